@@ -5,7 +5,6 @@ from datetime import datetime
 from pathlib import Path
 import logging
 from queue import Queue
-from threading import Event
 
 from flask import Flask, jsonify, request
 from flask_executor import Executor
@@ -13,8 +12,10 @@ from flask_executor import Executor
 import src.dataviewer.routes
 from src import dataviewer
 from src.ans_response_fetcher import AnsResponseFetcher
+from src.response_cache import SqliteCache
 
 from src.editdistance import main as ed_manager
+from src.editdistance.job_registry import JobRegistry
 
 name = __name__
 app = Flask(name)
@@ -30,18 +31,22 @@ def start_retrieval():
     data = request.get_json()
     logger.info("Starting retrieval")
 
-    stop_event = Event()
     job_queue = Queue()
 
     def retriever_task():
-        response_fetcher = AnsResponseFetcher(data["API_KEY"], DELAY, LIMIT)
-        response_fetcher.run(BASE_URL, data['ids'], BASE_DIR, responses_dir, None, job_queue)
+        try:
+            response_fetcher = AnsResponseFetcher(data["API_KEY"], DELAY, LIMIT, CONCURRENCY,
+                                                  CACHE_SIZE, http_cache, CACHE_MEMORY * 2 ** 20)
+            response_fetcher.run(BASE_URL, data['ids'], BASE_DIR, responses_dir, None, job_queue, result_dir)
+        finally:
+            # no more jobs will be put on the queue, this ends the computation loop
+            job_queue.put(None)
         logger.info("Retrieval of responses finished. Continuing with names.")
         response_fetcher.fetch_unknown_names(responses_dir, BASE_URL)
-        stop_event.set()
+        dataviewer.responses.update_manifest()
 
     def computation_task():
-        ed_manager.start(executor, result_dir, stop_event, job_queue, name)
+        ed_manager.start(executor, result_dir, job_queue, name, job_registry, process_pool, INCREMENTAL)
         logger.info("All computation jobs started")
 
     executor.submit(retriever_task)
@@ -61,6 +66,22 @@ if __name__ == '__main__':
                         help="The delay between api calls.")
     parser.add_argument("-pl", "--pagelimit", required=False, default=20, type=int,
                         help="The page size limit to use when using the ANS api.")
+    parser.add_argument("-c", "--concurrency", required=False, default=1, type=int,
+                        help="The number of results that are retrieved from ANS concurrently. "
+                             "All of them together still respect the delay between api calls.")
+    parser.add_argument("-w", "--workers", required=False, default=0, type=int,
+                        help="The number of worker processes that compute the edit distances. "
+                             "If 0, the computations run in threads of the web server process.")
+    parser.add_argument("--incremental", required=False, default=False, action="store_true",
+                        help="Keep the factorization state of each response, "
+                             "so a re-fetched response only factorizes its new snapshots.")
+    parser.add_argument("-cs", "--cachesize", required=False, default=1024, type=int,
+                        help="The maximum number of api responses that are kept in memory while retrieving.")
+    parser.add_argument("-cm", "--cachememory", required=False, default=64, type=int,
+                        help="The maximum number of megabytes of api responses that are kept in memory while retrieving.")
+    parser.add_argument("-ct", "--cachettl", required=False, default=24, type=float,
+                        help="The number of hours that assignment, exercise, question and course information "
+                             "is kept on disk, so it is reused by later retrievals. If 0, it is not kept.")
     parser.add_argument("--debug", required=False, default=False, action="store_true",
                         help="Will log more verbosely. For debug purposes.")
 
@@ -82,6 +103,32 @@ if __name__ == '__main__':
         print(f"Invalid limit: {LIMIT}. Should be between 0 (excluded) and 100 (included).")
         exit(1)
 
+    CONCURRENCY = args.concurrency
+    if CONCURRENCY < 1:
+        print(f"Concurrency should >= 1. Was: {CONCURRENCY}.")
+        exit(1)
+
+    WORKERS = args.workers
+    if WORKERS < 0:
+        print(f"Number of workers should >= 0. Was: {WORKERS}.")
+        exit(1)
+
+    CACHE_SIZE = args.cachesize
+    if CACHE_SIZE < 0:
+        print(f"Cache size should >= 0. Was: {CACHE_SIZE}.")
+        exit(1)
+
+    CACHE_MEMORY = args.cachememory
+    if CACHE_MEMORY < 0:
+        print(f"Cache memory should >= 0. Was: {CACHE_MEMORY}.")
+        exit(1)
+
+    CACHE_TTL = args.cachettl
+    if CACHE_TTL < 0:
+        print(f"Cache ttl should >= 0. Was: {CACHE_TTL}.")
+        exit(1)
+
+    INCREMENTAL = args.incremental
     DEBUG = args.debug
     BASE_URL = args.server
 
@@ -102,16 +149,31 @@ if __name__ == '__main__':
                 f"with debug mode {'ON' if DEBUG else 'OFF'}.\n"
                 f"Delay of {DELAY} seconds.\n"
                 f"Page size limit is {LIMIT}.\n"
+                f"Retrieving {CONCURRENCY} results concurrently.\n"
                 f"Server url is {BASE_URL}\n"
+                f"Number of worker processes is {WORKERS}.\n"
+                f"Incremental factorization is {'ON' if INCREMENTAL else 'OFF'}.\n"
+                f"Keeping {CACHE_SIZE} api responses of at most {CACHE_MEMORY} MB in memory, "
+                f"and metadata on disk for {CACHE_TTL} hours.\n"
                 )
 
     # initialize and start app
-    dataviewer.init(responses_dir, result_dir, user_dir, executor)
+    job_registry = JobRegistry(user_dir / 'jobs.sqlite')
+    dataviewer.init(responses_dir, result_dir, user_dir, executor, job_registry)
+    process_pool = ed_manager.create_process_pool(WORKERS)
+    http_cache = SqliteCache(user_dir / 'http_cache.sqlite', CACHE_TTL * 3600) if CACHE_TTL > 0 else None
 
     try:
         app.run(debug=DEBUG, port=port)
     except KeyboardInterrupt:
         logger.info('Shutting down Unified Response Viewer.')
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown(wait=False, cancel_futures=True)
+        ed_manager.stop_writer(timeout=30)
+        job_registry.close()
+        if http_cache is not None:
+            http_cache.close()
 
 
 
@@ -1,16 +1,26 @@
 import pickle
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from queue import Queue
 from threading import Event
 from typing import List, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 import os
-import time
 import logging
 
+from src import metrics
+from src.editdistance import lsh_index, result_store
+from src.rate_limiter import TokenBucket
+from src.response_cache import CachedResponse, LRUCache, SqliteCache
+from src.retrieval_journal import RetrievalJournal
+
 logger = logging.getLogger()
 
+JOURNAL_NAME = 'retrieval_journal.jsonl'
+
 
 def unpack_ids(ids: list[int]) -> tuple[int, int | None, int | None, int | None]:
     """
@@ -89,50 +99,90 @@ class AnsResponseFetcher:
     The ANS api can be found at https://ans.app/api/docs/index.html.
     """
 
-    def __init__(self, api_key: str, delay: float = 0.2, limit: int = 20):
+    def __init__(self, api_key: str, delay: float = 0.2, limit: int = 20, workers: int = 1,
+                 cache_size: int = 1024, persistent_cache: SqliteCache | None = None,
+                 cache_bytes: int = 64 * 2 ** 20):
         """
         Constructor.
         :param api_key: your API key for the ANS api
-        :param delay: the delay in seconds between each request
+        :param delay: the average delay in seconds between requests, shared by all workers
         :param limit: the page limit used by the ANS api
+        :param workers: the number of results of an assignment that are retrieved concurrently
+        :param cache_size: the maximum number of responses that are kept in memory
+        :param persistent_cache: optional on-disk cache for metadata that does not change between runs,
+                                 such as exercises, questions, assignments and courses
+        :param cache_bytes: the maximum total size in bytes of the responses that are kept in memory
         """
-        self.last_request_time = 0
         self.LIMIT = limit
         self.DELAY = delay
+        self.WORKERS = max(1, workers)
         self.prefices = ["assignment", "results", "submissions", "response"]
         self.request_header = {
             'Authorization': f"Bearer {api_key}"
         }
-        self._response_cache = {}
+        self.rate_limiter = TokenBucket(delay)
+
+        # one pooled session, so connections are kept alive between requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.WORKERS, pool_maxsize=self.WORKERS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._response_cache = LRUCache(cache_size, cache_bytes)
+        self._persistent_cache = persistent_cache
+        self.journal: RetrievalJournal | None = None
+        self.result_dir: Path | None = None
         # Categories that indicate open-ended questions we want to analyze
         # These can be found at https://ans.app/api/docs/v2/swagger.yaml (ctrl+f "description: An open question" to jump to the relevant section)
         self.OPEN_QUESTION_CATEGORIES = {"open", "code"}
 
-    def _cached_get(self, url: str) -> tuple[dict | list | None, dict]:
+    def _cached_get(self, url: str, persist: bool = False) -> CachedResponse:
         """
         Performs a GET request with in-memory caching and rate-limit handling.
         Returns a tuple of (json_data, headers).
+
+        :param url: the url to get
+        :param persist: whether the response may also be kept in the persistent cache.
+                        Only use this for responses that do not change between runs,
+                        the logs of responses for example grow when students continue working.
         """
-        if url in self._response_cache:
-            return self._response_cache[url]
+        cached = self._response_cache.get(url)
+        if cached is None and persist and self._persistent_cache is not None:
+            cached = self._persistent_cache.get(url)
+            if cached is not None:
+                self._response_cache.put(url, cached)
 
-        self._wait_if_required()
-        response = requests.get(url, headers=self.request_header)
-        self.last_request_time = time.time()
+        if cached is not None:
+            metrics.count('http_cache_hits')
+            return cached
+
+        response = self._get(url)
 
         if response.status_code == 429:
+            metrics.count('http_rate_limited')
             logger.warning(f"Got back HTTP 429 for {url}; sleeping for 10 seconds...")
-            time.sleep(10)
-            return self._cached_get(url)
+            self.rate_limiter.pause(10)
+            return self._cached_get(url, persist)
 
         response.raise_for_status()
         data = response.json()
         headers = response.headers  # Keep as CaseInsensitiveDict
         
         # Cache the result
-        self._response_cache[url] = (data, headers)
+        self._response_cache.put(url, (data, headers), len(response.content))
+        if persist and self._persistent_cache is not None:
+            self._persistent_cache.put(url, (data, headers))
         return data, headers
 
+    def _get(self, url: str) -> requests.Response:
+        """
+        Send a GET request with the pooled session, once the rate limiter allows it.
+        """
+        self._wait_if_required()
+        metrics.count('http_requests')
+        with metrics.timed('http_request'):
+            return self.session.get(url, headers=self.request_header)
+
     def fetch_unknown_names(self, response_dir: Path, base_url: str):
 
         logger.info("Retrieving names...")
@@ -151,49 +201,27 @@ class AnsResponseFetcher:
 
             assignmentyear = "[YEAR]"
 
-            # Fetch the year in which the assignment was used, to append to the name
+            # Fetch the year in which the assignment was used, to append to the name.
+            # The assignment and course are the same for every question of the assignment, so they are cached.
             try:
-                self._wait_if_required()
                 assignment_info_url = f"{base_url}/assignments/{as_id}"
-                response = requests.get(
-                    assignment_info_url, headers=self.request_header)
-                self.last_request_time = time.time()
+                resp_json, _ = self._cached_get(assignment_info_url, persist=True)
 
-                # if we receive HTTP 429 (Too many requests), wait before retrying
-                if response.status_code == 429:
-                    logger.warning(
-                        "Got back HTTP 429; sleeping for 10 seconds...")
-                    time.sleep(10)
-                    return
-
-                elif response.status_code == 200:
-                    resp_json = response.json()
-
-                    self._wait_if_required()
-                    course_id = resp_json['course_id']
-                    course_info_url = f"{base_url}/courses/{course_id}"
-                    courseresponse = requests.get(
-                        course_info_url, headers=self.request_header)
-                    self.last_request_time = time.time()
+                course_id = resp_json['course_id']
+                course_info_url = f"{base_url}/courses/{course_id}"
+                cresp_json, _ = self._cached_get(course_info_url, persist=True)
 
-                    if courseresponse.status_code == 200:
-                        cresp_json = courseresponse.json()
-
-                        if str(cresp_json['course_code']) != "None":
-                            assignmentyear = " (" + str(cresp_json['year']) + " " + str(
-                                cresp_json['course_code']) + ")"
-
-                        else:
-                            assignmentyear = " (" + \
-                                str(cresp_json['year']) + ")"
-
-                    else:
-                        logger.warn(
-                            f"Unknown status code in second stage while retrieving year for course {course_id}. Code: {courseresponse.status_code}")
+                if str(cresp_json['course_code']) != "None":
+                    assignmentyear = " (" + str(cresp_json['year']) + " " + str(
+                        cresp_json['course_code']) + ")"
 
                 else:
-                    logger.warn(
-                        f"Unknown status code while retrieving year for assignment {as_id}. Code: {response.status_code}")
+                    assignmentyear = " (" + \
+                        str(cresp_json['year']) + ")"
+
+            except (requests.HTTPError, requests.exceptions.HTTPError) as e:
+                logger.warn(
+                    f"Unknown status code while retrieving year for assignment {as_id}. Code: {e.response.status_code}")
 
             except Exception as e:
                 logger.warn(
@@ -202,24 +230,11 @@ class AnsResponseFetcher:
             def retrieve(url, filepath, key, uniqueID):
                 try:
                     if not filepath.exists():
-                        self._wait_if_required()
-                        response = requests.get(
-                            url, headers=self.request_header)
-                        self.last_request_time = time.time()
-
-                        # if we receive HTTP 429 (Too many requests), wait before retrying
-                        if response.status_code == 429:
-                            logger.warning(
-                                "Got back HTTP 429; sleeping for 30 seconds...")
-                            time.sleep(30)
-                            return
-
-                        if response.status_code == 200:
-                            resp_json = response.json()
-                            with open(filepath, 'w') as file:
-                                # Write the name, append the ID of the relevant object to make them unique. This is necessary to parse the dropdowns unambiguously.
-                                file.write(
-                                    str(resp_json[key]) + assignmentyear + " [" + uniqueID + "]")
+                        resp_json, _ = self._cached_get(url, persist=True)
+                        with open(filepath, 'w') as file:
+                            # Write the name, append the ID of the relevant object to make them unique. This is necessary to parse the dropdowns unambiguously.
+                            file.write(
+                                str(resp_json[key]) + assignmentyear + " [" + uniqueID + "]")
 
                 except Exception as e:
                     logger.warn(
@@ -290,13 +305,12 @@ class AnsResponseFetcher:
 
     def _wait_if_required(self):
         """
-        Sleep til 'self.DELAY' time has passed since 'self.last_request_time'
+        Sleep until the rate limiter, which allows one request per 'self.DELAY' seconds on average, has a token.
         """
-        time_diff = time.time() - self.last_request_time
-        if time_diff < self.DELAY:
-            time_to_sleep = self.DELAY - time_diff
-            logger.debug(f"Sleeping for {time_to_sleep} seconds...")
-            time.sleep(time_to_sleep)
+        time_slept = self.rate_limiter.acquire()
+        metrics.observe('rate_limit_wait', time_slept)
+        if time_slept > 0:
+            logger.debug(f"Slept for {time_slept} seconds...")
 
     def _get_relevant_questions(self, base_url: str, assignment_id: int) -> dict[int, str | None]:
         """
@@ -313,7 +327,7 @@ class AnsResponseFetcher:
         try:
             # List all exercises for the assignment
             exercises_url = f"{base_url}/assignments/{assignment_id}/exercises"
-            exercises, _ = self._cached_get(exercises_url)
+            exercises, _ = self._cached_get(exercises_url, persist=True)
 
             for exercise in exercises:
                 exercise_id = exercise["id"]
@@ -323,7 +337,7 @@ class AnsResponseFetcher:
                 total_pages = 1
                 while cur_page <= total_pages:
                     questions_url = f"{base_url}/exercises/{exercise_id}/questions?limit={self.LIMIT}&page={cur_page}"
-                    questions, q_headers = self._cached_get(questions_url)
+                    questions, q_headers = self._cached_get(questions_url, persist=True)
 
                     # Update pagination
                     total_pages = int(q_headers.get("Total-Pages", 1))
@@ -344,9 +358,10 @@ class AnsResponseFetcher:
 
         return interesting_questions
 
-    def _get_history_count(self, base_url: str, response_id: int) -> int:
+    def _get_history_count(self, base_url: str, response_id: int) -> int | None:
         """
         Checks the number of history entries for a response.
+        Returns None if the history could not be retrieved.
         """
         try:
             url = f"{base_url}/logs/responses/{response_id}"
@@ -356,7 +371,7 @@ class AnsResponseFetcher:
         except Exception as e:
             logger.warning(
                 f"Failed to probe history for response {response_id}: {e}")
-            return 0
+            return None
 
     def _filter_for_original(self, base_url: str, user_results: list[dict], relevant_questions: dict[int, str | None]) -> int | None:
         """
@@ -395,7 +410,7 @@ class AnsResponseFetcher:
                                 base_url, resp["id"])
                             
                             print(f"History count for response {resp['id']} (question {q_id}): {count}")
-                            if count > current_res_max:
+                            if count is not None and count > current_res_max:
                                 current_res_max = count
 
                             # If we found any real history, this is the original out of the peer-review duplicates, so we can stop checking
@@ -504,7 +519,8 @@ class AnsResponseFetcher:
                             "changes": {"content": predefined_answer},
                             "is_artificial": True
                         }
-                        resp_json.insert(0, artificial_entry)
+                        # not inserted in place, the list is also held by the response cache
+                        resp_json = [artificial_entry] + resp_json
 
                 # extract the data that we are interested in
                 if get_ids:
@@ -548,6 +564,185 @@ class AnsResponseFetcher:
 
         return True, return_data, current_exercise, current_question, base_path, rel_path
 
+    def _retrieve_result(self, base_url: str, assignment_id: int, result_id: int,
+                         relevant_questions: dict[int, str | None], job_queue: Queue,
+                         stop_event: Event) -> tuple[int, list[str]]:
+        """
+        Get all responses of a single result and queue them as one batch.
+
+        :param base_url: the url of the api to query
+        :param assignment_id: the id of the assignment the result is part of
+        :param result_id: the id of the result to get
+        :param relevant_questions: the open and code questions of the assignment, with their predefined answers
+        :param job_queue: the queue to put the responses on after they are retrieved
+        :param stop_event: the event to stop getting responses
+
+        :return: Tuple (nr_responses_retrieved, failed), see _main_loops.
+        """
+        nr_responses_retrieved = 0
+        failed = []
+
+        if stop_event.is_set():
+            return nr_responses_retrieved, failed
+
+        if self.journal.is_result_done(assignment_id, result_id):
+            logger.info(f"   Skipping result {result_id}, it was retrieved before the retrieval was interrupted.")
+            return nr_responses_retrieved, failed
+
+        url = f"{base_url}/results/{result_id}"
+        was_successful, submission_data, _, _, _, _ = self._fetch_and_write(url, self.result_path,
+                                                                            self.request_header,
+                                                                            [assignment_id,
+                                                                             result_id],
+                                                                            interested_in="submissions")
+
+        if not was_successful:
+            failed.append(submission_data)
+            return nr_responses_retrieved, failed
+        logger.info(f"   Retrieved result {result_id}.")
+
+        # Collect all response paths for this (assignment_id, result_id) pair
+        result_response_paths = []
+        # whether any response of this result is new or has a longer history than when it was last written
+        has_changed = False
+
+        for submission in submission_data:
+            if stop_event.is_set():
+                break
+
+            submission_id = submission["id"]
+            current_question = submission.get("question_id", -1)
+            current_exercise = submission.get("exercise_id", -1)
+
+            # Filter: only process open-ended and code questions using pre-fetched metadata
+            if current_question != -1 and current_question not in relevant_questions:
+                logger.info(
+                    f"      Skipping submission {submission_id} - question {current_question} is not an open/code question.")
+                continue
+
+            url = f"{base_url}/submissions/{submission_id}"
+            # responses will contain full response objects
+            was_successful, responses, _, _, _, _ = (
+                self._fetch_and_write(url,
+                                      self.submission_path,
+                                      self.request_header,
+                                      [
+                                          assignment_id,
+                                          result_id,
+                                          submission_id
+                                      ],
+                                      interested_in="responses")
+            )
+            response_path = self.base_response_path.joinpath(
+                f"{assignment_id}/{current_exercise}/{current_question}")
+
+            if not was_successful:
+                failed.append(responses)
+                continue
+            logger.info(
+                f"      Retrieved submission {submission_id}.")
+
+            for response in responses:
+                if stop_event.is_set():
+                    break
+
+                response_id = response["id"]
+
+                # only write the history again if it grew since it was last written,
+                # if the history count could not be retrieved it is written again to be sure
+                history_count = self._get_history_count(base_url, response_id)
+                known_count = self.journal.history_count(response_id)
+                pickle_path = response_path / f"{response_id}.pickle"
+                if (history_count is not None and known_count is not None and history_count <= known_count
+                        and pickle_path.exists()):
+                    base_path = response_path.parent.parent.parent
+                    result_response_paths.append({
+                        'base_path': base_path,
+                        'rel_file_path': pickle_path.relative_to(base_path)
+                    })
+                    logger.info(
+                        f"         Response {response_id} is unchanged.")
+                    continue
+
+                url = f"{base_url}/logs/responses/{response_id}"
+                # Get the predefined answer for this question
+                p_answer = relevant_questions.get(current_question)
+                fetch_successful, resp_data, _, _, base_path, rel_path = self._fetch_and_write(url,
+                                                                                               response_path,
+                                                                                               self.request_header,
+                                                                                               [assignment_id, result_id,
+                                                                                                submission_id, response_id],
+                                                                                               has_pages=False,
+                                                                                               get_ids=False,
+                                                                                               job_queue=None,  # Don't queue individually
+                                                                                               should_queue=False,
+                                                                                               should_write=True,
+                                                                                               predefined_answer=p_answer)
+
+                if not fetch_successful:
+                    failed.append(resp_data)
+                    continue
+                if history_count is not None:
+                    self.journal.mark_response(response_id, history_count)
+                has_changed = True
+
+                # keep the near-duplicate index of the question up to date
+                try:
+                    lsh_index.update(self.base_response_path,
+                                     [assignment_id, current_exercise, current_question, response_id])
+                except Exception as e:
+                    logger.warning(f"Could not add response {response_id} to the near-duplicate index: {e}")
+                # Store the path for batch processing
+                if base_path is not None and rel_path is not None:
+                    result_response_paths.append({
+                        'base_path': base_path,
+                        'rel_file_path': rel_path
+                    })
+
+                nr_responses_retrieved += 1
+                logger.info(
+                    f"         Retrieved response {response_id}.")
+
+        # a response whose history was written in an earlier run may have no result yet,
+        # if that run was interrupted before its batch was written
+        if not has_changed and result_response_paths:
+            has_changed = self._has_missing_results(assignment_id, result_response_paths)
+
+        is_done = not failed and not stop_event.is_set()
+
+        # Queue all responses for this (assignment_id, result_id) as a batch,
+        # the unchanged responses are included since the batch is computed as a whole
+        if has_changed and result_response_paths and job_queue is not None:
+            job_queue.put({
+                'assignment_id': assignment_id,
+                'result_id': result_id,
+                'response_paths': result_response_paths,
+                # the result is only done once its batch is written, an interrupted run retrieves it again
+                'on_written': partial(self.journal.mark_result_done, assignment_id, result_id) if is_done else None
+            })
+            logger.info(
+                f"   Queued batch of {len(result_response_paths)} responses for assignment {assignment_id}, result {result_id}.")
+        elif is_done:
+            self.journal.mark_result_done(assignment_id, result_id)
+
+        return nr_responses_retrieved, failed
+
+    def _has_missing_results(self, assignment_id: int, response_paths: list[dict]) -> bool:
+        """
+        Whether any of the responses has no computed result in the result directory.
+        Always False if the result directory is not known.
+        """
+        if self.result_dir is None:
+            return False
+
+        index = result_store.read_index(self.result_dir, assignment_id)
+        for response_info in response_paths:
+            ids = result_store.ids_from_rel_path(response_info['rel_file_path'])
+            if ids[3] not in index and not result_store.has_result(self.result_dir, ids):
+                return True
+
+        return False
+
     def _main_loops(self, base_url: str,
                     assignment_ids: list[int] | tuple[int],
                     job_queue: Queue,
@@ -579,6 +774,9 @@ class AnsResponseFetcher:
                 logger.info(
                     f"--- Starting retrieval of assignment {assignment_id} ---")
 
+                if self.journal.start_assignment(assignment_id):
+                    logger.info(f"Resuming the interrupted retrieval of assignment {assignment_id}.")
+
                 # Pre-fetch relevant questions for this assignment
                 relevant_questions = self._get_relevant_questions(
                     base_url, assignment_id)
@@ -616,104 +814,25 @@ class AnsResponseFetcher:
                 logger.info(
                     f"Retrieved and filtered {len(result_ids)} unique results for assignment {assignment_id}.")
 
-                for result_id in result_ids:
-                    if stop_event.is_set():
-                        break
+                # retrieve the results concurrently, all workers share the rate limiter
+                with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+                    futures = [pool.submit(self._retrieve_result, base_url, assignment_id, result_id,
+                                           relevant_questions, job_queue, stop_event)
+                               for result_id in result_ids]
 
-                    url = f"{base_url}/results/{result_id}"
-                    was_successful, submission_data, _, _, _, _ = self._fetch_and_write(url, self.result_path,
-                                                                                        self.request_header,
-                                                                                        [assignment_id,
-                                                                                         result_id],
-                                                                                        interested_in="submissions")
-
-                    if not was_successful:
-                        failed.append(submission_data)
-                        continue
-                    logger.info(f"   Retrieved result {result_id}.")
-
-                    # Collect all response paths for this (assignment_id, result_id) pair
-                    result_response_paths = []
-
-                    for submission in submission_data:
-                        if stop_event.is_set():
-                            break
-
-                        submission_id = submission["id"]
-                        current_question = submission.get("question_id", -1)
-                        current_exercise = submission.get("exercise_id", -1)
-
-                        # Filter: only process open-ended and code questions using pre-fetched metadata
-                        if current_question != -1 and current_question not in relevant_questions:
-                            logger.info(
-                                f"      Skipping submission {submission_id} - question {current_question} is not an open/code question.")
-                            continue
-
-                        url = f"{base_url}/submissions/{submission_id}"
-                        # responses will contain full response objects
-                        was_successful, responses, _, _, _, _ = (
-                            self._fetch_and_write(url,
-                                                  self.submission_path,
-                                                  self.request_header,
-                                                  [
-                                                      assignment_id,
-                                                      result_id,
-                                                      submission_id
-                                                  ],
-                                                  interested_in="responses")
-                        )
-                        response_path = self.base_response_path.joinpath(
-                            f"{assignment_id}/{current_exercise}/{current_question}")
-
-                        if not was_successful:
-                            failed.append(responses)
-                            continue
-                        logger.info(
-                            f"      Retrieved submission {submission_id}.")
+                    assignment_failed = []
+                    for future in futures:
+                        result_nr_retrieved, result_failed = future.result()
+                        nr_responses_retrieved += result_nr_retrieved
+                        assignment_failed += result_failed
 
-                        for response in responses:
-                            if stop_event.is_set():
-                                break
+                failed += assignment_failed
+                if stop_event.is_set():
+                    break
 
-                            response_id = response["id"]
-                            url = f"{base_url}/logs/responses/{response_id}"
-                            # Get the predefined answer for this question
-                            p_answer = relevant_questions.get(current_question)
-                            fetch_successful, resp_data, _, _, base_path, rel_path = self._fetch_and_write(url,
-                                                                                                           response_path,
-                                                                                                           self.request_header,
-                                                                                                           [assignment_id, result_id,
-                                                                                                            submission_id, response_id],
-                                                                                                           has_pages=False,
-                                                                                                           get_ids=False,
-                                                                                                           job_queue=None,  # Don't queue individually
-                                                                                                           should_queue=False,
-                                                                                                           should_write=True,
-                                                                                                           predefined_answer=p_answer)
-
-                            if not fetch_successful:
-                                failed.append(resp_data)
-                                continue
-                            # Store the path for batch processing
-                            if base_path is not None and rel_path is not None:
-                                result_response_paths.append({
-                                    'base_path': base_path,
-                                    'rel_file_path': rel_path
-                                })
-
-                            nr_responses_retrieved += 1
-                            logger.info(
-                                f"         Retrieved response {response_id}.")
-
-                    # Queue all responses for this (assignment_id, result_id) as a batch
-                    if result_response_paths and job_queue is not None:
-                        job_queue.put({
-                            'assignment_id': assignment_id,
-                            'result_id': result_id,
-                            'response_paths': result_response_paths
-                        })
-                        logger.info(
-                            f"   Queued batch of {len(result_response_paths)} responses for assignment {assignment_id}, result {result_id}.")
+                # a run with failures is resumed the next time, so only the failed results are retrieved again
+                if not assignment_failed:
+                    self.journal.finish_assignment(assignment_id)
 
                 logger.info(f"--- Finished assignment {assignment_id} ---")
         except KeyboardInterrupt:
@@ -800,7 +919,8 @@ class AnsResponseFetcher:
             base_dir: Path | str = None,
             base_out_dir: Path | str = "./out",
             paths: list[Path | str] | tuple[Path | str] = None,
-            job_queue: Queue = None) -> None:
+            job_queue: Queue = None,
+            result_dir: Path | str = None) -> None:
         """
         Query the 'base_url' endpoints for the all responses of the assignments in 'ids'
 
@@ -812,6 +932,8 @@ class AnsResponseFetcher:
                 Should be ordered as: [assignments, results, submissions, responses].
                 Default: ['./other/assignments', './other/results', './other/submissions', '.']
         :param job_queue: The job queue to use
+        :param result_dir: The root directory of the computed results. If given, the responses of a result that
+                           have no computed result are queued again, also if their histories did not change.
         """
         if job_queue is None:
             raise ValueError("Job queue is None.")
@@ -822,10 +944,13 @@ class AnsResponseFetcher:
         if not base_out_dir.is_absolute():
             base_out_dir = (base_dir / base_out_dir).resolve()
 
+        self.result_dir = Path(result_dir).resolve() if result_dir is not None else None
+
         nr_responses_retrieved, failed = 0, []
         try:
             # setup directories
             self._setup_output_dirs(base_out_dir, paths, False)
+            self.journal = RetrievalJournal(self.base_response_path / JOURNAL_NAME)
 
             # fetch the responses
             nr_responses_retrieved, failed = self._main_loops(base_url=base_url,
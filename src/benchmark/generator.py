@@ -0,0 +1,170 @@
+import os
+import pickle
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# The kinds of answers a history can be generated for
+KINDS = ('text', 'html', 'code')
+
+# The chance that the next snapshot of a history is made by each edit
+EDIT_WEIGHTS = {
+    'type': 0.6,
+    'delete': 0.15,
+    'paste': 0.05,
+    'autosave': 0.2
+}
+
+# The number of characters of a large paste
+PASTE_LENGTH = (200, 2000)
+
+_WORDS = ('the', 'algorithm', 'computes', 'a', 'suffix', 'array', 'of', 'every', 'snapshot', 'and', 'then',
+          'factorization', 'is', 'used', 'to', 'find', 'copied', 'text', 'in', 'student', 'answers', 'which',
+          'are', 'compared', 'with', 'each', 'other', 'because', 'time', 'complexity', 'linear', 'memory',
+          'question', 'result', 'response', 'log', 'edit', 'distance', 'between', 'two', 'versions', 'data')
+
+_IDENTIFIERS = ('i', 'j', 'n', 'sa', 'lcp', 'rank', 'word', 'result', 'total', 'values', 'index', 'count')
+
+_START = datetime(2025, 1, 1, 9, 0, tzinfo=timezone.utc)
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(4, 14))]
+    return ' '.join(words).capitalize() + '. '
+
+
+def _code_line(rng: random.Random) -> str:
+    indent = '    ' * rng.randint(0, 2)
+    a, b = rng.choice(_IDENTIFIERS), rng.choice(_IDENTIFIERS)
+    line = rng.choice((
+        f"{a} = {b} + {rng.randint(0, 9)}",
+        f"for {a} in range({b}):",
+        f"if {a} < {b}:",
+        f"{a}.append({b}[{rng.randint(0, 9)}])",
+        f"return {a}"
+    ))
+    return indent + line + '\n'
+
+
+def _fragment(rng: random.Random, kind: str, length: int) -> str:
+    """
+    Text of about 'length' characters, like what a student would type or paste in an answer of this kind.
+    """
+    parts = []
+    size = 0
+    while size < length:
+        part = _code_line(rng) if kind == 'code' else _sentence(rng)
+        parts.append(part)
+        size += len(part)
+
+    return ''.join(parts)[:length]
+
+
+def _render(text: str, kind: str) -> str:
+    """
+    The content of a snapshot as the ANS api returns it, answers that are not code are wrapped in html.
+    """
+    if kind == 'text':
+        return text
+    if kind == 'code':
+        return f"<pre><code>{text}</code></pre>"
+
+    paragraphs = text.split('. ')
+    return ''.join(f"<p>{p}</p>" if i % 3 else f"<p><strong>{p}</strong></p>" for i, p in enumerate(paragraphs))
+
+
+def _timestamp(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z"
+
+
+def generate_history(rng: random.Random, n_snapshots: int, kind: str = 'text',
+                     predefined_answer: str | None = None, start: datetime = _START) -> list[dict]:
+    """
+    Generate the version history of one response, like the fetcher writes it.
+    Every snapshot is made by typing a few characters, deleting a range, pasting a large block
+    or saving again without changes, see EDIT_WEIGHTS.
+
+    :param rng: the random generator, seed it to get the same history every time
+    :param n_snapshots: the number of snapshots, not counting the predefined answer
+    :param kind: the kind of answer, one of KINDS
+    :param predefined_answer: if given, it is inserted as artificial first snapshot, like the fetcher does
+    :param start: the time of the first snapshot
+    :return: the version history, a list of dicts with the keys 'timestamp' and 'changes'
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown kind of answer: {kind}, expected one of {KINDS}")
+
+    edits = list(EDIT_WEIGHTS)
+    weights = list(EDIT_WEIGHTS.values())
+
+    text = predefined_answer or ''
+    moment = start
+    history = []
+
+    if predefined_answer is not None:
+        history.append({
+            'timestamp': _timestamp(moment),
+            'changes': {'content': _render(predefined_answer, kind)},
+            'is_artificial': True
+        })
+
+    for _ in range(n_snapshots):
+        edit = rng.choices(edits, weights)[0] if text else 'type'
+
+        if edit == 'type':
+            position = rng.randint(0, len(text)) if rng.random() < 0.2 else len(text)
+            text = text[:position] + _fragment(rng, kind, rng.randint(1, 40)) + text[position:]
+            moment += timedelta(seconds=rng.uniform(1, 30))
+        elif edit == 'delete':
+            start_index = rng.randint(0, len(text) - 1)
+            text = text[:start_index] + text[start_index + rng.randint(1, 30):]
+            moment += timedelta(seconds=rng.uniform(1, 10))
+        elif edit == 'paste':
+            text += _fragment(rng, kind, rng.randint(*PASTE_LENGTH))
+            moment += timedelta(seconds=rng.uniform(0.5, 3))
+        else:
+            moment += timedelta(seconds=rng.uniform(0, 1))
+
+        history.append({
+            'timestamp': _timestamp(moment),
+            'changes': {'content': _render(text, kind)}
+        })
+
+    return history
+
+
+def generate_result(rng: random.Random, response_directory: Path, assignment_id: int, result_id: int,
+                    n_questions: int, n_snapshots: int) -> list[dict]:
+    """
+    Generate the responses of one result and write them like the fetcher does,
+    to 'response_directory/<assignment>/<exercise>/<question>/<response>.pickle'.
+    The histories of all questions overlap in time, like a student working on an exam.
+
+    :param rng: the random generator, seed it to get the same responses every time
+    :param response_directory: the root directory of the responses
+    :param assignment_id: the id of the assignment
+    :param result_id: the id of the result, the responses get the ids result_id * 1000 + question
+    :param n_questions: the number of questions, their kinds alternate between KINDS
+    :param n_snapshots: the number of snapshots of every response
+    :return: the response paths of the result, as the fetcher queues them for compute_edit_distances_batch
+    """
+    response_paths = []
+
+    for question in range(n_questions):
+        kind = KINDS[question % len(KINDS)]
+        predefined_answer = _fragment(rng, kind, 80) if rng.random() < 0.3 else None
+        start = _START + timedelta(seconds=rng.uniform(0, 600))
+        history = generate_history(rng, n_snapshots, kind, predefined_answer, start)
+        history[0]['result_id'] = result_id
+
+        rel_path = Path(str(assignment_id), str(question // 4), str(question), f"{result_id * 1000 + question}.pickle")
+        os.makedirs((response_directory / rel_path).parent, exist_ok=True)
+        with open(response_directory / rel_path, 'wb') as file:
+            pickle.dump(history, file)
+
+        response_paths.append({
+            'base_path': response_directory,
+            'rel_file_path': rel_path
+        })
+
+    return response_paths
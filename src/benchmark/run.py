@@ -0,0 +1,203 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from . import generator
+from ..editdistance.algorithms import edit_distance, lz77, snapshot_text, suffix_array_improved, suffix_array_naive, \
+    suffix_array_sais, text_encoding, util
+
+# The number of snapshots of every response. Every snapshot contains the whole answer so far,
+# so the word of a result grows about quadratically with it.
+SIZES = (10, 20, 40)
+
+# The number of responses (questions) of the generated result
+N_QUESTIONS = 6
+
+# The number of times every stage is run, the fastest and the mean time are reported
+REPEAT = 3
+
+# The naive suffix array copies every suffix, above this length it needs too much time and memory
+NAIVE_MAX_LENGTH = 5000
+
+# The kernels that are no longer used by any backend are left out above this length
+LEGACY_MAX_LENGTH = 100000
+
+# The legacy string kernels get the separators as private use characters, of which there are only this many
+_PRIVATE_USE_START = 0xF0000
+_PRIVATE_USE_COUNT = 0x10FFFD - _PRIVATE_USE_START
+
+
+def _time(function, *args, repeat: int = REPEAT) -> dict:
+    """
+    Run function(*args) 'repeat' times.
+
+    :return: dict with the fastest and the mean time in seconds, and the number of runs
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+
+    return {
+        'min': min(times),
+        'mean': statistics.fmean(times),
+        'runs': repeat
+    }
+
+
+def _legacy_word(codes: np.ndarray, is_separator: np.ndarray) -> str | None:
+    """
+    The encoded snapshots as a string for the kernels that take a string,
+    or None if there are more separators than private use characters.
+    """
+    n_separators = int(is_separator.sum())
+    if n_separators > _PRIVATE_USE_COUNT:
+        return None
+
+    codes = codes.astype(np.uint32)
+    codes[is_separator] = _PRIVATE_USE_START + np.arange(n_separators, dtype=np.uint32)
+
+    return codes.tobytes().decode('utf-32-le')
+
+
+def _largest_response(response_paths: list[dict]) -> Path:
+    return max((r['base_path'] / r['rel_file_path'] for r in response_paths), key=lambda p: p.stat().st_size)
+
+
+def benchmark_size(response_directory: Path, result_directory: Path, seed: int, n_questions: int,
+                   n_snapshots: int, repeat: int = REPEAT) -> list[dict]:
+    """
+    Time every stage of the edit distance computation on one generated result.
+
+    :param response_directory: where the generated responses are written
+    :param result_directory: where the results of compute_edit_distances_batch are written
+    :param seed: the seed of the generator
+    :param n_questions: the number of responses of the result
+    :param n_snapshots: the number of snapshots of every response
+    :param repeat: the number of times every stage is run
+    :return: list of dicts with the keys 'stage', 'backend', 'n_snapshots', 'length', 'min', 'mean' and 'runs'
+    """
+    rng = random.Random(seed)
+    response_paths = generator.generate_result(rng, response_directory, 1, 1, n_questions, n_snapshots)
+
+    # strip the html once, so the text files are there like after a retrieval
+    for r in response_paths:
+        snapshot_text.load_history(r['base_path'] / r['rel_file_path'])
+
+    codes, is_separator, _ = util.extract_all_snapshots_sorted(response_paths, response_directory)
+    n = len(codes)
+    separation_indices = np.flatnonzero(is_separator).tolist()
+
+    records = []
+
+    def add(stage: str, backend: str | None, function, *args):
+        timing = _time(function, *args, repeat=repeat)
+        records.append({'stage': stage, 'backend': backend, 'n_snapshots': n_snapshots, 'length': n, **timing})
+        print(f"  {stage:<30} {backend or '':<10} {timing['min'] * 1000:10.2f} ms")
+
+    version_history, texts = snapshot_text.load_history(_largest_response(response_paths))
+    add('extract_content', None, util.extract_content, version_history, True, texts)
+
+    sa = suffix_array_improved.improved_suffix_array_np(codes, n)
+    lcp = suffix_array_improved.compute_lcp_np(codes, sa, n)
+    sa_list = sa.tolist()
+
+    if n <= NAIVE_MAX_LENGTH:
+        add('naive_suffix_array', 'naive', suffix_array_naive.naive_suffix_array, codes.tolist(), n)
+
+    word = _legacy_word(codes, is_separator) if n <= LEGACY_MAX_LENGTH else None
+    if word is not None:
+        add('improved_suffix_array', 'legacy', suffix_array_improved.improved_suffix_array, word, n)
+        add('compute_lcp', 'legacy', suffix_array_improved.compute_lcp, word, sa_list, n)
+
+    add('improved_suffix_array', 'improved', suffix_array_improved.improved_suffix_array_np, codes, n)
+    add('compute_lcp', 'improved', suffix_array_improved.compute_lcp_np, codes, sa, n)
+
+    ranked, upper = suffix_array_sais.rank_codes(codes)
+    add('sais_suffix_array', 'sais', suffix_array_sais.sais_suffix_array, ranked, upper)
+    add('compute_lcp', 'sais', suffix_array_sais.compute_lcp, ranked, sa_list, n)
+
+    add('compute_lpf', 'legacy', lz77.compute_lpf, sa_list, lcp, n)
+    add('compute_lpf', 'compact', lz77.compute_lpf_compact, sa, lcp, n)
+
+    lpf = lz77.compute_lpf_compact(sa, lcp, n)
+    if n <= LEGACY_MAX_LENGTH:
+        add('compute_lz', 'legacy', lz77.compute_lz, lpf.tolist(), n, separation_indices)
+    add('compute_lz', 'bitmap', lz77.compute_lz_bitmap, lpf, n, is_separator)
+
+    for backend in edit_distance.word_alg_dict:
+        add('compute_edit_distances_batch', backend, edit_distance.compute_edit_distances_batch,
+            backend, response_directory, response_paths, result_directory, False)
+
+    return records
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=SIZES, n_questions: int = N_QUESTIONS, repeat: int = REPEAT, seed: int = 0) -> dict:
+    """
+    Run the benchmark for every size on freshly generated data.
+
+    :return: the report, with the environment under 'meta' and the timings under 'results', see benchmark_size
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as directory:
+        for n_snapshots in sizes:
+            print(f"{n_questions} responses of {n_snapshots} snapshots:")
+            results += benchmark_size(Path(directory) / str(n_snapshots) / 'responses',
+                                      Path(directory) / str(n_snapshots) / 'results',
+                                      seed, n_questions, n_snapshots, repeat)
+
+    return {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'seed': seed,
+            'n_questions': n_questions,
+            'repeat': repeat,
+            'separator_base': text_encoding.SEPARATOR_BASE
+        },
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m src.benchmark.run",
+                                     description="Time the stages of the edit distance computation on generated histories.")
+    parser.add_argument("-s", "--sizes", nargs='+', type=int, default=list(SIZES),
+                        help="The numbers of snapshots of every response to benchmark.")
+    parser.add_argument("-q", "--questions", type=int, default=N_QUESTIONS, help="The number of responses of the result.")
+    parser.add_argument("-r", "--repeat", type=int, default=REPEAT, help="The number of times every stage is run.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the history generator.")
+    parser.add_argument("-o", "--output", type=Path, default=Path("benchmark.json"),
+                        help="The JSON file the results are written to.")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.questions, args.repeat, args.seed)
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {len(report['results'])} timings to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,9 @@ from pathlib import Path
 
 from flask_executor import Executor
 
+from src.editdistance.job_registry import JobRegistry
 from . import routes, responses
 
 
-def init(response_dir: Path, results_dir: Path, user_dir: Path, ex: Executor):
-    responses.init(response_dir, results_dir, user_dir, ex)
\ No newline at end of file
+def init(response_dir: Path, results_dir: Path, user_dir: Path, ex: Executor, registry: JobRegistry | None = None):
+    responses.init(response_dir, results_dir, user_dir, ex, registry)
\ No newline at end of file
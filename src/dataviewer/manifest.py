@@ -0,0 +1,219 @@
+import logging
+import os
+import pickle
+import threading
+from pathlib import Path
+
+from src.editdistance import result_store
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.pickle'
+
+# Increase when the layout of the manifest changes, older manifests are then discarded.
+MANIFEST_VERSION = 1
+
+# The depth of the directories below the response directory: assignment, exercise and question.
+_QUESTION_DEPTH = 3
+
+
+def _new_manifest(response_dir: Path) -> dict:
+    return {
+        'version': MANIFEST_VERSION,
+        'response_dir': str(response_dir),
+        'assignments': {}
+    }
+
+
+def _new_node() -> dict:
+    return {
+        'mtime': None,
+        'name': None,
+        'children': {}
+    }
+
+
+def load(user_dir: Path, response_dir: Path) -> dict:
+    """
+    Load the manifest of 'response_dir' that was saved in 'user_dir'.
+
+    :return: the manifest, or an empty manifest if there is none or it is of an older version or another directory.
+    """
+    path = user_dir / MANIFEST_NAME
+
+    if path.exists():
+        try:
+            with open(path, 'rb') as file:
+                manifest = pickle.load(file)
+
+            if manifest.get('version') == MANIFEST_VERSION and manifest.get('response_dir') == str(response_dir):
+                return manifest
+        except Exception as e:
+            logger.warning(f"Could not load the manifest, rebuilding it. Exception: {e}")
+
+    return _new_manifest(response_dir)
+
+
+def save(user_dir: Path, manifest: dict):
+    """
+    Save the manifest in 'user_dir', the file is replaced atomically.
+    """
+    os.makedirs(user_dir, exist_ok=True)
+
+    path = user_dir / MANIFEST_NAME
+    # the retrieval and a reload can save at the same time, every save writes to a file of its own thread first
+    tmp_path = user_dir / f"{MANIFEST_NAME}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(manifest, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _read_name(directory: Path, default: str) -> str:
+    if (directory / 'name.txt').exists():
+        with open(directory / 'name.txt', 'r') as file:
+            return file.read()
+
+    return default
+
+
+def _update_node(node: dict | None, directory: Path, node_id: int, depth: int) -> tuple[dict, bool]:
+    """
+    Bring the node of 'directory' up to date. The directory is only listed again if its mtime changed,
+    which happens when files or directories are added to or removed from it.
+
+    :return: Tuple (node, changed), where changed is True if the node or any node below it was rescanned.
+    """
+    if node is None:
+        node = _new_node()
+
+    mtime = directory.stat().st_mtime_ns
+    changed = False
+
+    if node['mtime'] != mtime:
+        changed = True
+        node['mtime'] = mtime
+        node['name'] = _read_name(directory, str(node_id))
+
+        found = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if depth < _QUESTION_DEPTH:
+                    if entry.is_dir() and entry.name.isdigit():
+                        found.append(int(entry.name))
+                elif entry.is_file() and entry.name.endswith('.pickle') and entry.name[:-len('.pickle')].isdigit():
+                    found.append(int(entry.name[:-len('.pickle')]))
+
+        children = node['children']
+        node['children'] = {child_id: children.get(child_id) for child_id in found}
+
+    if depth < _QUESTION_DEPTH:
+        for child_id, child in node['children'].items():
+            node['children'][child_id], child_changed = _update_node(child, directory / str(child_id), child_id, depth + 1)
+            changed = changed or child_changed
+
+    return node, changed
+
+
+def _update_results(assignment: dict, assignment_id: int, result_dir: Path):
+    """
+    Read the max edit distance and number of versions of every response of an assignment from its result index.
+    """
+    index = result_store.read_index(result_dir, assignment_id)
+
+    for ex_id, exercise in assignment['children'].items():
+        for q_id, question in exercise['children'].items():
+            for resp_id in question['children']:
+                if resp_id in index:
+                    _, _, max_ed, n_versions = index[resp_id]
+                else:
+                    resultdata = result_store.read_legacy_result(result_dir, [assignment_id, ex_id, q_id, resp_id],
+                                                                 result_store.EMPTY_RESULT)
+                    max_ed, n_versions = resultdata["max"], len(resultdata["edit_distances"])
+
+                question['children'][resp_id] = (max_ed, n_versions)
+
+
+def update(manifest: dict, response_dir: Path, result_dir: Path) -> bool:
+    """
+    Bring the manifest up to date with the response and result directories.
+    Only the subtrees whose directories changed are rescanned, and only the result indices that changed are read.
+
+    :param manifest: the manifest to update
+    :param response_dir: the root directory of the responses
+    :param result_dir: the root directory of the computed edit distances
+    :return: whether anything changed
+    """
+    assignments = manifest['assignments']
+    changed = False
+
+    found = []
+    if response_dir.exists():
+        with os.scandir(response_dir) as entries:
+            found = [int(entry.name) for entry in entries if entry.is_dir() and entry.name.isdigit()]
+
+    for as_id in list(assignments):
+        if as_id not in found:
+            del assignments[as_id]
+            changed = True
+
+    for as_id in found:
+        assignment, tree_changed = _update_node(assignments.get(as_id), response_dir / str(as_id), as_id, 1)
+
+        index_path = result_dir / str(as_id) / result_store.INDEX_NAME
+        index_mtime = index_path.stat().st_mtime_ns if index_path.exists() else None
+
+        if tree_changed or assignment.get('index_mtime') != index_mtime:
+            _update_results(assignment, as_id, result_dir)
+            assignment['index_mtime'] = index_mtime
+            changed = True
+
+        assignments[as_id] = assignment
+
+    return changed
+
+
+def build_trees(manifest: dict) -> tuple[dict, dict, dict, list, dict]:
+    """
+    Construct the trees that the dataviewer uses from the manifest.
+    Assignments, exercises and questions without any responses are left out.
+
+    :return: Tuple (tree, ed_tree, names_tree, names_ids_list, versions_tree)
+    """
+    tree = {}
+    ed_tree = {}
+    versions_tree = {}
+    names_ids_list = [{}, {}, {}]
+    names_tree = {}
+
+    for as_id, assignment in manifest['assignments'].items():
+        for ex_id, exercise in assignment['children'].items():
+            for q_id, question in exercise['children'].items():
+                if len(question['children']) == 0:
+                    continue
+
+                if as_id not in tree:
+                    tree[as_id] = {}
+                    ed_tree[as_id] = {}
+                    versions_tree[as_id] = {}
+                    names_ids_list[0][assignment['name']] = as_id
+                    names_tree[assignment['name']] = {}
+
+                if ex_id not in tree[as_id]:
+                    tree[as_id][ex_id] = {}
+                    ed_tree[as_id][ex_id] = {}
+                    versions_tree[as_id][ex_id] = {}
+                    names_ids_list[1][exercise['name']] = ex_id
+                    names_tree[assignment['name']][exercise['name']] = {}
+
+                tree[as_id][ex_id][q_id] = list(question['children'])
+                ed_tree[as_id][ex_id][q_id] = {r: v[0] for r, v in question['children'].items()}
+                versions_tree[as_id][ex_id][q_id] = {r: v[1] for r, v in question['children'].items()}
+                names_ids_list[2][question['name']] = q_id
+                names_tree[assignment['name']][exercise['name']][question['name']] = {}
+
+    return tree, ed_tree, names_tree, names_ids_list, versions_tree
@@ -1,18 +1,25 @@
+import copy
+import hashlib
 import html
 import logging
-import traceback
+import threading
+from collections import OrderedDict
 
 from os import makedirs
-import pickle
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
 from typing import Any
 
-from bs4 import BeautifulSoup
+import numpy as np
 from flask_executor import Executor
 
-from src.editdistance.algorithms.edit_distance import compute_edit_distances
+from src import metrics
+from src.editdistance import lsh_index, result_store, similarity
+from src.editdistance.algorithms import snapshot_text
+from src.editdistance import main as ed_main
+from src.editdistance.job_registry import JobRegistry, JobState
+from . import manifest
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +30,21 @@ class HtmlModes(str, Enum):
     STRIP = "Strip"
 
 
+class SortKeys(str, Enum):
+    EDIT_DISTANCE = "Edit distance"
+    PASTE_BURSTS = "Paste bursts"
+    MAX_NOVEL = "Largest insertion"
+    INSERTION_RATE = "Insertion rate"
+
+
+# The signal in the result index that each sort key sorts on, see signals.compute_signals
+_SORT_SIGNALS = {
+    SortKeys.PASTE_BURSTS: 'paste_bursts',
+    SortKeys.MAX_NOVEL: 'max_novel',
+    SortKeys.INSERTION_RATE: 'insertion_rate'
+}
+
+
 class ResponsesTo(str, Enum):
     ASSIGNMENT = "Assignment"
     EXERCISE = "Exercise"
@@ -32,246 +54,772 @@ class ResponsesTo(str, Enum):
 _use_diff = False
 _show_edbo_phrases = True
 
-_html_mode: str = HtmlModes.STRIP
+# The number of sessions whose view is kept, the view of the least recently seen session is dropped first
+MAX_VIEWS = 256
 
-_user_dir: Path
+# The number of rendered histories that are kept, the least recently used history is dropped first
+HISTORY_CACHE_SIZE = 64
 
-_response_ids: list[list[int]] = []
+# The number of responses before and after the current response whose history is rendered in the background
+PREFETCH = 2
 
-_current_response_index: int = 0
-_current_eds_info: dict | None = None
+# The number of snapshots in a chunk of the compact form of a history, see _compact_history
+CHUNK_SIZE = 50
 
-_response_tree: dict = {}
-_edit_distance_tree: dict = {}
-_names_tree: dict = {}
-_names_ids_list: list = {}
-_num_versions_tree: dict = {}
+_user_dir: Path
 
 _result_dir: Path
 _response_dir: Path
 
 _executor: Executor | None = None
+_registry: JobRegistry | None = None
+
+
+class TreeSnapshot:
+    """
+    The trees of the responses as they were built from the manifest. A snapshot is never changed after it is built,
+    reloading builds a new snapshot and replaces the current one at once. Requests that are still using the old
+    snapshot finish with it undisturbed.
+    """
+
+    def __init__(self, response_tree: dict, edit_distance_tree: dict, names_tree: dict, names_ids_list: list,
+                 num_versions_tree: dict):
+        self.response_tree = response_tree
+        self.edit_distance_tree = edit_distance_tree
+        self.names_tree = names_tree
+        self.names_ids_list = names_ids_list
+        self.num_versions_tree = num_versions_tree
+
+        # The ranked active sets that were selected before, keyed by the selected ids and the sort key.
+        # Shared by all sessions, a set that is ranked twice at the same time is ranked the same both times.
+        self._ranked_sets: dict[tuple[tuple[int, ...], str], tuple[np.ndarray, np.ndarray, np.ndarray,
+                                                                    dict[int, int]]] = {}
+
+        self._index_leaves()
+
+    def _index_leaves(self):
+        """
+        Flatten the trees into the leaf arrays, and record the slice of the leaves of every subtree.
+        Every response is in the leaf arrays in tree order, so the responses of every subtree are consecutive.
+        This is the only walk over the trees, selecting an active set afterwards only looks up its slice.
+        """
+        leaves = []
+        ranges = {}
+        for as_id, exercises in self.response_tree.items():
+            as_start = len(leaves)
+            for ex_id, questions in exercises.items():
+                ex_start = len(leaves)
+                for q_id, response_ids in questions.items():
+                    q_start = len(leaves)
+                    leaves.extend((as_id, ex_id, q_id, resp_id) for resp_id in response_ids)
+                    ranges[(as_id, ex_id, q_id)] = (q_start, len(leaves))
+                ranges[(as_id, ex_id)] = (ex_start, len(leaves))
+            ranges[(as_id,)] = (as_start, len(leaves))
+        ranges[()] = (0, len(leaves))
+
+        n = len(leaves)
+        self.leaf_ids = _read_only(np.array(leaves, dtype=np.int64).reshape(n, 4))
+        self.leaf_max_eds = _read_only(np.fromiter((self.edit_distance_tree[a][e][q][r] for a, e, q, r in leaves),
+                                                   dtype=np.int64, count=n))
+        self.leaf_versions = _read_only(np.fromiter((self.num_versions_tree[a][e][q][r] for a, e, q, r in leaves),
+                                                    dtype=np.int64, count=n))
+        self.subtree_ranges = ranges
+
+    def default_prefix(self) -> tuple[int, ...]:
+        """
+        The ids of the subtree a new view starts with: the first assignment, or everything if there is none.
+        """
+        return (next(iter(self.response_tree)),) if len(self.response_tree) > 0 else ()
+
+    def ranked_set(self, prefix: tuple[int, ...], sort_key: str) -> tuple[np.ndarray, np.ndarray, np.ndarray,
+                                                                         dict[int, int]]:
+        """
+        The responses of the subtree with ids 'prefix', ranked on 'sort_key'.
+        Every ranked subtree is kept, so selecting it again does not rank it again.
+
+        :return: Tuple (ids, max_eds, n_versions, index) of the ranked responses,
+                 where index maps every response id to its position
+        """
+        if prefix not in self.subtree_ranges:
+            raise ValueError(f"Could not find ids {prefix} in the response tree!")
+
+        key = (prefix, sort_key)
+        ranked = self._ranked_sets.get(key)
+        if ranked is None:
+            start, stop = self.subtree_ranges[prefix]
+            order = start + _sort_order(self.leaf_ids[start:stop], self.leaf_max_eds[start:stop], sort_key)
+
+            ids = _read_only(self.leaf_ids[order])
+            # the first response with an id wins, like a search from the start of the active set
+            index = {rid: i for i, rid in reversed(list(enumerate(ids[:, 3].tolist())))}
+            ranked = (ids, _read_only(self.leaf_max_eds[order]), _read_only(self.leaf_versions[order]), index)
+            self._ranked_sets[key] = ranked
+
+        return ranked
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+def _sort_order(ids: np.ndarray, max_eds: np.ndarray, sort_key: str) -> np.ndarray:
+    """
+    The order of the responses with 'ids' on 'sort_key', highest first.
+    Responses with the same key keep their order.
+    """
+    if sort_key in _SORT_SIGNALS:
+        # the signals are read from the result index of each assignment once
+        name = _SORT_SIGNALS[sort_key]
+        assignment_signals = {as_id: result_store.read_signals(_result_dir, as_id)
+                              for as_id in np.unique(ids[:, 0]).tolist()}
+
+        keys = np.fromiter((assignment_signals[as_id].get(resp_id, {}).get(name, 0)
+                            for as_id, resp_id in ids[:, [0, 3]].tolist()), dtype=np.float64, count=len(ids))
+    else:
+        keys = max_eds
+
+    return np.argsort(-keys, kind='stable')
+
+
+# The trees that are currently shown. Only ever replaced as a whole.
+_snapshot: TreeSnapshot = TreeSnapshot({}, {}, {}, [{}, {}, {}], {})
+_reload_lock = threading.Lock()
+
+# The view of every session, the most recently seen session last
+_views: OrderedDict[str, 'ViewState'] = OrderedDict()
+_views_lock = threading.Lock()
+
+# The rendered histories, keyed by (compact, _history_key), the most recently used history last,
+# and the keys of the histories that are being rendered in the background
+_history_cache: OrderedDict[tuple, dict] = OrderedDict()
+_prefetching: set[tuple] = set()
+_history_lock = threading.Lock()
 
 
 def reinit():
     """
     Reinitialize datastructures with the same directories
     """
-    init(_response_dir, _result_dir, _user_dir, _executor)
+    init(_response_dir, _result_dir, _user_dir, _executor, _registry)
 
 
-def init(response_dir: Path, results_dir: Path, user_dir: Path, ex: Executor):
+def init(response_dir: Path, results_dir: Path, user_dir: Path, ex: Executor, registry: JobRegistry | None = None):
     """
-    (Re)initializes all datastructures
+    (Re)initializes all datastructures.
+    The new trees replace the current ones at once, the views of the sessions move to them when they are used next.
 
     :param response_dir: the root directory of the responses
     :param results_dir: the root directory of the computed edit distances
     :param user_dir: the root directory of remaining files
+    :param registry: the registry of the computation jobs
     """
-    global _user_dir, _response_tree, _edit_distance_tree, _names_tree, _names_ids_list, \
-        _result_dir, _response_dir,  _executor, _num_versions_tree
+    global _user_dir, _result_dir, _response_dir, _executor, _registry, _snapshot
+
+    with _reload_lock:
+        _user_dir = user_dir
+        makedirs(user_dir, exist_ok=True)
+
+        _response_dir = response_dir
+        _result_dir = results_dir
+        _executor = ex
+        _registry = registry
 
-    _user_dir = user_dir
-    makedirs(user_dir, exist_ok=True)
+        trees = construct_trees(response_dir)
 
-    _response_dir = response_dir
-    _result_dir = results_dir
+        logger.debug(trees[0])
+
+        if trees[0] is None:
+            raise RuntimeError("Something went wrong: response tree was None!")
+
+        _snapshot = TreeSnapshot(*trees)
+
+
+def construct_trees(response_dir: Path) -> tuple[dict, dict, dict, list, dict]:
+    """
+    Construct the trees from the manifest, after rescanning the parts of the response directory that changed.
+    The manifest is saved again if anything changed.
+    """
+    with metrics.timed('construct_trees'):
+        tree_manifest = manifest.load(_user_dir, response_dir)
 
-    _response_tree, _edit_distance_tree, _names_tree, _names_ids_list, _num_versions_tree = construct_trees(response_dir)
+        if manifest.update(tree_manifest, response_dir, _result_dir):
+            manifest.save(_user_dir, tree_manifest)
 
-    logger.debug(_response_tree)
+        return manifest.build_trees(tree_manifest)
 
-    if _response_tree is not None:
-        if len(list(_response_tree.keys())) > 0:
-            assignment_id = list(_response_tree.keys())[0]
-            reset_response_ids(_find_all_response_ids([assignment_id]))
+
+def update_manifest():
+    """
+    Bring the saved manifest up to date, without changing the trees that are currently shown.
+    """
+    tree_manifest = manifest.load(_user_dir, _response_dir)
+
+    if manifest.update(tree_manifest, _response_dir, _result_dir):
+        manifest.save(_user_dir, tree_manifest)
+
+
+def get_view(session_id: str) -> 'ViewState':
+    """
+    Get the view of a session, a new view if the session was not seen before.
+    The view is moved to the current trees first, if they were reloaded since the session was last seen.
+
+    :param session_id: the id of the session
+    """
+    snapshot = _snapshot
+
+    with _views_lock:
+        view = _views.get(session_id)
+        if view is None:
+            view = ViewState()
+            _views[session_id] = view
+
+        _views.move_to_end(session_id)
+        while len(_views) > MAX_VIEWS:
+            _views.popitem(last=False)
+
+    view.sync(snapshot)
+    return view
+
+
+class ViewState:
+    """
+    What a session is looking at: its active set of responses, the current response and how it is shown.
+    Every session has its own view over the shared trees, so sessions do not move each other's position.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._snapshot: TreeSnapshot | None = None
+
+        self._html_mode: str = HtmlModes.STRIP
+        self._sort_key: str = SortKeys.EDIT_DISTANCE
+
+        # The active set of responses in the order they are ranked in: the (assignment, exercise, question, response)
+        # ids of every response, with its max edit distance and number of versions at the same position.
+        # The selected ids of the active set, and the index of every response id in it.
+        self._prefix: tuple[int, ...] = ()
+        self._ids: np.ndarray = np.empty((0, 4), dtype=np.int64)
+        self._max_eds: np.ndarray = np.empty(0, dtype=np.int64)
+        self._versions: np.ndarray = np.empty(0, dtype=np.int64)
+        self._index: dict[int, int] = {}
+
+        self._current_response_index: int = -1
+        self._current_eds_info: dict | None = None
+
+    def sync(self, snapshot: TreeSnapshot):
+        """
+        Move the view to 'snapshot' if it is not on it yet. The same subtree stays selected and the same response
+        stays current if they are still in the trees, otherwise the view starts over.
+        """
+        with self._lock:
+            if snapshot is self._snapshot:
+                return
+
+            cur_id = self.get_cur_id()
+            first_use = self._snapshot is None
+            self._snapshot = snapshot
+
+            if not first_use and self._prefix in snapshot.subtree_ranges:
+                self._activate(self._prefix)
+            else:
+                self._activate(snapshot.default_prefix())
+
+            if len(cur_id) == 4 and cur_id[3] in self._index:
+                self._update_current_index(self._index[cur_id[3]])
+
+    def _activate(self, prefix: tuple[int, ...]):
+        """
+        Make the responses of the subtree with ids 'prefix' the active set, ranked on the current sort key.
+        """
+        self._ids, self._max_eds, self._versions, self._index = self._snapshot.ranked_set(prefix, self._sort_key)
+        self._prefix = prefix
+
+        print('resetting response ids to a list of size ' + str(len(self._ids)))
+
+        if len(self._ids) > 0:
+            self._update_current_index(0)
         else:
-            try:
-                set_active_set([])
-            except FileNotFoundError:
-                pass
-    else:
-        raise RuntimeError("Something went wrong: response tree was None!")
-
-    _executor = ex
-
-
-def construct_trees(response_dir: Path) -> tuple[dict, dict, dict, list]:
-    tree = {}
-    ed_tree = {}
-    versions_tree = {}
-    names_ids_list = [{}, {}, {}]
-    names_tree = {}
-
-    for file_path in response_dir.glob('./*/*/*/*.pickle'):
-        # Extract parts of the path
-        as_id, ex_id, q_id, resp_id = file_path.parts[-4:]
-        resp_id = int(resp_id.split('.')[0])  # Remove file extension
-        as_id = int(as_id)
-        ex_id = int(ex_id)
-        q_id = int(q_id)
-
-        if as_id not in tree:
-            tree[as_id] = {}
-            ed_tree[as_id] = {}
-            versions_tree[as_id] = {}
-            as_name = str(as_id)
-            if (response_dir / str(as_id) / 'name.txt').exists():
-                with open(response_dir / str(as_id) / 'name.txt', 'r') as file:
-                    as_name = file.read()
-            names_ids_list[0][as_name] = as_id
-            names_tree[as_name] = {}
-
-        if ex_id not in tree[as_id]:
-            tree[as_id][ex_id] = {}
-            ed_tree[as_id][ex_id] = {}
-            versions_tree[as_id][ex_id] = {}
-            ex_name = str(ex_id)
-            if (response_dir / str(as_id) / str(ex_id) / 'name.txt').exists():
-                with open(response_dir / str(as_id) / str(ex_id) / 'name.txt', 'r') as file:
-                    ex_name = file.read()
-            names_ids_list[1][ex_name] = ex_id
-            names_tree[as_name][ex_name] = {}
-
-        if q_id not in tree[as_id][ex_id]:
-            tree[as_id][ex_id][q_id] = []
-            ed_tree[as_id][ex_id][q_id] = {}
-            versions_tree[as_id][ex_id][q_id] = {}
-            q_name = str(q_id)
-            if (response_dir / str(as_id) / str(ex_id) / str(q_id) / 'name.txt').exists():
-                with open(response_dir / str(as_id) / str(ex_id) / str(q_id) / 'name.txt', 'r') as file:
-                    q_name = file.read()
-            names_ids_list[2][q_name] = q_id
-            names_tree[as_name][ex_name][q_name] = {}
-
-        resultdata = _read_file(_result_dir, [as_id, ex_id, q_id, resp_id], ED_DEFAULT)
-        ed_tree[as_id][ex_id][q_id][resp_id] = resultdata["max"]
-        versions_tree[as_id][ex_id][q_id][resp_id] = len(resultdata["edit_distances"])
-        tree[as_id][ex_id][q_id].append(resp_id)
-
-    return tree, ed_tree, names_tree, names_ids_list, versions_tree
-
-
-def _update_current_index(new_index: int):
-    if not -1 <= new_index < len(_response_ids):
-        raise ValueError(f"Invalid response index {new_index}")
-
-    global _current_response_index, _current_eds_info
-
-    _current_response_index = new_index
-
-    if new_index >= 0:
-        _current_eds_info = _read_file(_result_dir, get_cur_id(), ED_DEFAULT)
-    else:
-        _current_eds_info = ED_DEFAULT
+            self._update_current_index(-1)
 
+    def _update_current_index(self, new_index: int):
+        if not -1 <= new_index < len(self._ids):
+            raise ValueError(f"Invalid response index {new_index}")
 
-def next_response():
-    global _current_response_index
+        self._current_response_index = new_index
 
-    if _current_response_index == -1:
-        return
+        if new_index >= 0:
+            self._current_eds_info = _read_result(self.get_cur_id())
+        else:
+            self._current_eds_info = ED_DEFAULT
 
-    _update_current_index((_current_response_index + 1) % len(_response_ids))
+    def next_response(self):
+        with self._lock:
+            if self._current_response_index == -1:
+                return
 
+            self._update_current_index((self._current_response_index + 1) % len(self._ids))
 
-def previous_response():
-    global _current_response_index
+    def previous_response(self):
+        with self._lock:
+            if self._current_response_index == -1:
+                return
 
-    if _current_response_index == -1:
-        return
+            self._update_current_index((self._current_response_index - 1) % len(self._ids))
+
+    def specific_response_index(self, response_index: int):
+        with self._lock:
+            if not (0 <= response_index < len(self._ids)):
+                raise ValueError(f"{response_index} is out of range: [0, {len(self._ids)-1}]")
+
+            self._update_current_index(response_index)
+
+    def specific_response_id(self, rid: int):
+        with self._lock:
+            if rid not in self._index:
+                raise ValueError(f"response id {rid} is not in the active set of responses!")
+
+            self._update_current_index(self._index[rid])
 
-    _update_current_index((_current_response_index - 1) % len(_response_ids))
+    def history_key(self, ids: list[int] | None = None) -> tuple:
+        """
+        The key of the rendered history of a response as this view shows it, see _history_key.
 
+        :param ids: the (assignment, exercise, question, response) ids. If None, the current response.
+        """
+        with self._lock:
+            return _history_key(self.get_cur_id() if ids is None else ids, self._html_mode)
+
+    def get_history(self, key: tuple | None = None, compact: bool = False) -> dict[str, list]:
+        """
+        Get the rendered history of a response, and render the histories of the responses around the current
+        response in the background, so they are ready when the view moves on.
+
+        :param key: the key of the history, see history_key. If None, the current response.
+        :param compact: whether to only get the header of the compact form, see _compact_history.
+                        The snapshots are then fetched in chunks, see get_history_chunk.
+        """
+        if key is None:
+            key = self.history_key()
+
+        with metrics.timed('get_history'):
+            out = _rendered_history(key, compact)
+        self._prefetch()
+        return out["header"] if compact else out
+
+    def _prefetch(self):
+        if _executor is None:
+            return
+
+        with self._lock:
+            n = len(self._ids)
+            if self._current_response_index < 0:
+                return
+
+            neighbours = {(self._current_response_index + d) % n for d in range(-PREFETCH, PREFETCH + 1)}
+            neighbours.discard(self._current_response_index)
+            # the viewer fetches the compact form of the histories
+            keys = [(True, _history_key(self._ids[i].tolist(), self._html_mode)) for i in sorted(neighbours)]
+
+        for cache_key in keys:
+            with _history_lock:
+                if cache_key in _history_cache or cache_key in _prefetching:
+                    continue
+                _prefetching.add(cache_key)
+
+            _executor.submit(_prefetch_history, cache_key)
+
+    def _process_html(self, string: str):
+        if self._should_strip_html():
+            return snapshot_text.strip_html(string)
+
+        if self._should_escape_html():
+            return html.escape(string)
+
+        return string
+
+    def _should_strip_html(self):
+        return self._html_mode == HtmlModes.STRIP
+
+    def _should_escape_html(self):
+        return self._html_mode == HtmlModes.SHOW
+
+    def get_nr_responses(self) -> int:
+        return len(self._ids)
+
+    def get_num_versions(self) -> list[int]:
+        if len(self._ids) == 0:
+            return [0]
+
+        return self._versions.tolist()
+
+    def get_all_max_edit_distances(self) -> list[int]:
+        if len(self._ids) == 0:
+            return [0]
+
+        return self._max_eds.tolist()
+
+    def get_response_page(self, offset: int = 0, limit: int = 100) -> dict:
+        """
+        Get a page of the active set, in the order the responses are ranked in.
+
+        :param offset: the index of the first response on the page
+        :param limit: the maximum number of responses on the page
+        :return: dict with the size of the active set, the offset and the responses on the page, see _response_rows
+        """
+        if offset < 0 or limit < 0:
+            raise ValueError(f"Invalid page: offset {offset}, limit {limit}")
+
+        with self._lock:
+            n = len(self._ids)
+            return {
+                "total": n,
+                "offset": offset,
+                "responses": self._response_rows(np.arange(min(offset, n), min(offset + limit, n)))
+            }
+
+    def get_responses_in_range(self, min_ed: int | None = None, max_ed: int | None = None,
+                               offset: int = 0, limit: int = 100) -> dict:
+        """
+        Get a page of the responses in the active set whose max edit distance is in [min_ed, max_ed],
+        in the order the responses are ranked in.
+
+        :param min_ed: the lowest max edit distance, or None for no lower bound
+        :param max_ed: the highest max edit distance, or None for no upper bound
+        :param offset: the index of the first matching response on the page
+        :param limit: the maximum number of responses on the page
+        :return: dict with the number of matching responses, the offset and the responses on the page,
+                 see _response_rows
+        """
+        if offset < 0 or limit < 0:
+            raise ValueError(f"Invalid page: offset {offset}, limit {limit}")
+
+        with self._lock:
+            in_range = np.ones(len(self._ids), dtype=bool)
+            if min_ed is not None:
+                in_range &= self._max_eds >= min_ed
+            if max_ed is not None:
+                in_range &= self._max_eds <= max_ed
+
+            indices = np.flatnonzero(in_range)
+
+            return {
+                "total": len(indices),
+                "offset": offset,
+                "responses": self._response_rows(indices[offset:offset + limit])
+            }
+
+    def _response_rows(self, indices: np.ndarray) -> list[dict]:
+        """
+        The responses at 'indices' in the active set, as dicts with their index in the active set,
+        their ids ('rid'), their max edit distance and their number of versions.
+        """
+        return [
+            {"index": index, "rid": rid, "max_ed": max_ed, "num_versions": n_versions}
+            for index, rid, max_ed, n_versions in zip(indices.tolist(), self._ids[indices].tolist(),
+                                                      self._max_eds[indices].tolist(),
+                                                      self._versions[indices].tolist())
+        ]
+
+    def get_index(self):
+        return self._current_response_index
+
+    def set_html(self, val: str):
+        """
+        Set the html mode
+        :param val: the new mode, see HtmlModes
+        """
+        self._html_mode = HtmlModes(val)
+
+    def get_html(self) -> str:
+        return self._html_mode
+
+    def set_sort(self, val: str):
+        """
+        Set what the responses are ranked on, and rank the current active set again
+        :param val: the new sort key, see SortKeys
+        """
+        with self._lock:
+            self._sort_key = SortKeys(val)
+            self._activate(self._prefix)
+
+    def get_sort(self) -> str:
+        return self._sort_key
+
+    def get_cur_id(self) -> list[int]:
+        with self._lock:
+            if self._current_response_index < 0:
+                return []
+            return self._ids[self._current_response_index].tolist()
+
+    def set_active_set(self, ids: list[int|str]):
+        with self._lock:
+            self._activate(tuple(int(i) for i in ids))
+
+    def get_current_eds(self) -> list[int]:
+        if self._current_eds_info is None:
+            return []
+        return self._current_eds_info["edit_distances"]
+
+    def get_max_ed(self) -> int:
+        if self._current_eds_info is None:
+            return 0
+        return self._current_eds_info["max"]
+
+
+def _history_key(ids: list[int], html_mode: str) -> tuple:
+    """
+    The key of a rendered history. It changes whenever the rendered history would change:
+    with the response, how it is shown, and when the response or its result were written again.
+    """
+    if len(ids) != 4:
+        return tuple(ids), HtmlModes(html_mode).value, _show_edbo_phrases, 0, 0
+
+    try:
+        response_mtime = _file_path(_response_dir, ids).stat().st_mtime_ns
+    except OSError:
+        response_mtime = 0
+
+    return (tuple(ids), HtmlModes(html_mode).value, _show_edbo_phrases,
+            response_mtime, result_store.result_mtime(_result_dir, ids))
+
+
+def history_etag(key: tuple) -> str:
+    """
+    The ETag of the rendered history with 'key', see _history_key.
+    """
+    return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).hexdigest()
 
-def specific_response_index(response_index: int):
-    if not (0 <= response_index < len(_response_ids) ):
-        raise ValueError(f"{response_index} is out of range: [0, {len(_response_ids)-1}]")
 
-    _update_current_index(response_index)
+def _rendered_history(key: tuple, compact: bool = False) -> dict:
+    """
+    Get the rendered history with 'key' from the cache, or render it and add it to the cache.
 
+    :param key: the key of the history, see _history_key
+    :param compact: whether to get the compact form of the history, see _compact_history
+    """
+    cache_key = (compact, key)
+    with _history_lock:
+        if cache_key in _history_cache:
+            _history_cache.move_to_end(cache_key)
+            return _history_cache[cache_key]
 
-def specific_response_id(rid: int):
-    index = -1
-    for i in range(len(_response_ids)):
-        if rid == _response_ids[i][3]:
-            index = i
-            break
+    out = (_compact_history if compact else _render_history)(list(key[0]), key[1])
 
-    if index == -1:
-        raise ValueError(f"response id {rid} is not in the active set of responses!")
+    with _history_lock:
+        _history_cache[cache_key] = out
+        while len(_history_cache) > HISTORY_CACHE_SIZE:
+            _history_cache.popitem(last=False)
+
+    return out
 
-    specific_response_index(index)
 
+def _prefetch_history(cache_key: tuple):
+    compact, key = cache_key
+    try:
+        _rendered_history(key, compact)
+    except Exception as e:
+        logger.warning(f"Could not prefetch the history of {list(key[0])}: {e}")
+    finally:
+        with _history_lock:
+            _prefetching.discard(cache_key)
 
-def get_history() -> dict[str, list]:
 
-    content = _read_file(_response_dir, get_cur_id(), RESPONSE_DEFAULT)
+def _prepare_history(ids: list[int], html_mode: str) -> tuple[list[dict], list[str | None], list, dict]:
+    """
+    Read the history of the response with the (assignment, exercise, question, response) ids,
+    and the content of every snapshot as it is shown in 'html_mode', before the phrases are coloured.
+
+    :return: Tuple (history, contents, factorizations, eds_info), where contents is None for snapshots without
+             content, and factorizations holds the phrases to colour of every snapshot, empty or None if there are none
+    """
+    eds_info = _read_result(ids) if len(ids) == 4 else ED_DEFAULT
+
+    path = _file_path(_response_dir, ids)
+    if path.exists():
+        # the stripped text is read from the text file next to the response, if it was stripped before
+        content, texts = snapshot_text.load_history(path)
+    else:
+        content, texts = copy.deepcopy(RESPONSE_DEFAULT), [None] * len(RESPONSE_DEFAULT)
+
+    contents = [version["changes"]["content"] if _has_content(version) else None for version in content]
+    factorizations = [None] * len(content)
+
+    if html_mode == HtmlModes.STRIP:
+        contents = [text if text is not None else old for text, old in zip(texts, contents)]
 
-    if _should_strip_html():
         if _show_edbo_phrases:
-            # _current_eds_info['factorization'] contains one entry per snapshot WITH valid content
+            # eds_info['factorization'] contains one entry per snapshot WITH valid content
             # We need to align factorizations with content entries that have valid content
-            raw_factorizations = _current_eds_info['factorization'] if _current_eds_info else []
-            
+            raw_factorizations = eds_info['factorization'] if eds_info else []
+
             # Build factorizations list aligned with content indices
             # The factorization algorithm skips snapshots with None content
             factorizations = []
             fact_idx = 0
             for version in content:
-                has_content = ("changes" in version 
-                               and "content" in version["changes"] 
-                               and version["changes"]["content"] is not None)
-                if has_content and fact_idx < len(raw_factorizations):
+                if _has_content(version) and fact_idx < len(raw_factorizations):
                     factorizations.append(raw_factorizations[fact_idx])
                     fact_idx += 1
                 else:
                     # No content or no factorization available - use empty
                     factorizations.append([])
-        else:
-            factorizations = [None]*len(content)
-
-        # Process each snapshot: strip HTML and apply phrase colors
-        for (version, factorization) in zip(content, factorizations):
-            if "changes" in version and "content" in version["changes"] and version["changes"]["content"] is not None:
-                version["changes"]["content"] = BeautifulSoup(version["changes"]["content"], 'lxml').get_text()
-                
-                # Apply phrase coloring if enabled and factorization is available
-                if _show_edbo_phrases and factorization and len(factorization) > 0:
-                    version["changes"]["content"] = _process_phrase_colors(version["changes"]["content"], factorization)
-
-    elif _should_escape_html():
-        for version in content:
-            if "changes" in version and "content" in version["changes"] and version["changes"]["content"] is not None:
-                version["changes"]["content"] = html.escape(version["changes"]["content"])
 
-    timestamps = _process_time(content)
-    hist = content
+    elif html_mode == HtmlModes.SHOW:
+        contents = [html.escape(c) if c is not None else None for c in contents]
+
+    return content, contents, factorizations, eds_info
+
+
+def _has_content(version: dict) -> bool:
+    return "changes" in version and "content" in version["changes"] and version["changes"]["content"] is not None
+
 
-    result_id = None
-    for version in hist:
+def _result_id(history: list) -> int | None:
+    for version in history:
         if isinstance(version, dict):
             candidate = version.get("result_id")
             if candidate is not None:
-                result_id = candidate
-                break
+                return candidate
+
+    return None
+
+
+def _render_history(ids: list[int], html_mode: str) -> dict[str, list]:
+    """
+    Render the history of the response with the (assignment, exercise, question, response) ids in 'html_mode'.
+    """
+    content, contents, factorizations, eds_info = _prepare_history(ids, html_mode)
+
+    # Process each snapshot: set the content as shown and apply phrase colors
+    for (version, factorization, shown) in zip(content, factorizations, contents):
+        if shown is not None:
+            # Apply phrase coloring if enabled and factorization is available
+            if factorization:
+                shown = _process_phrase_colors(shown, factorization)
+
+            version["changes"]["content"] = shown
+
+    timestamps = _process_time(content)
 
     out = {
-        "history": hist,
-        "edit_distances": get_current_eds(),
+        "history": content,
+        "edit_distances": eds_info["edit_distances"] if eds_info is not None else [],
         "timestamps": timestamps,
         "format": "old",
-        "result_id": result_id
+        "result_id": _result_id(content)
     }
 
     return out
 
 
+def _compact_history(ids: list[int], html_mode: str) -> dict:
+    """
+    Encode the history of the response with the (assignment, exercise, question, response) ids in 'html_mode'
+    in the compact form: every snapshot is a delta to the previous snapshot with content, see _delta,
+    and the phrases are coloured by the viewer instead of being sent as html.
+    The deltas are sent in chunks of CHUNK_SIZE snapshots, every chunk starts from the content before it (its base),
+    so a chunk can be decoded without the chunks before it.
+
+    :return: dict with the header of the history, and the bases, deltas and factorizations of all snapshots
+    """
+    content, contents, factorizations, eds_info = _prepare_history(ids, html_mode)
+
+    bases = []
+    deltas = []
+    previous = ''
+    for i, shown in enumerate(contents):
+        if i % CHUNK_SIZE == 0:
+            bases.append(previous)
+
+        if shown is None:
+            deltas.append(None)
+        else:
+            deltas.append(_delta(previous, shown))
+            previous = shown
+
+    phrases = html_mode == HtmlModes.STRIP and _show_edbo_phrases
+
+    return {
+        "header": {
+            "response": list(ids),
+            "n_snapshots": len(contents),
+            "chunk_size": CHUNK_SIZE,
+            "first_is_artificial": bool(content[0].get("is_artificial", False)) if len(content) > 0 else False,
+            "edit_distances": eds_info["edit_distances"] if eds_info is not None else [],
+            "timestamps": _process_time(content),
+            "format": "delta",
+            "result_id": _result_id(content)
+        },
+        "bases": bases,
+        "deltas": deltas,
+        "factorizations": factorizations if phrases else None
+    }
+
+
+def _delta(old: str, new: str) -> list:
+    """
+    The delta [prefix, suffix, inserted] that turns 'old' into 'new': the first 'prefix' and the last 'suffix'
+    characters of 'old' are kept, and 'inserted' goes in between. The lengths count UTF-16 code units,
+    like the strings of the viewer.
+    """
+    limit = min(len(old), len(new))
+
+    # the longest common prefix and suffix, comparing slices is done in C
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if old[:mid] == new[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    prefix = low
+
+    low, high = 0, limit - prefix
+    while low < high:
+        mid = (low + high + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            low = mid
+        else:
+            high = mid - 1
+    suffix = low
+
+    return [_utf16_length(new[:prefix]), _utf16_length(new[len(new) - suffix:]), new[prefix:len(new) - suffix]]
+
+
+def _utf16_length(string: str) -> int:
+    if string.isascii():
+        return len(string)
+    return len(string.encode('utf-16-le')) // 2
+
+
+def get_history_chunk(key: tuple, start: int) -> dict:
+    """
+    Get a chunk of the compact form of a history, see _compact_history.
+
+    :param key: the key of the history, see _history_key
+    :param start: the index of the first snapshot of the chunk, a multiple of CHUNK_SIZE
+    :return: dict with the start, the base and the deltas and factorizations of the snapshots in the chunk
+    """
+    history = _rendered_history(key, compact=True)
+
+    if start < 0 or start % CHUNK_SIZE != 0 or start >= max(len(history["deltas"]), 1):
+        raise ValueError(f"Invalid chunk start {start} for a history of {len(history['deltas'])} snapshots")
+
+    factorizations = history["factorizations"]
+    return {
+        "start": start,
+        "base": history["bases"][start // CHUNK_SIZE] if history["bases"] else '',
+        "deltas": history["deltas"][start:start + CHUNK_SIZE],
+        "factorizations": factorizations[start:start + CHUNK_SIZE] if factorizations is not None else None
+    }
+
+
 def _process_phrase_colors(text: str, factorization: list[int]):
     match_color = [' #85c1e9', ' #f9e79f', ' #abebc6']
     i, c = 0, 0
     old_text = text
-    new_text = "<p>"
+    parts = ["<p>"]
     fact_sum = sum(factorization) if factorization else 0
     text_len = len(text)
     
@@ -284,7 +832,7 @@ def _process_phrase_colors(text: str, factorization: list[int]):
             c = (c + 1) % len(match_color)
 
         match = old_text[i:i + j]
-        new_text += f"<span style='background-color:{color}'>{match}</span>"
+        parts.append(f"<span style='background-color:{color}'>{match}</span>")
         i += j
     
     # Check if we processed all text
@@ -293,11 +841,12 @@ def _process_phrase_colors(text: str, factorization: list[int]):
               f"fact_sum={fact_sum}, remaining='{text[i:]}'")
         # Append remaining text as unmatched (red background). THIS SHOULD NOT HAPPEN NORMALLY.
         remaining = text[i:]
-        new_text += f"<span style='background-color:#f1948a'>{remaining}</span>"
+        parts.append(f"<span style='background-color:#f1948a'>{remaining}</span>")
     elif i > text_len:
         print(f"DEBUG _process_phrase_colors: Processed beyond text! i={i}, text_len={text_len}, fact_sum={fact_sum}")
     
-    return new_text + '</p>'
+    parts.append('</p>')
+    return ''.join(parts)
 
 
 def _process_time(content: list) -> list:
@@ -312,163 +861,12 @@ def _process_time(content: list) -> list:
     return timestamps
 
 
-def _process_html(string: str):
-    if _should_strip_html():
-        return BeautifulSoup(string, 'lxml').get_text()
-
-    if _should_escape_html():
-        return html.escape(string)
-
-    return string
-
-
-def _should_strip_html():
-    return _html_mode == HtmlModes.STRIP
-
-
-def _should_escape_html():
-    return _html_mode == HtmlModes.SHOW
-
-
-def get_nr_responses() -> int:
-    return len(_response_ids)
-
-
-def get_num_versions() -> list[int]:
-    if _response_ids is None or len(_response_ids) == 0:
-        return [0]
-    else:
-        num_versions_array = []
-    
-        for id in _response_ids:
-            num_versions_array.append(_num_versions_tree[id[0]][id[1]][id[2]][id[3]])
-    
-        return num_versions_array
-
-def get_all_max_edit_distances() -> list[int]:
-    if _response_ids is None or len(_response_ids) == 0:
-        return [0]
-    else:
-        max_edit_distances_array = []
-    
-        for id in _response_ids:
-            max_edit_distances_array.append(_edit_distance_tree[id[0]][id[1]][id[2]][id[3]])
-    
-        return max_edit_distances_array
-
-def get_index():
-    return _current_response_index
-
-
-def set_html(val: str):
-    """
-    Set the html mode
-    :param val: the new mode
-    """
-    global _html_mode
-    _html_mode = val
-
-
-def get_html() -> str:
-    return _html_mode
-
-
-def get_cur_id() -> list[int]:
-    if _response_ids is None or len(_response_ids) == 0:
-        return []
-    return _response_ids[_current_response_index]
-
-
-def set_active_set(ids: list[int|str]):
-    global _response_ids
-
-    if len(ids) == 0:
-        new_response_ids = _get_all_leaves(_response_tree, [])
-    else:
-        ids = [int(i) for i in ids]
-        new_response_ids = _find_all_response_ids(ids)
-
-    # sort ids on their edit distance
-    new_response_ids.sort(reverse=True,
-                          key=lambda ids_list: _edit_distance_tree[ids_list[0]][ids_list[1]][ids_list[2]][ids_list[3]])
-
-    reset_response_ids( new_response_ids )
-
-
-def _find_all_response_ids(ids: list[int], tree: dict | list = None, index: int = 0) -> list[list[int]]:
-    logger.info(f"Finding all responses for {ids}, current value of index is {index}.")
-
-    if ids is None:
-        return []
-
-    if tree is None:
-        tree = _response_tree
-
-    # if index is outside the ids list, we want to get all leaves from that point
-    if index == len(ids):
-        return _get_all_leaves(tree, ids)
-
-    # otherwise, walk one node down
-    if ids[index] not in tree:
-        traceback.print_exc()
-        raise ValueError(f"Could not find id: {ids[index]}! Stopped finding all responses. Queried to find all response ids for {ids}")
-
-    else:
-        return _find_all_response_ids(ids, tree[ids[index]], index + 1)
-
-
-def _get_all_leaves(tree: dict[int, dict | list] | list[int], prefix: list[int]) -> list[list[int]]:
-    """
-    Get all leaves in the tree
-
-    :param tree: the relevant tree
-    :param prefix: prefix of ids
-    :return: a list of ids
-    """
-    if isinstance(tree, list):
-        return [(prefix + [x]) for x in tree]
-
-    elif isinstance(tree, dict):
-        out = []
-        for k, v in tree.items():
-            out += _get_all_leaves(v, prefix + [k])
-
-        return out
-
-    else:
-        raise TypeError(f"Unsupported type: {type(tree)}")
-
-
-def reset_response_ids(new_ids: list[list[int]]):
-    global _response_ids
-    _response_ids = new_ids
-
-    print('resetting response ids to a list of size ' + str(len(_response_ids)))
-
-    if len(_response_ids) > 0:
-        _update_current_index(0)
-    else:
-        _update_current_index(-1)
-
-
-def get_current_eds() -> list[int]:
-    if _current_eds_info is None:
-        return []
-    return _current_eds_info["edit_distances"]
-
-
-def get_max_ed() -> int:
-    if _current_eds_info is None:
-        return 0
-    return _current_eds_info["max"]
-
-
 def get_tree() -> dict:
-    return _response_tree
+    return _snapshot.response_tree
 
 
 def get_names_tree() -> list:
-    return [_names_tree, _names_ids_list]
+    return [_snapshot.names_tree, _snapshot.names_ids_list]
 
 
 ED_DEFAULT = {
@@ -487,7 +885,41 @@ RESPONSE_DEFAULT = [
                     ]
 
 
-def _read_file(root: Path, ids: list[int], default=None) -> dict | list:
+def get_similar_pairs(question_ids: list[int], k: int = 20) -> dict:
+    """
+    Rank the pairs of responses to a question whose final answers are the most similar.
+
+    :param question_ids: the (assignment, exercise, question) ids
+    :param k: the number of pairs to return
+    :return: dict with the question ids and the ranked pairs, see similarity.rank_similar_pairs
+    """
+    if len(question_ids) != 3:
+        raise ValueError(f"question ids were of unexpected length. Was {len(question_ids)}, expected 3.")
+
+    # the fingerprints are kept in the near-duplicate index, only new and changed responses are read
+    return {
+        "question": question_ids,
+        "pairs": similarity.rank_similar_pairs(lsh_index.question_fingerprints(_response_dir, question_ids), k)
+    }
+
+
+def get_near_duplicates(ids: list[int]) -> dict:
+    """
+    Find the responses to the same question whose final answer is a near-duplicate of that of a response.
+
+    :param ids: the (assignment, exercise, question, response) ids
+    :return: dict with the response ids and the near-duplicates, see lsh_index.query
+    """
+    if len(ids) != 4:
+        raise ValueError(f"ids were of unexpected length. Was {len(ids)}, expected 4.")
+
+    return {
+        "response": ids,
+        "near_duplicates": lsh_index.query(_response_dir, ids)
+    }
+
+
+def _file_path(root: Path, ids: list[int]) -> Path:
     if len(ids) != 4:
         ValueError(f"ids was of unexpected length. Was {len(ids)}, expected 4.")
 
@@ -495,38 +927,75 @@ def _read_file(root: Path, ids: list[int], default=None) -> dict | list:
     for i in ids:
         path = path / str(i)
 
-    path = path.with_suffix(".pickle")
+    return path.with_suffix(".pickle")
 
-    if not path.exists():
-        return default
 
-    with open(path, 'rb') as file:
-        return pickle.load(file)
+def _read_result(ids: list[int]) -> dict:
+    return result_store.read_result(_result_dir, ids, ED_DEFAULT)
 
 
 def compute_ed(rel_path: Path):
-    if _executor is None:
+    if _executor is None or _registry is None:
         logger.warning("No executor found. Skipping. "
                        "If this message is given at startup, then it can safely be ignored.")
         return
 
-    _executor.submit(compute_edit_distances, 'improved', _response_dir, rel_path, _result_dir)
+    ed_main.submit_job(_executor, {'base_path': _response_dir, 'rel_file_path': rel_path}, _result_dir, _registry,
+                       __name__)
 
 
-def test_all():
-    responses = _get_all_leaves(_response_tree, [])
+def test_all() -> bool:
+    """
+    Start a computation job for every response that has no result and is not in a queued or running job.
+
+    :return: whether all responses have a result
+    """
+    responses = _snapshot.leaf_ids.tolist()
+    active = _registry.active_responses() if _registry is not None else set()
 
     found_all = True
+    result_indices = {}
 
     for ids in responses:
-        path = _result_dir
-        for i in ids:
-            path = path / str(i)
+        if ids[0] not in result_indices:
+            result_indices[ids[0]] = result_store.read_index(_result_dir, ids[0])
 
-        path = path.with_suffix(".pickle")
+        if ids[3] in result_indices[ids[0]] or result_store.has_result(_result_dir, ids):
+            continue
 
-        if not path.exists():
-            found_all = False
-            compute_ed(path.relative_to(_result_dir))
+        found_all = False
+        if ids[3] not in active:
+            compute_ed(Path(*[str(i) for i in ids]).with_suffix(".pickle"))
 
     return found_all
+
+
+def get_job_counts() -> dict[str, int]:
+    """
+    The number of computation jobs in every state, see JobState.
+    """
+    if _registry is None:
+        return {state.value: 0 for state in JobState}
+
+    return _registry.counts()
+
+
+def get_jobs(state: str | None = None, limit: int = 100) -> list[dict]:
+    """
+    The most recent computation jobs, most recent first.
+
+    :param state: if given, only the jobs in this state, one of the values of JobState
+    :param limit: the maximum number of jobs
+    :raises ValueError: if the state is unknown
+    """
+    if _registry is None:
+        return []
+
+    return _registry.jobs(JobState(state) if state is not None else None, limit)
+
+
+def get_job(job_id: int) -> dict | None:
+    """
+    The record of a computation job, or None if there is no such job.
+    """
+    return _registry.get(job_id) if _registry is not None else None
@@ -1,13 +1,38 @@
+import gzip
 import logging
 import os
+import uuid
+from typing import Any
 
-from flask import render_template, send_from_directory, jsonify, request, Blueprint
+from flask import render_template, send_from_directory, jsonify, request, Blueprint, g, make_response
 
+from src import metrics
 from src.dataviewer import responses
 
 dv_routes = Blueprint('dv_routes', __name__)
 logger = logging.getLogger(__name__)
 
+# Every browser gets its own view of the responses, the cookie holds the id of its session
+SESSION_COOKIE = 'viewer_session'
+
+
+def get_view() -> responses.ViewState:
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if session_id is None:
+        # a new session, the cookie is set on the response
+        if 'session_id' not in g:
+            g.session_id = uuid.uuid4().hex
+        session_id = g.session_id
+
+    return responses.get_view(session_id)
+
+
+@dv_routes.after_app_request
+def set_session_cookie(response):
+    if 'session_id' in g:
+        response.set_cookie(SESSION_COOKIE, g.session_id, httponly=True, samesite='Lax')
+    return response
+
 
 @dv_routes.route('/static/<path:filename>')
 def static_files(filename):
@@ -24,40 +49,44 @@ def index():
     return render_template("index.html")
 
 
-def construct_info(max_ed: float = None,
+def construct_info(view: responses.ViewState,
+                   max_ed: float = None,
                    rid: list[int] = None,
                    resp_index: int = None,
                    n_responses: int = None,
-                   todo_html: str = None):
+                   todo_html: str = None,
+                   with_histograms: bool = True):
+    # the histograms of the whole active set are only sent when the active set changed,
+    # navigating within the active set only sends the current response
 
     if max_ed is None:
-        max_ed = responses.get_max_ed()
+        max_ed = view.get_max_ed()
 
     if rid is None:
-        rid = responses.get_cur_id()
+        rid = view.get_cur_id()
 
     if resp_index is None:
-        resp_index = responses.get_index()
+        resp_index = view.get_index()
 
     if n_responses is None:
-        n_responses = responses.get_nr_responses()
+        n_responses = view.get_nr_responses()
 
     if todo_html is None:
-        todo_html = responses.get_html()
-
-    num_versions = responses.get_num_versions()
-
-    all_max_edit_distances = responses.get_all_max_edit_distances()
+        todo_html = view.get_html()
 
-    return jsonify({
+    info = {
         "index": resp_index,
         "n_responses": n_responses,
         "rid": rid,
         "max_ed": int(max_ed),
-        "html": todo_html,
-        "num_versions": num_versions,
-        "all_max_edit_distances": all_max_edit_distances
-    })
+        "html": todo_html
+    }
+
+    if with_histograms:
+        info["num_versions"] = view.get_num_versions()
+        info["all_max_edit_distances"] = view.get_all_max_edit_distances()
+
+    return jsonify(info)
 
 
 @dv_routes.route("/api/reload", methods=["GET"])
@@ -74,13 +103,68 @@ def reload():
 
 @dv_routes.route("/api/info", methods=["GET"])
 def get_info():
-    return construct_info(), 200
+    return construct_info(get_view()), 200
+
+
+# Payloads smaller than this are not compressed
+MIN_COMPRESS_SIZE = 1024
+
+
+def compressed_json(payload: Any):
+    """
+    A json response with 'payload', gzip-compressed if the browser accepts it.
+    """
+    response = jsonify(payload)
+
+    if 'gzip' in request.accept_encodings and response.content_length and response.content_length >= MIN_COMPRESS_SIZE:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _history_request_key(view: responses.ViewState) -> tuple:
+    # the current response, or the response given by the 'response' argument as
+    # '<assignment>-<exercise>-<question>-<response>'
+    ids = [int(i) for i in request.args['response'].split('-')] if 'response' in request.args else None
+    return view.history_key(ids)
+
+
+def _conditional(key: tuple, render):
+    # the history is only rendered again when it changed, a browser that has it already gets 304 Not Modified
+    etag = responses.history_etag(key)
+
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = compressed_json(render())
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @dv_routes.route("/api/history", methods=["GET"])
 def get_history():
+    # the whole history, or only the header of its compact form if the 'format' argument is 'delta'
+    try:
+        view = get_view()
+        key = _history_request_key(view)
+        compact = request.args.get('format') == 'delta'
+        return _conditional(key, lambda: view.get_history(key, compact))
+    except (FileNotFoundError, ValueError) as e:
+        logger.error(e)
+        return jsonify({"error": e.args}), 500
+
+
+@dv_routes.route("/api/history/chunk", methods=["GET"])
+def get_history_chunk():
+    # the chunk of the compact form of the history that starts at the snapshot given by the 'start' argument
     try:
-        return responses.get_history(), 200
+        key = _history_request_key(get_view())
+        start = int(request.args.get('start', 0))
+        return _conditional(key, lambda: responses.get_history_chunk(key, start))
     except (FileNotFoundError, ValueError) as e:
         logger.error(e)
         return jsonify({"error": e.args}), 500
@@ -88,21 +172,24 @@ def get_history():
 
 @dv_routes.route("/api/nextResponse", methods=["GET"])
 def next_response():
-    responses.next_response()
-    return construct_info(), 200
+    view = get_view()
+    view.next_response()
+    return construct_info(view, with_histograms=False), 200
 
 
 @dv_routes.route("/api/previousResponse", methods=["GET"])
 def previous_response():
-    responses.previous_response()
-    return construct_info(), 200
+    view = get_view()
+    view.previous_response()
+    return construct_info(view, with_histograms=False), 200
 
 
 @dv_routes.route("/api/response/index/<i>", methods=["GET"])
 def specific_response_index(i):
+    view = get_view()
     try:
-        responses.specific_response_index(int(i))
-        return construct_info(), 200
+        view.specific_response_index(int(i))
+        return construct_info(view, with_histograms=False), 200
     except ValueError as e:
         logger.error(e)
         return jsonify({"error": e.args}), 500
@@ -110,9 +197,10 @@ def specific_response_index(i):
 
 @dv_routes.route("/api/response/id/<i>", methods=["GET"])
 def specific_response_id(i):
+    view = get_view()
     try:
-        responses.specific_response_id(int(i))
-        return construct_info(), 200
+        view.specific_response_id(int(i))
+        return construct_info(view, with_histograms=False), 200
     except ValueError as e:
         logger.error(e)
         return jsonify({"error": e.args}), 500
@@ -121,8 +209,26 @@ def specific_response_id(i):
 @dv_routes.route("/api/striphtml", methods=["POST"])
 def strip_html():
     data = request.get_json()
-    responses.set_html(data["value"])
-    return responses.get_history(), 200
+    view = get_view()
+    try:
+        view.set_html(data["value"])
+        # the header of the compact form, the viewer fetches the snapshots in chunks
+        return compressed_json(view.get_history(compact=True)), 200
+    except (FileNotFoundError, ValueError) as e:
+        logger.error(e)
+        return jsonify({"error": e.args}), 500
+
+
+@dv_routes.route("/api/sort", methods=["POST"])
+def sort_responses():
+    data = request.get_json()
+    view = get_view()
+    try:
+        view.set_sort(data["value"])
+        return construct_info(view), 200
+    except ValueError as e:
+        logger.error(e)
+        return jsonify({"error": e.args}), 500
 
 
 @dv_routes.route("/api/id_tree", methods=["GET"])
@@ -138,19 +244,112 @@ def get_names_tree():
 @dv_routes.route("/api/set_active_set", methods=["POST"])
 def set_active_set():
     data = request.get_json()
+    view = get_view()
     try:
         logger.info(f"Setting active set to {data}")
-        responses.set_active_set(data)
-        return construct_info(), 200
+        view.set_active_set(data)
+        return construct_info(view), 200
     except (FileNotFoundError, ValueError) as e:
         logger.error(e)
         return jsonify({"error": e.args}), 500
 
 
+@dv_routes.route("/api/responses", methods=["GET"])
+def get_responses():
+    # a page of the active set, in the order it is ranked in,
+    # given by the 'offset' and 'limit' arguments
+    try:
+        return jsonify(get_view().get_response_page(int(request.args.get('offset', 0)),
+                                                    int(request.args.get('limit', 100)))), 200
+    except ValueError as e:
+        logger.error(e)
+        return jsonify({"error": e.args}), 500
+
+
+@dv_routes.route("/api/responses/range", methods=["GET"])
+def get_responses_in_range():
+    # a page of the responses in the active set with a max edit distance between the 'min_ed' and 'max_ed'
+    # arguments, either can be left out
+    try:
+        min_ed = request.args.get('min_ed')
+        max_ed = request.args.get('max_ed')
+        return jsonify(get_view().get_responses_in_range(None if min_ed is None else int(min_ed),
+                                                         None if max_ed is None else int(max_ed),
+                                                         int(request.args.get('offset', 0)),
+                                                         int(request.args.get('limit', 100)))), 200
+    except ValueError as e:
+        logger.error(e)
+        return jsonify({"error": e.args}), 500
+
+
+@dv_routes.route("/api/similarity", methods=["GET"])
+def get_similarity():
+    # the question is given by the 'assignment', 'exercise' and 'question' arguments,
+    # or is the question of the current response if they are left out
+    try:
+        if 'question' in request.args:
+            question_ids = [int(request.args[key]) for key in ('assignment', 'exercise', 'question')]
+        else:
+            question_ids = get_view().get_cur_id()[:3]
+
+        return jsonify(responses.get_similar_pairs(question_ids, int(request.args.get('k', 20)))), 200
+    except (FileNotFoundError, ValueError, KeyError) as e:
+        logger.error(e)
+        return jsonify({"error": e.args}), 500
+
+
+@dv_routes.route("/api/near_duplicates", methods=["GET"])
+def get_near_duplicates():
+    # the response is given by the 'assignment', 'exercise', 'question' and 'response' arguments,
+    # or is the current response if they are left out
+    try:
+        if 'response' in request.args:
+            ids = [int(request.args[key]) for key in ('assignment', 'exercise', 'question', 'response')]
+        else:
+            ids = get_view().get_cur_id()
+
+        return jsonify(responses.get_near_duplicates(ids)), 200
+    except (FileNotFoundError, ValueError, KeyError) as e:
+        logger.error(e)
+        return jsonify({"error": e.args}), 500
+
+
 @dv_routes.route("/api/recheck", methods=["GET"])
 def recheck():
     out = responses.test_all()
     return jsonify({
         "status": out,
+        "jobs": responses.get_job_counts()
     }), 200
 
+
+@dv_routes.route("/api/jobs", methods=["GET"])
+def get_jobs():
+    # the most recent computation jobs, optionally only those in the given 'state',
+    # together with the number of jobs in every state
+    try:
+        return jsonify({
+            "counts": responses.get_job_counts(),
+            "jobs": responses.get_jobs(request.args.get('state'), int(request.args.get('limit', 100)))
+        }), 200
+    except ValueError as e:
+        logger.error(e)
+        return jsonify({"error": e.args}), 400
+
+
+@dv_routes.route("/api/jobs/<int:job_id>", methods=["GET"])
+def get_job(job_id: int):
+    job = responses.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"No job with id {job_id}"}), 404
+
+    return jsonify(job), 200
+
+
+@dv_routes.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    # the time spent in every stage and the event counters, in the Prometheus text format
+    response = make_response(metrics.render(), 200)
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
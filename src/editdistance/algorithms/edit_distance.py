@@ -1,11 +1,11 @@
 import ctypes
-import pickle
-from os import makedirs
 from pathlib import Path
 import logging
 from threading import Lock
 
-from . import suffix_array_naive, suffix_array_improved, util
+from . import snapshot_text, suffix_array_naive, suffix_array_improved, suffix_array_sais, suffix_automaton, util
+from src import metrics
+from .. import result_store, signals
 
 
 # author: Valentijn van den Berg
@@ -40,19 +40,36 @@ def lz77_improved_algorithm(pickle_file_path: Path) -> list[list[int]]:
     return suffix_array_improved.compute_suffix_array(pickle_file_path)
 
 
+def lz77_sais_algorithm(pickle_file_path: Path) -> list[list[int]]:
+    return suffix_array_sais.compute_suffix_array(pickle_file_path)
+
+
 # Whether to use the python implementations or not
 USE_PYTHON = True
 
 alg_dict = {
     "naive": lz77_naive_algorithm,
-    "improved": lz77_improved_algorithm
+    "improved": lz77_improved_algorithm,
+    "sais": lz77_sais_algorithm
+}
+
+# The algorithms that can factorize already encoded snapshots, used for batch processing
+word_alg_dict = {
+    "improved": suffix_array_improved.compute_suffix_array_from_codes,
+    "sais": suffix_array_sais.compute_suffix_array_from_codes
 }
 
+# The algorithm used when none is specified
+DEFAULT_ALGORITHM = "improved"
+
 
 n_running_jobs = 0
 lock = Lock()
 logger = logging.getLogger()
 
+metrics.gauge('running_jobs', "Computation jobs that were queued or are running, and have not finished yet.",
+              lambda: n_running_jobs)
+
 
 def add_to_running_jobs(amount: int = 1):
     try:
@@ -63,7 +80,15 @@ def add_to_running_jobs(amount: int = 1):
         print(f"Error while adding to/removing from running_jobs! Exception: {e}")
 
 
-def compute_edit_distances(algorithm: str, base_path: Path, rel_pickle_file_path: Path, result_directory: Path) -> None:
+def _finish_job(count_job: bool, failed: bool = False):
+    metrics.count('jobs_failed' if failed else 'jobs_done')
+    if count_job:
+        add_to_running_jobs(-1)
+
+
+def compute_edit_distances(algorithm: str, base_path: Path, rel_pickle_file_path: Path, result_directory: Path,
+                           count_job: bool = True, incremental: bool = False,
+                           write: bool = True) -> list[tuple[list[int], dict]]:
     """
     Compute the edit distance for a sequence of words.
 
@@ -71,29 +96,42 @@ def compute_edit_distances(algorithm: str, base_path: Path, rel_pickle_file_path
     :param base_path: the root path of the data
     :param rel_pickle_file_path: the path to the pickle file relative to 'base_path'
     :param result_directory: where to store the results
+    :param count_job: whether to remove this job from the running jobs when done.
+                      False when running in a worker process, then the submitting process keeps count.
+    :param incremental: whether to resume the factorization from the state saved next to the previous result.
+                        Then only the snapshots that were added since the previous computation are factorized.
+    :param write: whether to write the result. If False, the caller writes the returned result.
+    :return: the result as a list of (ids, result), see result_store.write_results. Empty if it failed.
     """
     global n_running_jobs
 
     logger.info(f"Computing edit distance for response {rel_pickle_file_path.stem}")
 
+    results = []
+
     try:
         if algorithm not in alg_dict:
             raise RuntimeError(f"Unknown algorithm: {algorithm}")
 
+        # the stripped text is read from the text file next to the response, if it was stripped before
+        version_history, texts = snapshot_text.load_history(base_path / rel_pickle_file_path)
+        codes, is_separator, artificial_flags = util.extract_content(version_history, texts=texts)
+
         try:
-            factorization = alg_dict[algorithm](base_path / rel_pickle_file_path)
+            if incremental:
+                factorization = suffix_automaton.factorize_incremental(
+                    codes, is_separator, suffix_automaton.state_path(result_directory / rel_pickle_file_path),
+                    key=[Path(rel_pickle_file_path).as_posix()])
+            elif algorithm in word_alg_dict:
+                factorization = word_alg_dict[algorithm](codes, is_separator)
+            else:
+                factorization = alg_dict[algorithm](base_path / rel_pickle_file_path)
         
         except Exception as e:
             print(f"The factorization algorithm produced an error! The input file was determined via {base_path} and {rel_pickle_file_path}")
             raise e
 
-        write_dir = (result_directory / rel_pickle_file_path.parent).resolve()
-        makedirs(write_dir, exist_ok=True)
-
         try:
-            # Get the artificial flags from the util
-            _, _, artificial_flags = util.extract_content(pickle.load(open(base_path / rel_pickle_file_path, "rb")))
-            
             # Distance is the length of factorization, unless it's artificial
             ed = []
             for i, x in enumerate(factorization):
@@ -106,23 +144,47 @@ def compute_edit_distances(algorithm: str, base_path: Path, rel_pickle_file_path
             ed = [0]
             print(f"An exception occurred when trying to list the factorization counts! Fall-back to [0]. Exception: {e}")
 
-        with open((write_dir / rel_pickle_file_path.name).resolve(), 'wb') as file:
-            pickle.dump({
+        timestamps = [util.parse_timestamp_us(version.get("timestamp"))
+                      for version, text in zip(version_history, texts) if text is not None]
+        response_signals, = signals.compute_signals(factorization, timestamps, artificial_flags,
+                                                    [0] * len(factorization), 1)
+
+        results = [(
+            result_store.ids_from_rel_path(rel_pickle_file_path),
+            {
                 'factorization': factorization,
                 'edit_distances': ed,
-                'max': max(ed + [0])
-            }, file)
+                'max': max(ed + [0]),
+                'signals': response_signals
+            }
+        )]
+
+        if write:
+            result_store.write_results(result_directory, results)
 
     except Exception as e:
         print(f"An exception occurred while computing the edit distance for response {rel_pickle_file_path}!\n "
               f"Exception message: {e}")
 
-    add_to_running_jobs(-1)
+    _finish_job(count_job, failed=not results)
 
     logger.info(f"Completed response {rel_pickle_file_path.stem}. Number of remaining jobs: {n_running_jobs}")
 
+    return results
+
+
+def _batch_state_path(response_paths: list, result_directory: Path) -> Path:
+    """
+    The factorization state of a batch is kept next to the result of its first response,
+    in a file of its own, so it does not replace the state of that response by itself.
+    """
+    first = min(Path(r['rel_file_path']).as_posix() for r in response_paths)
+    return suffix_automaton.state_path(result_directory / first).with_suffix('.batch.lzstate')
+
 
-def compute_edit_distances_batch(algorithm: str, base_path: Path, response_paths: list, result_directory: Path) -> None:
+def compute_edit_distances_batch(algorithm: str, base_path: Path, response_paths: list, result_directory: Path,
+                                 count_job: bool = True, incremental: bool = False,
+                                 write: bool = True) -> list[tuple[list[int], dict]]:
     """
     Compute the edit distance for a batch of responses from the same (assignment_id, result_id).
     All snapshots are sorted by timestamp and processed together, but results are mapped back to individual questions.
@@ -131,44 +193,57 @@ def compute_edit_distances_batch(algorithm: str, base_path: Path, response_paths
     :param base_path: the root path of the data
     :param response_paths: list of dicts with 'base_path' and 'rel_file_path' keys
     :param result_directory: where to store the results
+    :param count_job: whether to remove this job from the running jobs when done.
+                      False when running in a worker process, then the submitting process keeps count.
+    :param incremental: whether to resume the factorization from the state saved next to the previous result.
+                        Then only the snapshots that were added since the previous computation are factorized.
+    :param write: whether to write the results. If False, the caller writes the returned results.
+    :return: the results as a list of (ids, result), see result_store.write_results. Empty if it failed.
     """
     global n_running_jobs
     
     if not response_paths:
         logger.warning("Empty response_paths list, skipping batch")
-        add_to_running_jobs(-1)
-        return
+        _finish_job(count_job)
+        return []
+
+    results = []
     
     logger.info(f"Computing edit distance for batch of {len(response_paths)} responses")
     
     try:
-        if algorithm != "improved":
-            raise RuntimeError(f"Batch processing only supports 'improved' algorithm, got: {algorithm}")
+        if algorithm not in word_alg_dict:
+            raise RuntimeError(f"Batch processing only supports the algorithms {list(word_alg_dict)}, got: {algorithm}")
         
         # Extract and sort all snapshots across all questions
-        word, separation_indices, snapshot_metadata = util.extract_all_snapshots_sorted(
+        codes, is_separator, snapshot_metadata = util.extract_all_snapshots_sorted(
             response_paths, base_path, remove_html=True
         )
         
-        if len(word) == 0:
+        if len(codes) == 0:
             logger.warning("No snapshots found in batch, skipping")
             # Still write empty results for each question
-            for response_info in response_paths:
-                rel_path = Path(response_info['rel_file_path'])
-                write_dir = (result_directory / rel_path.parent).resolve()
-                makedirs(write_dir, exist_ok=True)
-                with open((write_dir / rel_path.name).resolve(), 'wb') as file:
-                    pickle.dump({
-                        'factorization': [],
-                        'edit_distances': [0],
-                        'max': 0
-                    }, file)
-            add_to_running_jobs(-1)
-            return
+            results = [
+                (result_store.ids_from_rel_path(response_info['rel_file_path']), {
+                    'factorization': [],
+                    'edit_distances': [0],
+                    'max': 0
+                })
+                for response_info in response_paths
+            ]
+            if write:
+                result_store.write_results(result_directory, results)
+            _finish_job(count_job)
+            return results
         
         # Compute LZ factorization
         try:
-            factorization = suffix_array_improved.compute_suffix_array_from_word(word, separation_indices)
+            if incremental:
+                factorization = suffix_automaton.factorize_incremental(
+                    codes, is_separator, _batch_state_path(response_paths, result_directory),
+                    key=sorted(Path(r['rel_file_path']).as_posix() for r in response_paths))
+            else:
+                factorization = word_alg_dict[algorithm](codes, is_separator)
         except Exception as e:
             print(f"The factorization algorithm produced an error! Exception: {e}")
             raise e
@@ -186,7 +261,18 @@ def compute_edit_distances_batch(algorithm: str, base_path: Path, response_paths
                 'factorization': factorization[idx] if idx < len(factorization) else []
             })
         
-        # Write results for each question
+        # Compute the paste signals of all responses in one pass
+        response_index = {Path(r['rel_file_path']).as_posix(): i for i, r in enumerate(response_paths)}
+        factorized_metadata = snapshot_metadata[:len(factorization)]
+        batch_signals = signals.compute_signals(
+            factorization[:len(factorized_metadata)],
+            [metadata['timestamp'] for metadata in factorized_metadata],
+            [metadata['is_artificial'] for metadata in factorized_metadata],
+            [response_index[metadata['question_path']] for metadata in factorized_metadata],
+            len(response_paths)
+        )
+
+        # Write results for each question, all at once
         for response_info in response_paths:
             rel_path_str = Path(response_info['rel_file_path']).as_posix()  # Normalize for comparison
             rel_path = Path(response_info['rel_file_path'])
@@ -211,15 +297,15 @@ def compute_edit_distances_batch(algorithm: str, base_path: Path, response_paths
                     else:
                         question_edit_distances.append(len(s['factorization']))
             
-            write_dir = (result_directory / rel_path.parent).resolve()
-            makedirs(write_dir, exist_ok=True)
-            
-            with open((write_dir / rel_path.name).resolve(), 'wb') as file:
-                pickle.dump({
-                    'factorization': question_factorizations,
-                    'edit_distances': question_edit_distances,
-                    'max': max(question_edit_distances + [0])
-                }, file)
+            results.append((result_store.ids_from_rel_path(rel_path), {
+                'factorization': question_factorizations,
+                'edit_distances': question_edit_distances,
+                'max': max(question_edit_distances + [0]),
+                'signals': batch_signals[response_index[rel_path_str]]
+            }))
+
+        if write:
+            result_store.write_results(result_directory, results)
         
         logger.info(f"Completed batch of {len(response_paths)} responses")
         
@@ -228,6 +314,9 @@ def compute_edit_distances_batch(algorithm: str, base_path: Path, response_paths
               f"Exception message: {e}")
         import traceback
         traceback.print_exc()
+        results = []
     
-    add_to_running_jobs(-1)
-    logger.info(f"Number of remaining jobs: {n_running_jobs}")
\ No newline at end of file
+    _finish_job(count_job, failed=not results)
+    logger.info(f"Number of remaining jobs: {n_running_jobs}")
+
+    return results
\ No newline at end of file
@@ -1,6 +1,9 @@
+from array import array
 from collections import deque
 from copy import deepcopy
 
+import numpy as np
+
 
 def compute_lpf(sa: list[int], lcp: list[int], n: int, in_place: bool = False):
     """
@@ -16,14 +19,15 @@ def compute_lpf(sa: list[int], lcp: list[int], n: int, in_place: bool = False):
         sa = deepcopy(sa)
         lcp = deepcopy(lcp)
 
-    sa[n - 1] = -1
-    lcp[n - 1] = 0
+    # sentinel at position n, which pops every remaining index off the stack
+    sa.append(-1)
+    lcp.append(0)
     lpf = [-1] * n
 
     stack = deque()
     stack.append(0)
 
-    for i in range(n):
+    for i in range(1, n + 1):
         while len(stack) > 0 and (sa[i] < sa[stack[-1]] or (sa[i] > sa[stack[-1]] and lcp[i] <= lcp[stack[-1]])):
             top = stack[-1]
 
@@ -34,9 +38,12 @@ def compute_lpf(sa: list[int], lcp: list[int], n: int, in_place: bool = False):
                 lpf[sa[top]] = lcp[top]
             stack.pop()
 
-        if i < n - 1:
+        if i < n:
             stack.append(i)
 
+    sa.pop()
+    lcp.pop()
+
     return lpf
 
 
@@ -68,3 +75,116 @@ def compute_lz(lpf: list[int], n: int, separation_indices: list[int]) -> list[li
 
     return lz
 
+
+
+def compute_lpf_compact(sa, lcp, n: int) -> array:
+    """
+    Compute the longest previous factor array, like compute_lpf, on compact integer arrays.
+    The inputs are never modified, only compact copies of them are.
+
+    :param sa: the suffix array, a list, array or NumPy array
+    :param lcp: the longest common prefix array, a list, array or NumPy array
+    :param n: the length of the word
+    :return: the longest previous factor array as array('i')
+    """
+    sa = _as_int_array(sa)
+    lcp = _as_int_array(lcp)
+
+    # sentinel at position n, which pops every remaining index off the stack
+    sa.append(-1)
+    lcp.append(0)
+    lpf = array('i', [-1]) * n
+
+    stack = array('i', [0])
+    push = stack.append
+    pop = stack.pop
+
+    for i in range(1, n + 1):
+        sa_i = sa[i]
+        lcp_i = lcp[i]
+
+        while stack:
+            top = stack[-1]
+            sa_top = sa[top]
+
+            if sa_i < sa_top:
+                lcp_top = lcp[top]
+                lpf[sa_top] = lcp_top if lcp_top > lcp_i else lcp_i
+                if lcp_top < lcp_i:
+                    lcp_i = lcp_top
+            elif sa_i > sa_top and lcp_i <= lcp[top]:
+                lpf[sa_top] = lcp[top]
+            else:
+                break
+
+            pop()
+
+        lcp[i] = lcp_i
+
+        if i < n:
+            push(i)
+
+    return lpf
+
+
+def compute_lz_compact(lpf, n: int, separation_indices) -> list[list[int]]:
+    """
+    Compute the Lempel-Ziv factorization, like compute_lz, with a bitmap for the separation indices.
+
+    :param lpf: the longest previous factor array.
+    :param n: the length of word
+    :param separation_indices: the indices of the separation characters.
+    :return: the lz factorization of the original word.
+    """
+    is_separator = bytearray(n)
+    for index in separation_indices:
+        if 0 <= index < n:
+            is_separator[index] = 1
+
+    return compute_lz_bitmap(lpf, n, is_separator)
+
+
+def compute_lz_bitmap(lpf, n: int, is_separator) -> list[list[int]]:
+    """
+    Compute the Lempel-Ziv factorization, like compute_lz, where the separators are given as a bitmap.
+
+    :param lpf: the longest previous factor array.
+    :param n: the length of word
+    :param is_separator: for every position of the word whether it is a separator,
+                         a bytearray or boolean NumPy array, see text_encoding.encode_snapshots
+    :return: the lz factorization of the original word.
+    """
+    if isinstance(is_separator, np.ndarray):
+        is_separator = is_separator.astype(np.bool_).tobytes()
+
+    lz = [[]]
+    current = lz[0]
+    prev_index = 0
+
+    while prev_index < n - 1:
+        delta = lpf[prev_index]
+        if delta < 1:
+            delta = 1
+
+        # if a separation character is reached, begin a new list
+        if delta == 1 and is_separator[prev_index]:
+            current = []
+            lz.append(current)
+
+        # otherwise add delta to the list
+        else:
+            current.append(delta)
+
+        prev_index += delta
+
+    return lz
+
+
+def _as_int_array(values) -> array:
+    """
+    Make a compact copy of 'values' as array('i').
+    """
+    if isinstance(values, np.ndarray):
+        return array('i', values.astype(np.int32).tobytes())
+
+    return array('i', values)
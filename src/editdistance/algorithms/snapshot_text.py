@@ -0,0 +1,178 @@
+import hashlib
+import os
+import pickle
+import threading
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from src import metrics
+
+# The stripped text of a response '<id>.pickle' is kept in '<id>.text' next to it.
+# It must not end in '.pickle', since those files are the responses themselves.
+TEXT_SUFFIX = '.text'
+
+# Increase when strip_html changes, older text files are then stripped again.
+TEXT_VERSION = 1
+
+# The text inside these tags is not part of the text of a snapshot, like BeautifulSoup's get_text.
+_EXCLUDED_TAGS = frozenset({'script', 'style', 'template', 'rt', 'rp'})
+
+# Whitespace inside these tags is kept as is, elsewhere a string of only whitespace is collapsed.
+_PRESERVE_WHITESPACE_TAGS = frozenset({'pre', 'textarea'})
+
+_ASCII_SPACES = str.maketrans('', '', '\x20\x0a\x09\x0c\x0d')
+
+class _TextCollector:
+    """
+    Parser target that collects the text of a document from the events of lxml's html parser,
+    the same way BeautifulSoup builds its strings from these events.
+    """
+
+    def __init__(self):
+        self.parts: list[str] = []
+        self._data: list[str] = []
+        self._open_tags: list[str] = []
+        self._n_preserve = 0
+        self._containers: list[str] = []
+
+    def _end_data(self, is_text: bool = True):
+        if not self._data:
+            return
+
+        text = ''.join(self._data)
+        self._data = []
+
+        # a string of only whitespace is collapsed, unless it is inside <pre> or <textarea>
+        if self._n_preserve == 0 and text.translate(_ASCII_SPACES) == '':
+            text = '\n' if '\n' in text else ' '
+
+        # the text of comments and processing instructions, and inside <script>, <style> etc. is left out
+        if is_text and not self._containers:
+            self.parts.append(text)
+
+    def start(self, name, attrs, nsmap=None):
+        self._end_data()
+        self._open_tags.append(name)
+        if name in _PRESERVE_WHITESPACE_TAGS:
+            self._n_preserve += 1
+        if name in _EXCLUDED_TAGS:
+            self._containers.append(name)
+
+    def end(self, name):
+        self._end_data()
+        if name not in self._open_tags:
+            return
+
+        # close every tag up to and including the most recent tag with this name
+        while self._open_tags:
+            tag = self._open_tags.pop()
+            if tag in _PRESERVE_WHITESPACE_TAGS:
+                self._n_preserve -= 1
+            if tag in _EXCLUDED_TAGS:
+                self._containers.pop()
+            if tag == name:
+                break
+
+    def data(self, content):
+        self._data.append(content)
+
+    def comment(self, content):
+        self._end_data()
+        self._data.append(content)
+        self._end_data(is_text=False)
+
+    def pi(self, target, data):
+        self._end_data()
+        self._data.append(target + ' ' + data)
+        self._end_data(is_text=False)
+
+    def doctype(self, name, pubid, system):
+        self._end_data()
+
+    def close(self):
+        self._end_data()
+        return ''.join(self.parts)
+
+
+def strip_html(content: str) -> str:
+    """
+    Remove all html from 'content'. The result is the same as BeautifulSoup(content, 'lxml').get_text(),
+    but only the text is collected from lxml's parser, no BeautifulSoup tree is built.
+
+    :param content: the html of a snapshot
+    :return: the text of the snapshot
+    """
+    if content[:1] == '\N{BYTE ORDER MARK}':
+        content = content[1:]
+
+    collector = _TextCollector()
+    try:
+        # fed at once like BeautifulSoup does, lxml's events can depend on how the document is split
+        parser = etree.HTMLParser(target=collector, recover=True)
+        parser.feed(content)
+        parser.close()
+    except (UnicodeDecodeError, LookupError, etree.ParserError):
+        # BeautifulSoup tries other encodings after this, leave these rare documents to BeautifulSoup itself
+        return BeautifulSoup(content, 'lxml').get_text()
+
+    return collector.close()
+
+
+def _has_content(version: dict) -> bool:
+    return "changes" in version and "content" in version["changes"] and version["changes"]["content"] is not None
+
+
+def text_path(pickle_path: Path) -> Path:
+    """
+    The path of the file with the stripped text of the response at 'pickle_path'.
+    """
+    return pickle_path.with_suffix(TEXT_SUFFIX)
+
+
+def load_history(pickle_path: Path) -> tuple[list[dict], list[str | None]]:
+    """
+    Load the version history of a response together with the stripped text of every version.
+    The text is read from the text file next to the response if it was stripped from the same content before,
+    otherwise the html is stripped and the text file is written.
+
+    :param pickle_path: the path of the response
+    :return: Tuple (version_history, texts), where texts contains the stripped text of every version,
+             or None for versions without content.
+    """
+    with metrics.timed('pickle_load'):
+        with open(pickle_path, 'rb') as file:
+            raw = file.read()
+
+        version_history = pickle.loads(raw)
+    content_hash = hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    path = text_path(pickle_path)
+    try:
+        with open(path, 'rb') as file:
+            cached = pickle.load(file)
+
+        if cached['version'] == TEXT_VERSION and cached['hash'] == content_hash:
+            metrics.count('text_cache_hits')
+            return version_history, cached['texts']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+
+    with metrics.timed('strip_html'):
+        texts = [strip_html(version["changes"]["content"]) if _has_content(version) else None
+                 for version in version_history]
+    metrics.count('snapshots_stripped', sum(text is not None for text in texts))
+
+    # write to a file of this process and thread first, so readers never see a partially written file
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as file:
+            pickle.dump({'version': TEXT_VERSION, 'hash': content_hash, 'texts': texts}, file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError:
+        # the text is only a cache, the history can still be used without it
+        pass
+
+    return version_history, texts
@@ -1,5 +1,8 @@
 from pathlib import Path
 
+import numpy as np
+
+from src import metrics
 from . import util, lz77
 
 
@@ -74,6 +77,84 @@ def compute_lcp(word, sa, n):
     return lcp
 
 
+def improved_suffix_array_np(codes: np.ndarray, n: int) -> np.ndarray:
+    """
+    Compute the suffix array with prefix doubling, where every round ranks all suffixes at once with NumPy.
+    Stops as soon as all ranks are unique, instead of always doing log(n) rounds.
+
+    :param codes: the encoded word, see text_encoding.encode_snapshots
+    :param n: the length of the word
+    :return: the suffix array as an int64 array
+    """
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # dense ranks of the single characters
+    _, rank = np.unique(codes, return_inverse=True)
+    rank = rank.astype(np.int64)
+    sa = np.argsort(rank, kind='stable')
+
+    l = 1
+    while l < n:
+        if rank[sa[-1]] == n - 1:
+            break
+
+        # (rank[i], rank[i + l]) as one key, a suffix shorter than l gets 0 as its second rank
+        second = np.zeros(n, dtype=np.int64)
+        second[:n - l] = rank[l:] + 1
+        key = rank * (n + 1) + second
+
+        sa = np.argsort(key, kind='stable')
+        sorted_key = key[sa]
+
+        new_rank = np.empty(n, dtype=np.int64)
+        new_rank[sa] = np.concatenate(([0], np.cumsum(sorted_key[1:] != sorted_key[:-1])))
+        rank = new_rank
+
+        l *= 2
+
+    return sa
+
+
+def compute_lcp_np(codes: np.ndarray, sa: np.ndarray, n: int) -> list[int]:
+    """
+    Compute the longest common prefix array with Kasai's algorithm,
+    where the rank inversion is done with array operations.
+
+    :param codes: the encoded word, see text_encoding.encode_snapshots
+    :param sa: the suffix array
+    :param n: the length of the word
+    :return: the lcp array
+    """
+    rank = np.empty(n, dtype=np.int64)
+    rank[sa] = np.arange(n, dtype=np.int64)
+
+    # predecessor of each suffix in the suffix array, the smallest suffix has none
+    prev = np.full(n, -1, dtype=np.int64)
+    prev[sa[1:]] = sa[:-1]
+
+    word = codes.tolist()
+    prev = prev.tolist()
+    rank = rank.tolist()
+
+    lcp = [0] * n
+    l = 0
+
+    for i in range(n):
+        j = prev[i]
+        if j == -1:
+            l = 0
+            continue
+
+        while i + l < n and j + l < n and word[i + l] == word[j + l]:
+            l += 1
+        lcp[rank[i]] = l
+        if l > 0:
+            l -= 1
+
+    return lcp
+
+
 def compute_suffix_array(pickle_file_path: Path) -> list[list[int]]:
     """
     Compute the lz compression of a list of snapshots.
@@ -83,64 +164,42 @@ def compute_suffix_array(pickle_file_path: Path) -> list[list[int]]:
              where $1 and $2 are unique separation characters.
     """
     try:
-        word, separation_indices = util.get_word_from_file(pickle_file_path)
-
-        n = len(word)
-
-        if n == 0:
-            return []
-    
+        codes, is_separator, _ = util.get_word_from_file(pickle_file_path)
     except Exception as e:
         print(f"Exception when parsing input from pickle to prepare for edit distance computation. The exception is {e}. Treating as empty.")
         return []
 
-    try:
-        sa = improved_suffix_array(word, n)
-        lcp = compute_lcp(word, sa, n)
-
-        del word
-
-        lpf = lz77.compute_lpf(sa, lcp, n, in_place=True)
-
-        lz = lz77.compute_lz(lpf, n, separation_indices)
-    except Exception as e:
-        print(f"Exception in compute_suffix_array. The exception was {e}. The input was {word} and {separation_indices}.")
-        
-        raise e
-
-    return lz
+    return compute_suffix_array_from_codes(codes, is_separator)
 
 
-def compute_suffix_array_from_word(word: str, separation_indices: list[int]) -> list[list[int]]:
+def compute_suffix_array_from_codes(codes: np.ndarray, is_separator: np.ndarray) -> list[list[int]]:
     """
-    Compute the lz compression from a pre-processed word and separation indices.
-    This is used for batch processing where snapshots are already sorted and concatenated.
+    Compute the lz compression from the encoded snapshots.
+    This is used for batch processing where snapshots are already sorted and encoded.
     
-    :param word: The concatenated word containing all snapshots
-    :param separation_indices: The indices where snapshots are separated
+    :param codes: the encoded snapshots, see text_encoding.encode_snapshots
+    :param is_separator: whether each position of codes is a separator
     :return: the Lempel-Ziv compression of the concentrated snapshots with separating characters.
     """
-    try:
-        n = len(word)
+    n = len(codes)
 
-        if n == 0:
-            return []
-    
-    except Exception as e:
-        print(f"Exception when processing word for edit distance computation. The exception is {e}. Treating as empty.")
+    if n == 0:
         return []
 
     try:
-        sa = improved_suffix_array(word, n)
-        lcp = compute_lcp(word, sa, n)
+        with metrics.timed('suffix_array'):
+            sa = improved_suffix_array_np(codes, n)
+        with metrics.timed('lcp'):
+            lcp = compute_lcp_np(codes, sa, n)
 
-        lpf = lz77.compute_lpf(sa, lcp, n, in_place=True)
+        with metrics.timed('lpf'):
+            lpf = lz77.compute_lpf_compact(sa, lcp, n)
 
-        lz = lz77.compute_lz(lpf, n, separation_indices)
+        with metrics.timed('lz'):
+            lz = lz77.compute_lz_bitmap(lpf, n, is_separator)
     except Exception as e:
-        print(f"Exception in compute_suffix_array_from_word. The exception was {e}.")
+        print(f"Exception in compute_suffix_array_from_codes. The exception was {e}.")
         
         raise e
 
     return lz
-
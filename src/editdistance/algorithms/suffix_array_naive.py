@@ -1,15 +1,16 @@
 import logging
 from pathlib import Path
 
+from src import metrics
 from . import util, lz77
 
 
-def compute_lcp(str1: str, str2: str) -> int:
+def compute_lcp(str1, str2) -> int:
     """
-    Compute the LCP between two strings.
+    Compute the LCP between two encoded words.
 
-    :param str1: string 1
-    :param str2: string 2
+    :param str1: encoded word 1
+    :param str2: encoded word 2
     :return: the longest common prefix between str1 and str2.
     """
     i = 0
@@ -21,7 +22,7 @@ def compute_lcp(str1: str, str2: str) -> int:
     return i
 
 
-def naive_suffix_array(w: str, n: int) -> tuple[list[int], list[int]]:
+def naive_suffix_array(w: list[int], n: int) -> tuple[list[int], list[int]]:
     sa = list(range(n))
     sa.sort(key=lambda k: w[k:])  # Sort indices by the suffix starting at each index
 
@@ -47,16 +48,20 @@ def compute_suffix_array(pickle_file_path: Path) -> list[list[int]]:
     logger = logging.getLogger()
     logger.info(f"Started lz77 (naive) with {pickle_file_path.stem}")
 
-    word, separation_indices = util.get_word_from_file(pickle_file_path)
+    codes, is_separator, _ = util.get_word_from_file(pickle_file_path)
 
-    n = len(word)
-    sa, lcp = naive_suffix_array(word, n)
+    n = len(codes)
+    # the naive suffix array comes with its lcp array
+    with metrics.timed('suffix_array'):
+        sa, lcp = naive_suffix_array(codes.tolist(), n)
 
-    del word
+    del codes
 
-    lpf = lz77.compute_lpf(sa, lcp, n, in_place=True)
+    with metrics.timed('lpf'):
+        lpf = lz77.compute_lpf_compact(sa, lcp, n)
 
-    lz = lz77.compute_lz(lpf, n, separation_indices)
+    with metrics.timed('lz'):
+        lz = lz77.compute_lz_bitmap(lpf, n, is_separator)
 
     logger.info(f"Completed lz77 with {pickle_file_path.stem}")
 
@@ -0,0 +1,223 @@
+from pathlib import Path
+
+import numpy as np
+
+from src import metrics
+from . import util, lz77
+
+
+# Below this length, sorting the suffixes directly is faster than the induced sorting.
+NAIVE_THRESHOLD = 10
+
+
+def rank_codes(codes: np.ndarray) -> tuple[list[int], int]:
+    """
+    Map the encoded word to the range [0, upper], preserving the order of the symbols.
+    The separators are in the alphabet too, so it can be as large as the number of snapshots.
+
+    :param codes: the encoded word, see text_encoding.encode_snapshots
+    :return: Tuple (ranked, upper), where
+             | *ranked*: the rank of each symbol of codes in the alphabet of codes.
+             | *upper*: the largest rank that occurs in ranked.
+    """
+    alphabet, ranked = np.unique(codes, return_inverse=True)
+
+    return ranked.tolist(), len(alphabet) - 1
+
+
+def sais_suffix_array(s: list[int], upper: int) -> list[int]:
+    """
+    Compute the suffix array of 's' with the SA-IS algorithm (Nong, Zhang and Chan) in O(n + upper) time.
+
+    :param s: the integer encoded word, every value should be in the range [0, upper]
+    :param upper: the largest value that may occur in s
+    :return: the suffix array of s
+    """
+    n = len(s)
+
+    if n == 0:
+        return []
+    if n < NAIVE_THRESHOLD:
+        return sorted(range(n), key=lambda i: s[i:])
+
+    sa = [-1] * n
+
+    # ls[i] is True if suffix i is an S-type suffix (smaller than suffix i + 1)
+    ls = [False] * n
+    for i in range(n - 2, -1, -1):
+        ls[i] = ls[i + 1] if s[i] == s[i + 1] else s[i] < s[i + 1]
+
+    # bucket boundaries: sum_l[c] is the start of bucket c, sum_s[c] the start of the S-type part of bucket c
+    sum_l = [0] * (upper + 1)
+    sum_s = [0] * (upper + 1)
+    for i in range(n):
+        if not ls[i]:
+            sum_s[s[i]] += 1
+        else:
+            sum_l[s[i] + 1] += 1
+
+    for c in range(upper + 1):
+        sum_s[c] += sum_l[c]
+        if c < upper:
+            sum_l[c + 1] += sum_s[c]
+
+    def induce(lms: list[int]):
+        for i in range(n):
+            sa[i] = -1
+
+        buf = sum_s[:]
+        for d in lms:
+            if d == n:
+                continue
+            sa[buf[s[d]]] = d
+            buf[s[d]] += 1
+
+        buf = sum_l[:]
+        sa[buf[s[n - 1]]] = n - 1
+        buf[s[n - 1]] += 1
+        for i in range(n):
+            v = sa[i]
+            if v >= 1 and not ls[v - 1]:
+                c = s[v - 1]
+                sa[buf[c]] = v - 1
+                buf[c] += 1
+
+        buf = sum_l[:]
+        for i in range(n - 1, -1, -1):
+            v = sa[i]
+            if v >= 1 and ls[v - 1]:
+                c = s[v - 1] + 1
+                buf[c] -= 1
+                sa[buf[c]] = v - 1
+
+    # find the left-most S-type positions
+    lms_map = [-1] * (n + 1)
+    lms = []
+    for i in range(1, n):
+        if not ls[i - 1] and ls[i]:
+            lms_map[i] = len(lms)
+            lms.append(i)
+    m = len(lms)
+
+    induce(lms)
+
+    if m > 0:
+        # name the sorted LMS substrings and sort them recursively
+        sorted_lms = [v for v in sa if lms_map[v] != -1]
+        rec_s = [0] * m
+        rec_upper = 0
+        rec_s[lms_map[sorted_lms[0]]] = 0
+
+        for i in range(1, m):
+            left, right = sorted_lms[i - 1], sorted_lms[i]
+            end_left = lms[lms_map[left] + 1] if lms_map[left] + 1 < m else n
+            end_right = lms[lms_map[right] + 1] if lms_map[right] + 1 < m else n
+
+            same = True
+            if end_left - left != end_right - right:
+                same = False
+            else:
+                while left < end_left:
+                    if s[left] != s[right]:
+                        break
+                    left += 1
+                    right += 1
+                if left == n or s[left] != s[right]:
+                    same = False
+
+            if not same:
+                rec_upper += 1
+            rec_s[lms_map[sorted_lms[i]]] = rec_upper
+
+        rec_sa = sais_suffix_array(rec_s, rec_upper)
+
+        for i in range(m):
+            sorted_lms[i] = lms[rec_sa[i]]
+
+        induce(sorted_lms)
+
+    return sa
+
+
+def compute_lcp(s: list[int], sa: list[int], n: int) -> list[int]:
+    """
+    Compute the longest common prefix array with Kasai's algorithm.
+
+    :param s: the integer encoded word
+    :param sa: the suffix array of s
+    :param n: the length of s
+    :return: the lcp array, where lcp[i] is the longest common prefix of the suffixes sa[i - 1] and sa[i].
+    """
+    rank = [0] * n
+    for i in range(n):
+        rank[sa[i]] = i
+
+    lcp = [0] * n
+    l = 0
+
+    for i in range(n):
+        r = rank[i]
+        if r == 0:
+            l = 0
+            continue
+
+        j = sa[r - 1]
+        while i + l < n and j + l < n and s[i + l] == s[j + l]:
+            l += 1
+        lcp[r] = l
+        if l > 0:
+            l -= 1
+
+    return lcp
+
+
+def compute_suffix_array(pickle_file_path: Path) -> list[list[int]]:
+    """
+    Compute the lz compression of a list of snapshots.
+    :param pickle_file_path: the path to the pickled list or dictionary containing the snapshots
+    :return: the Lempel-Ziv compression of the concentrated snapshots with separating characters.
+             Example: snapshots = [A, B, C] will be concatenated as A$1B$2C,
+             where $1 and $2 are unique separation characters.
+    """
+    try:
+        codes, is_separator, _ = util.get_word_from_file(pickle_file_path)
+    except Exception as e:
+        print(f"Exception when parsing input from pickle to prepare for edit distance computation. The exception is {e}. Treating as empty.")
+        return []
+
+    return compute_suffix_array_from_codes(codes, is_separator)
+
+
+def compute_suffix_array_from_codes(codes: np.ndarray, is_separator: np.ndarray) -> list[list[int]]:
+    """
+    Compute the lz compression from the encoded snapshots with the SA-IS backend.
+
+    :param codes: the encoded snapshots, see text_encoding.encode_snapshots
+    :param is_separator: whether each position of codes is a separator
+    :return: the Lempel-Ziv compression of the concentrated snapshots with separating characters.
+    """
+    n = len(codes)
+
+    if n == 0:
+        return []
+
+    try:
+        with metrics.timed('suffix_array'):
+            s, upper = rank_codes(codes)
+            sa = sais_suffix_array(s, upper)
+        with metrics.timed('lcp'):
+            lcp = compute_lcp(s, sa, n)
+
+        del s
+
+        with metrics.timed('lpf'):
+            lpf = lz77.compute_lpf_compact(sa, lcp, n)
+
+        with metrics.timed('lz'):
+            lz = lz77.compute_lz_bitmap(lpf, n, is_separator)
+    except Exception as e:
+        print(f"Exception in suffix_array_sais.compute_suffix_array_from_codes. The exception was {e}.")
+
+        raise e
+
+    return lz
@@ -0,0 +1,229 @@
+import pickle
+import threading
+from os import getpid, makedirs, replace
+from pathlib import Path
+
+import numpy as np
+
+
+class SuffixAutomaton:
+    """
+    Suffix automaton of a word that is built one character at a time.
+    It recognizes every substring of the characters that have been added so far.
+    """
+
+    def __init__(self):
+        self.length: list[int] = [0]
+        self.link: list[int] = [-1]
+        self.next: list[dict] = [{}]
+        self.last = 0
+
+    def extend(self, c) -> tuple[int, int] | None:
+        """
+        Add the character 'c' to the end of the word.
+
+        :param c: the character to add
+        :return: (q, clone) if state q was split, where clone took over the strings of q
+                 with a length of at most self.length[clone]. None otherwise.
+        """
+        length, link, nxt = self.length, self.link, self.next
+
+        cur = len(length)
+        length.append(length[self.last] + 1)
+        link.append(-1)
+        nxt.append({})
+
+        split = None
+        p = self.last
+        while p != -1 and c not in nxt[p]:
+            nxt[p][c] = cur
+            p = link[p]
+
+        if p == -1:
+            link[cur] = 0
+        else:
+            q = nxt[p][c]
+            if length[p] + 1 == length[q]:
+                link[cur] = q
+            else:
+                clone = len(length)
+                length.append(length[p] + 1)
+                link.append(link[q])
+                nxt.append(dict(nxt[q]))
+
+                while p != -1 and nxt[p].get(c) == q:
+                    nxt[p][c] = clone
+                    p = link[p]
+
+                link[q] = clone
+                link[cur] = clone
+                split = (q, clone)
+
+        self.last = cur
+        return split
+
+
+class IncrementalFactorization:
+    """
+    Lempel-Ziv factorization of a word that can be resumed when characters are appended to the word.
+
+    Every phrase is the longest prefix of the remaining word that also starts at an earlier position
+    (the longest previous factor), so the result is the same as the suffix array based factorization.
+    The automaton only ever contains the characters before the end of the phrase that is being matched.
+    """
+
+    def __init__(self):
+        self.automaton = SuffixAutomaton()
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.built = 0
+        self.position = 0
+        self.lz: list[list[int]] = [[]]
+
+    def can_resume(self, codes: np.ndarray) -> bool:
+        """
+        Whether 'codes' extends the encoded word that was factorized so far.
+        """
+        # states saved before the snapshots were encoded as integers have no codes, those are started over
+        previous = getattr(self, 'codes', None)
+        if previous is None:
+            return False
+
+        return len(codes) >= len(previous) and np.array_equal(codes[:len(previous)], previous)
+
+    def factorize(self, codes: np.ndarray, is_separator: np.ndarray) -> list[list[int]]:
+        """
+        Continue the factorization with 'codes', only the symbols that were not seen before are factorized.
+
+        :param codes: the encoded snapshots, see text_encoding.encode_snapshots. Should extend the previous codes.
+        :param is_separator: whether each position of codes is a separator
+        :return: the lz factorization of the whole word, the same as lz77.compute_lz would give.
+        """
+        if not self.can_resume(codes):
+            raise ValueError("The word does not extend the previously factorized word.")
+
+        n = len(codes)
+        if n == 0:
+            return []
+
+        word = codes.tolist()
+        is_separator = is_separator.astype(np.bool_).tobytes()
+
+        automaton = self.automaton
+        nxt = automaton.next
+        length = automaton.length
+
+        lz = self.lz
+        current = lz[-1]
+        position = self.position
+        built = self.built
+
+        while position < n - 1:
+            state = 0
+            matched = 0
+
+            # text[position:position + matched + 1] has an earlier occurrence
+            # if it occurs in text[:position + matched]
+            while position + matched < n:
+                while built < position + matched:
+                    split = automaton.extend(word[built])
+                    built += 1
+                    if split is not None and split[0] == state and matched <= length[split[1]]:
+                        state = split[1]
+
+                target = nxt[state].get(word[position + matched])
+                if target is None:
+                    break
+
+                state = target
+                matched += 1
+
+            delta = matched if matched > 1 else 1
+
+            # if a separation character is reached, begin a new list
+            if delta == 1 and is_separator[position]:
+                current = []
+                lz.append(current)
+
+            # otherwise add delta to the list
+            else:
+                current.append(delta)
+
+            position += delta
+
+        self.codes = codes
+        self.position = position
+        self.built = built
+
+        return [list(x) for x in lz]
+
+
+def state_path(result_file_path: Path) -> Path:
+    """
+    The path of the factorization state that belongs to a result file.
+    """
+    return result_file_path.with_suffix('.lzstate')
+
+
+def load_state(path: Path, key=None) -> IncrementalFactorization | None:
+    """
+    Load a factorization state.
+
+    :param path: the path of the state file
+    :param key: if given, the state is only returned if it was saved with the same key
+    :return: the state, or None if it does not exist or does not match the key
+    """
+    if not path.exists():
+        return None
+
+    try:
+        with open(path, 'rb') as file:
+            saved = pickle.load(file)
+    except Exception as e:
+        print(f"Could not load factorization state {path}, starting from scratch. Exception: {e}")
+        return None
+
+    if key is not None and saved.get('key') != key:
+        return None
+
+    return saved['state']
+
+
+def save_state(path: Path, state: IncrementalFactorization, key=None):
+    """
+    Save a factorization state, the file is replaced atomically.
+    """
+    makedirs(path.parent, exist_ok=True)
+
+    # a response can be computed by more than one job at the same time, every save writes to a file of its own first
+    tmp_path = path.with_name(f"{path.name}.{getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as file:
+            pickle.dump({'key': key, 'state': state}, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def factorize_incremental(codes: np.ndarray, is_separator: np.ndarray, path: Path, key=None) -> list[list[int]]:
+    """
+    Compute the lz factorization of 'codes', resuming from the state at 'path' if 'codes' extends its codes.
+    The updated state is written back to 'path'.
+
+    :param codes: the encoded snapshots, see text_encoding.encode_snapshots
+    :param is_separator: whether each position of codes is a separator
+    :param path: the path of the state file
+    :param key: identifies the input the state belongs to
+    :return: the lz factorization of codes
+    """
+    state = load_state(path, key)
+
+    if state is None or not state.can_resume(codes):
+        state = IncrementalFactorization()
+
+    lz = state.factorize(codes, is_separator)
+
+    save_state(path, state, key)
+
+    return lz
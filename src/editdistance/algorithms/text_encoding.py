@@ -0,0 +1,35 @@
+import numpy as np
+
+# The separator after snapshot i is encoded as SEPARATOR_BASE + i. Code points end at 0x10FFFF,
+# so separators never equal a character of the text or each other, however many snapshots there are.
+SEPARATOR_BASE = 0x110000
+
+
+def encode_snapshots(contents: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encode the snapshots as one integer array, every snapshot followed by its own separator.
+    The array is allocated once and every snapshot is copied into its place, no concatenated string is built.
+
+    :param contents: the text of every snapshot
+    :return: Tuple (codes, is_separator), where
+             | *codes*: int32 array with the code point of every character, and SEPARATOR_BASE + i after snapshot i.
+             | *is_separator*: boolean array, True at the positions of the separators.
+    """
+    lengths = np.fromiter((len(content) for content in contents), dtype=np.int64, count=len(contents))
+    separation_indices = np.cumsum(lengths + 1) - 1
+    n = int(separation_indices[-1]) + 1 if len(contents) > 0 else 0
+
+    codes = np.empty(n, dtype=np.int32)
+    start = 0
+    for content, end in zip(contents, separation_indices.tolist()):
+        if end > start:
+            codes[start:end] = np.frombuffer(content.encode('utf-32-le'), dtype=np.uint32)
+        start = end + 1
+
+    codes[separation_indices] = SEPARATOR_BASE + np.arange(len(contents), dtype=np.int32)
+
+    is_separator = np.zeros(n, dtype=bool)
+    is_separator[separation_indices] = True
+
+    return codes, is_separator
+
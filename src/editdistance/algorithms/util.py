@@ -1,44 +1,57 @@
-import pickle
+import heapq
+from itertools import repeat
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import List, Tuple, Dict
 
-from bs4 import BeautifulSoup
+import numpy as np
 
+from . import snapshot_text, text_encoding
 
-def extract_content(version_history: list[dict], remove_html: bool = True) -> tuple[str, list[int], list[bool]]:
-    word = ''
-    separation_indices = []
+
+def extract_content(version_history: list[dict], remove_html: bool = True,
+                    texts: list[str | None] | None = None) -> tuple[np.ndarray, np.ndarray, list[bool]]:
+    """
+    Encode the content of all versions, each followed by a separator, see text_encoding.encode_snapshots.
+
+    :param version_history: the versions of a response
+    :param remove_html: whether to remove HTML tags
+    :param texts: the already stripped text of every version, see snapshot_text.load_history. Used if remove_html.
+    :return: Tuple of (codes, is_separator, artificial_flags)
+    """
+    contents = []
     artificial_flags = []
-    separator_generator = chinese_character_generator()
 
-    for version in version_history:
+    for i, version in enumerate(version_history):
         if ("changes" in version
                 and "content" in version["changes"]
                 and version["changes"]["content"] is not None):
 
             content = version["changes"]["content"]
             if remove_html:
-                content = BeautifulSoup(content, "lxml").get_text()
+                content = texts[i] if texts is not None else snapshot_text.strip_html(content)
 
-            word += (content + next(separator_generator).decode('utf-8'))
-            separation_indices.append(len(word) - 1)
+            contents.append(content)
             artificial_flags.append(version.get("is_artificial", False))
 
-    return word, separation_indices, artificial_flags
+    codes, is_separator = text_encoding.encode_snapshots(contents)
 
+    return codes, is_separator, artificial_flags
 
-def get_word_from_file(path: Path) -> tuple[str, list[int], list[bool]]:
-    with open(path, "rb") as file:
-        return extract_content(pickle.load(file))
 
+def get_word_from_file(path: Path) -> tuple[np.ndarray, np.ndarray, list[bool]]:
+    version_history, texts = snapshot_text.load_history(path)
+    return extract_content(version_history, texts=texts)
 
-def extract_snapshot_with_metadata(version: dict, remove_html: bool = True) -> tuple[str, str | None, bool]:
+
+def extract_snapshot_with_metadata(version: dict, remove_html: bool = True,
+                                   text: str | None = None) -> tuple[str, str | None, bool]:
     """
     Extract content from a single snapshot version.
     
     :param version: A single version dict from version history
     :param remove_html: Whether to remove HTML tags
+    :param text: the already stripped text of the version. Used if remove_html.
     :return: Tuple of (content, timestamp, is_artificial)
     """
     if ("changes" in version
@@ -47,7 +60,7 @@ def extract_snapshot_with_metadata(version: dict, remove_html: bool = True) -> t
 
         content = version["changes"]["content"]
         if remove_html:
-            content = BeautifulSoup(content, "lxml").get_text()
+            content = text if text is not None else snapshot_text.strip_html(content)
         
         timestamp = version.get("timestamp") if "timestamp" in version else None
         is_artificial = version.get("is_artificial", False)
@@ -56,78 +69,111 @@ def extract_snapshot_with_metadata(version: dict, remove_html: bool = True) -> t
     return "", None, False
 
 
-def extract_all_snapshots_sorted(response_paths: List[Dict], base_path: Path, remove_html: bool = True) -> Tuple[str, List[int], List[Dict]]:
+# The sort key of snapshots without a valid timestamp, they are put after all other snapshots
+NO_TIMESTAMP = np.iinfo(np.int64).max
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_timestamp_us(timestamp: str | None) -> int | None:
+    """
+    Convert an ISO 8601 timestamp of the ANS api to integer microseconds since the epoch.
+    Handles formats like 2025-01-01T12:00:00.000000+00:00, 2025-01-01T12:00:00+00:00 and 2025-01-01T12:00:00.000Z.
+
+    :return: the microseconds since the epoch, or None if there is no timestamp or it can not be parsed
+    """
+    if timestamp is None:
+        return None
+
+    try:
+        moment = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return None
+
+    if moment.tzinfo is None:
+        return round(moment.timestamp() * 1_000_000)
+
+    return (moment - _EPOCH) // timedelta(microseconds=1)
+
+
+def _load_snapshots(full_path: Path, remove_html: bool) -> list[tuple[int, int, str, int | None, bool]]:
+    """
+    Load the non-empty snapshots of one response in time order, without keeping its version history.
+
+    :return: list of (sort_key, snapshot_index, content, timestamp, is_artificial), where timestamp is
+             in microseconds since the epoch, see parse_timestamp_us, and sort_key is the timestamp or NO_TIMESTAMP.
+    """
+    version_history, texts = snapshot_text.load_history(full_path)
+
+    snapshots = []
+    for snapshot_idx, version in enumerate(version_history):
+        content, timestamp, is_artificial = extract_snapshot_with_metadata(version, remove_html, texts[snapshot_idx])
+        if not content:  # Only add non-empty snapshots
+            continue
+
+        timestamp_us = parse_timestamp_us(timestamp)
+        if timestamp_us is None and timestamp is not None:
+            print(f"Timestamp parsing failed for {timestamp}.")
+
+        snapshots.append((NO_TIMESTAMP if timestamp_us is None else timestamp_us, snapshot_idx, content,
+                          timestamp_us, is_artificial))
+
+    # a log is in time order already, except for snapshots without a valid timestamp, should not happen
+    if any(snapshots[i - 1][0] > snapshots[i][0] for i in range(1, len(snapshots))):
+        snapshots.sort(key=lambda snapshot: snapshot[0])
+
+    return snapshots
+
+
+def extract_all_snapshots_sorted(response_paths: List[Dict], base_path: Path, remove_html: bool = True) -> Tuple[np.ndarray, np.ndarray, List[Dict]]:
     """
     Extract all snapshots from multiple response files, sort by timestamp, and track metadata.
+    The snapshots of every response are already in time order, so they are merged with a heap
+    instead of sorted, and only their text is kept in memory, not their version histories.
+    Snapshots with the same timestamp keep the order of response_paths.
     
     :param response_paths: List of dicts with 'base_path' and 'rel_file_path' keys
     :param base_path: Base path for resolving relative paths
     :param remove_html: Whether to remove HTML tags
-    :return: Tuple of (concatenated_word, separation_indices, snapshot_metadata)
-             where snapshot_metadata is a list of dicts with keys: 'question_path', 'snapshot_index', 'timestamp', 'is_artificial'
+    :return: Tuple of (codes, is_separator, snapshot_metadata), see text_encoding.encode_snapshots
+             where snapshot_metadata is a list of dicts with keys: 'question_path', 'snapshot_index', 'timestamp', 'is_artificial'.
+             The timestamp is in microseconds since the epoch, or None, see parse_timestamp_us.
     """
-    all_snapshots = []
-    
+    logs = []
+    question_paths = []
+
     # Load all snapshots with metadata
     for response_info in response_paths:
         rel_path_obj = Path(response_info['rel_file_path'])
-        rel_path_str = rel_path_obj.as_posix()  # Normalize to string for consistent comparison
         full_path = base_path / rel_path_obj
         
         try:
-            with open(full_path, "rb") as file:
-                version_history = pickle.load(file)
-            
-            # Extract each snapshot with its metadata
-            for snapshot_idx, version in enumerate(version_history):
-                content, timestamp, is_artificial = extract_snapshot_with_metadata(version, remove_html)
-                if content:  # Only add non-empty snapshots
-                    all_snapshots.append({
-                        'content': content,
-                        'timestamp': timestamp,
-                        'is_artificial': is_artificial,
-                        'question_path': rel_path_str,  # Store as normalized string
-                        'snapshot_index': snapshot_idx,
-                        'version': version  # Keep original for reference
-                    })
+            logs.append(_load_snapshots(full_path, remove_html))
+            question_paths.append(rel_path_obj.as_posix())  # Normalize to string for consistent comparison
         except Exception as e:
             print(f"Error loading file {full_path}: {e}")
             continue
-    
-    # Sort by timestamp
-    def get_timestamp_key(snapshot):
-        ts = snapshot['timestamp']
-        if ts is None:
-            return datetime.max  # Put snapshots without timestamps at the end, should not happen
-        try:
-            # Use fromisoformat for ISO 8601 format (standard ANS API format)
-            # Handles formats like: 2025-01-01T12:00:00.000000+00:00 or 2025-01-01T12:00:00+00:00
-            return datetime.fromisoformat(ts.replace('Z', '+00:00'))
-        except (ValueError, AttributeError):
-            # If parsing fails, put at the end 
-            print(f"Timestamp parsing failed for {ts}.")
-            return datetime.max
-    
-    all_snapshots.sort(key=get_timestamp_key)
-    
-    # Concatenate sorted snapshots
-    word = ''
-    separation_indices = []
-    separator_generator = chinese_character_generator()
+
+    # Merge the logs by timestamp, the log index breaks ties so earlier responses come first
+    merged = heapq.merge(*(zip(repeat(log_idx), log) for log_idx, log in enumerate(logs)),
+                         key=lambda item: (item[1][0], item[0]))
+
+    contents = []
     snapshot_metadata = []
-    
-    for snapshot in all_snapshots:
-        content = snapshot['content']
-        word += (content + next(separator_generator).decode('utf-8'))
-        separation_indices.append(len(word) - 1)
+
+    for log_idx, (_, snapshot_idx, content, timestamp_us, is_artificial) in merged:
+        contents.append(content)
         snapshot_metadata.append({
-            'question_path': snapshot['question_path'],
-            'snapshot_index': snapshot['snapshot_index'],
-            'timestamp': snapshot['timestamp'],
-            'is_artificial': snapshot['is_artificial']
+            'question_path': question_paths[log_idx],
+            'snapshot_index': snapshot_idx,
+            'timestamp': timestamp_us,
+            'is_artificial': is_artificial
         })
-    
-    return word, separation_indices, snapshot_metadata
+
+    # Encode sorted snapshots
+    codes, is_separator = text_encoding.encode_snapshots(contents)
+
+    return codes, is_separator, snapshot_metadata
 
 
 def get_phrases(snapshots: list[str], lz: list[list[int]]) -> list[list[str]]:
@@ -149,26 +195,3 @@ def get_phrases(snapshots: list[str], lz: list[list[int]]) -> list[list[str]]:
 
     return out
 
-
-def chinese_character_generator():
-    """
-    Generates Chinese character encoded in 'utf-8' as bytes
-    """
-    start = 0x4E00
-    end = 0x9FFF
-    for code_point in range(start, end + 1):
-        yield chr(code_point).encode('utf-8')
-
-
-def is_generated_chinese_character(c):
-    """
-    Check if the character c is a Chinese character in the range U+4E00 to U+9FFF.
-
-    :param c: A single character (string of length 1)
-    :return: True if c is a Chinese character in the generator's range, False otherwise
-    """
-    if len(c) != 1:
-        raise ValueError(f"Input must be a single character. Got: {c}")
-
-    code_point = ord(c)
-    return 0x4E00 <= code_point <= 0x9FFF
\ No newline at end of file
@@ -0,0 +1,209 @@
+import logging
+import sqlite3
+import time
+from enum import Enum
+from pathlib import Path
+from threading import Lock
+from typing import Callable
+
+from . import result_store
+
+logger = logging.getLogger(__name__)
+
+
+class JobState(Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+# The states of jobs that have not finished yet
+ACTIVE_STATES = (JobState.QUEUED, JobState.RUNNING)
+
+_COLUMNS = ('id', 'assignment_id', 'result_id', 'state', 'queued_at', 'started_at', 'finished_at', 'duration',
+            'n_responses', 'input_bytes', 'error')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    assignment_id INTEGER,
+    result_id INTEGER,
+    state TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL,
+    n_responses INTEGER NOT NULL,
+    input_bytes INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE TABLE IF NOT EXISTS job_responses (
+    job_id INTEGER NOT NULL,
+    response_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_responses_response ON job_responses (response_id);
+CREATE INDEX IF NOT EXISTS job_responses_job ON job_responses (job_id);
+"""
+
+
+class JobRegistry:
+    """
+    Thread-safe registry of the computation jobs, kept in a SQLite database.
+
+    Every job is recorded when it is queued, and again when it starts running and when it is done or failed,
+    together with the time it took and the size of its input. A job is done once its results are written.
+    The responses of the jobs that have not finished yet are also kept in memory.
+    Jobs that were still queued or running when the program exited are marked as failed when the registry is opened.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Constructor, creates the database at 'path' if it does not exist.
+        :param path: the database file
+        """
+        self.path = path
+        self._lock = Lock()
+        self._active: dict[int, list[int]] = {}
+        self._on_finish: dict[int, Callable[[], None]] = {}
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+            self._connection.execute(f"UPDATE jobs SET state = ?, error = ? "
+                                     f"WHERE state IN ({', '.join('?' * len(ACTIVE_STATES))})",
+                                     (JobState.FAILED.value, "interrupted", *(s.value for s in ACTIVE_STATES)))
+
+    def add(self, response_paths: list[dict], assignment_id: int | None = None, result_id: int | None = None,
+            on_finish: Callable[[], None] | None = None) -> int:
+        """
+        Record a new queued job.
+
+        :param response_paths: the responses of the job, dicts with the keys 'base_path' and 'rel_file_path'
+        :param assignment_id: the assignment of the responses, if known
+        :param result_id: the result of the responses, if the job computes a whole result
+        :param on_finish: if given, called once the results of the job are written, see finish
+        :return: the id of the job
+        """
+        response_ids = []
+        input_bytes = 0
+        for response_info in response_paths:
+            response_ids.append(result_store.ids_from_rel_path(response_info['rel_file_path'])[3])
+            try:
+                input_bytes += (Path(response_info['base_path']) / response_info['rel_file_path']).stat().st_size
+            except OSError:
+                pass
+
+        with self._lock, self._connection:
+            job_id = self._connection.execute(
+                "INSERT INTO jobs (assignment_id, result_id, state, queued_at, n_responses, input_bytes) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (assignment_id, result_id, JobState.QUEUED.value, time.time(), len(response_paths), input_bytes)
+            ).lastrowid
+            self._connection.executemany("INSERT INTO job_responses (job_id, response_id) VALUES (?, ?)",
+                                         [(job_id, response_id) for response_id in response_ids])
+            self._active[job_id] = response_ids
+            if on_finish is not None:
+                self._on_finish[job_id] = on_finish
+
+        return job_id
+
+    def start(self, job_id: int, started_at: float | None = None):
+        """
+        Record that the job started running. Only a queued job can start, a job that is already running or has
+        ended is left as it is.
+
+        :param started_at: the time.time() at which it started. If None, now.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE jobs SET state = ?, started_at = ? WHERE id = ? AND state = ?",
+                                     (JobState.RUNNING.value, started_at or time.time(), job_id,
+                                      JobState.QUEUED.value))
+
+    def finish(self, job_id: int, duration: float | None = None):
+        """
+        Record that the results of the job were written.
+
+        :param duration: the seconds the computation took. If None, the time since the job started.
+        """
+        on_finish = self._end(job_id, JobState.DONE, duration, None)
+        if on_finish is not None:
+            try:
+                on_finish()
+            except Exception as e:
+                logger.error(f"The callback of job {job_id} failed! Exception: {e}")
+
+    def fail(self, job_id: int, error: str, duration: float | None = None):
+        """
+        Record that the job failed.
+
+        :param error: what went wrong
+        :param duration: the seconds the computation took. If None, the time since the job started.
+        """
+        self._end(job_id, JobState.FAILED, duration, error)
+
+    def _end(self, job_id: int, state: JobState, duration: float | None,
+             error: str | None) -> Callable[[], None] | None:
+        """
+        Record that the job ended in 'state'.
+
+        :return: the on_finish callback of the job, if it has one
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE jobs SET state = ?, finished_at = ?, "
+                                     "duration = COALESCE(?, ? - COALESCE(started_at, queued_at)), error = ? "
+                                     "WHERE id = ?",
+                                     (state.value, now, duration, now, error, job_id))
+            self._active.pop(job_id, None)
+            return self._on_finish.pop(job_id, None)
+
+    def get(self, job_id: int) -> dict | None:
+        """
+        The record of a job, a dict with the keys in _COLUMNS, or None if there is no such job.
+        """
+        with self._lock:
+            row = self._connection.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?",
+                                           (job_id,)).fetchone()
+
+        return None if row is None else dict(zip(_COLUMNS, row))
+
+    def jobs(self, state: JobState | None = None, limit: int = 100) -> list[dict]:
+        """
+        The records of the most recent jobs, most recent first.
+
+        :param state: if given, only the jobs in this state
+        :param limit: the maximum number of jobs
+        """
+        query = f"SELECT {', '.join(_COLUMNS)} FROM jobs"
+        args = ()
+        if state is not None:
+            query += " WHERE state = ?"
+            args = (state.value,)
+
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY id DESC LIMIT ?", (*args, limit)).fetchall()
+
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def counts(self) -> dict[str, int]:
+        """
+        The number of jobs in every state.
+        """
+        with self._lock:
+            rows = dict(self._connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+        return {state.value: rows.get(state.value, 0) for state in JobState}
+
+    def active_responses(self) -> set[int]:
+        """
+        The ids of the responses that are in a job that is queued or running.
+        """
+        with self._lock:
+            return {response_id for response_ids in self._active.values() for response_id in response_ids}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,234 @@
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+from . import similarity
+
+# The indices are kept in 'response_directory/INDEX_DIR/<assignment>-<exercise>-<question>.sqlite'.
+# They are not kept in the question directories themselves, so writing them does not change those directories.
+INDEX_DIR = 'near_duplicates'
+
+# The MinHash signature of a response consists of BANDS * ROWS values. Two responses are candidates
+# when all ROWS values of any band are equal, which is likely from a Jaccard similarity of about
+# (1 / BANDS) ** (1 / ROWS) = 0.5 onwards.
+BANDS = 16
+ROWS = 4
+NUM_PERMUTATIONS = BANDS * ROWS
+
+# The candidates with an estimated Jaccard similarity below this are not near-duplicates.
+THRESHOLD = 0.5
+
+# Increase when what is kept per response changes, the responses of older indices are then indexed again.
+INDEX_VERSION = 2
+
+# Random multiply-shift hash functions ((a * x + b) mod 2^64) >> 32 with odd a,
+# fixed so signatures stay comparable between runs.
+_rng = np.random.default_rng(20250101)
+_A = _rng.integers(0, np.iinfo(np.uint64).max, size=NUM_PERMUTATIONS, dtype=np.uint64, endpoint=True) | np.uint64(1)
+_B = _rng.integers(0, np.iinfo(np.uint64).max, size=NUM_PERMUTATIONS, dtype=np.uint64, endpoint=True)
+_EMPTY = np.uint64(1 << 32)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    response_id INTEGER PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    response_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buckets_band_bucket ON buckets (band, bucket);
+CREATE INDEX IF NOT EXISTS buckets_response ON buckets (response_id);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    response_id INTEGER PRIMARY KEY,
+    fingerprints BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def index_path(response_directory: Path, question_ids: list[int]) -> Path:
+    """
+    The path of the index of the question with the (assignment, exercise, question) ids.
+    """
+    return response_directory / INDEX_DIR / f"{question_ids[0]}-{question_ids[1]}-{question_ids[2]}.sqlite"
+
+
+def _question_dir(response_directory: Path, question_ids: list[int]) -> Path:
+    return response_directory / str(question_ids[0]) / str(question_ids[1]) / str(question_ids[2])
+
+
+def _connect(response_directory: Path, question_ids: list[int]) -> sqlite3.Connection:
+    path = index_path(response_directory, question_ids)
+    os.makedirs(path.parent, exist_ok=True)
+
+    connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def signature(fingerprints: set[int]) -> np.ndarray:
+    """
+    Compute the MinHash signature of a set of fingerprints, see similarity.fingerprints.
+
+    :return: array of NUM_PERMUTATIONS values, the minimum of every hash function over the fingerprints
+    """
+    if not fingerprints:
+        return np.full(NUM_PERMUTATIONS, _EMPTY, dtype=np.uint64)
+
+    values = np.fromiter(fingerprints, dtype=np.uint64, count=len(fingerprints))
+    return ((_A[:, None] * values[None, :] + _B[:, None]) >> np.uint64(32)).min(axis=1)
+
+
+def _band_buckets(sig: np.ndarray) -> list[int]:
+    out = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).digest()
+        out.append(int.from_bytes(digest, 'little', signed=True))
+
+    return out
+
+
+def _index_response(connection: sqlite3.Connection, pickle_path: Path, response_id: int):
+    text = similarity.final_text(pickle_path)
+    fingerprints = similarity.fingerprints(text)
+    sig = signature(fingerprints)
+
+    connection.execute("DELETE FROM buckets WHERE response_id = ?", (response_id,))
+    connection.execute("INSERT OR REPLACE INTO signatures (response_id, mtime, signature) VALUES (?, ?, ?)",
+                       (response_id, pickle_path.stat().st_mtime_ns, sig.tobytes()))
+    connection.execute("INSERT OR REPLACE INTO fingerprints (response_id, fingerprints) VALUES (?, ?)",
+                       (response_id, np.array(sorted(fingerprints), dtype=np.uint32).tobytes()))
+
+    # empty answers have no fingerprints, they are not near-duplicates of each other
+    if fingerprints:
+        connection.executemany("INSERT INTO buckets (band, bucket, response_id) VALUES (?, ?, ?)",
+                               [(band, bucket, response_id) for band, bucket in enumerate(_band_buckets(sig))])
+
+
+def update(response_directory: Path, ids: list[int]):
+    """
+    Add the response with the (assignment, exercise, question, response) ids to the index of its question,
+    or replace it if it was indexed before. Called when the response was written.
+    """
+    connection = _connect(response_directory, ids[:3])
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        _index_response(connection, _question_dir(response_directory, ids[:3]) / f"{ids[3]}.pickle", ids[3])
+        connection.execute("COMMIT")
+    except Exception:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+
+
+def _refresh(connection: sqlite3.Connection, question_dir: Path):
+    """
+    Index the responses that were added or changed since the index was last refreshed.
+    The question directory is only listed again when its mtime changed, which happens when responses are added.
+    Responses that were rewritten by the fetcher are indexed by update already.
+    """
+    dir_mtime = question_dir.stat().st_mtime_ns
+    meta = dict(connection.execute("SELECT key, value FROM meta"))
+    if meta.get('version') == INDEX_VERSION and meta.get('dir_mtime') == dir_mtime:
+        return
+
+    # responses that were indexed by an older version have no fingerprints, they are indexed again
+    indexed = dict(connection.execute("SELECT s.response_id, s.mtime FROM signatures s "
+                                      "JOIN fingerprints f ON f.response_id = s.response_id"))
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        with os.scandir(question_dir) as entries:
+            for entry in entries:
+                name, suffix = os.path.splitext(entry.name)
+                if suffix != '.pickle' or not name.isdigit():
+                    continue
+
+                if indexed.get(int(name)) != entry.stat().st_mtime_ns:
+                    _index_response(connection, Path(entry.path), int(name))
+
+        connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               [('dir_mtime', dir_mtime), ('version', INDEX_VERSION)])
+        connection.execute("COMMIT")
+    except Exception:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        raise
+
+
+def question_fingerprints(response_directory: Path, question_ids: list[int]) -> dict[int, set[int]]:
+    """
+    The fingerprints of the final answer of every response to a question, read from the index of the question.
+    Only the responses that were added or changed since the index was last refreshed are read from disk.
+
+    :param response_directory: the root directory of the responses
+    :param question_ids: the (assignment, exercise, question) ids
+    :return: dictionary mapping each response id to the fingerprints of its final answer, see similarity.fingerprints
+    """
+    question_dir = _question_dir(response_directory, question_ids)
+    if not question_dir.is_dir():
+        raise FileNotFoundError(f"There are no responses to question {question_ids}.")
+
+    connection = _connect(response_directory, question_ids)
+    try:
+        _refresh(connection, question_dir)
+        rows = connection.execute("SELECT response_id, fingerprints FROM fingerprints").fetchall()
+    finally:
+        connection.close()
+
+    return {response_id: set(np.frombuffer(data, dtype=np.uint32).tolist()) for response_id, data in rows}
+
+
+def query(response_directory: Path, ids: list[int], threshold: float = THRESHOLD) -> list[dict]:
+    """
+    Find the near-duplicates of a response among all responses to the same question.
+    Only the responses that share a band bucket with it are compared, so the work does not grow with the number
+    of responses to the question.
+
+    :param response_directory: the root directory of the responses
+    :param ids: the (assignment, exercise, question, response) ids of the response
+    :param threshold: the minimum estimated Jaccard similarity
+    :return: list of dicts with keys 'response' and 'similarity', most similar first
+    """
+    question_dir = _question_dir(response_directory, ids[:3])
+    if not (question_dir / f"{ids[3]}.pickle").exists():
+        raise FileNotFoundError(f"There is no response with ids {ids}.")
+
+    connection = _connect(response_directory, ids[:3])
+    try:
+        _refresh(connection, question_dir)
+
+        row = connection.execute("SELECT signature FROM signatures WHERE response_id = ?", (ids[3],)).fetchone()
+        if row is None:
+            return []
+        sig = np.frombuffer(row[0], dtype=np.uint64)
+
+        candidates = set()
+        for band, bucket in enumerate(_band_buckets(sig)):
+            candidates.update(r for (r,) in connection.execute(
+                "SELECT response_id FROM buckets WHERE band = ? AND bucket = ?", (band, bucket)))
+        candidates.discard(ids[3])
+
+        out = []
+        for candidate in candidates:
+            (candidate_sig,) = connection.execute("SELECT signature FROM signatures WHERE response_id = ?",
+                                                  (candidate,)).fetchone()
+            estimate = float(np.mean(np.frombuffer(candidate_sig, dtype=np.uint64) == sig))
+            if estimate >= threshold:
+                out.append({'response': candidate, 'similarity': round(estimate, 4)})
+    finally:
+        connection.close()
+
+    out.sort(key=lambda x: x['similarity'], reverse=True)
+    return out
@@ -1,68 +1,338 @@
 import logging
-import os
-import pickle
+import multiprocessing
+import multiprocessing.queues
 import time
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from queue import Empty, Queue
-from threading import Event, Thread, Lock
+from threading import Thread, Lock
 
 from flask_executor import Executor
-from numpy import max
 
-from .algorithms.edit_distance import compute_edit_distances, compute_edit_distances_batch, add_to_running_jobs
+from src import metrics
+from . import result_store
+from .job_registry import JobRegistry
+from .algorithms import edit_distance
+from .algorithms.edit_distance import compute_edit_distances, compute_edit_distances_batch, add_to_running_jobs, \
+    DEFAULT_ALGORITHM
 
 
 # author: Valentijn van den Berg
 
+# The results of the jobs are written by a single writer thread, that writes the results on the queue together:
+# one transaction and one fsync per assignment, instead of one per job.
+# The queue is bounded, so the jobs wait for the writer when it falls behind instead of piling up results in memory.
+WRITE_QUEUE_SIZE = 256
 
-def start(executor: Executor, result_directory: Path, stop_event: Event, job_queue: Queue, logger_name: str):
+# The writer collects results for at most WRITE_DELAY seconds after the first one, or until it has WRITE_BATCH_SIZE
+# results, before it writes them.
+WRITE_DELAY = 0.5
+WRITE_BATCH_SIZE = 512
+
+write_queue: Queue = Queue(maxsize=WRITE_QUEUE_SIZE)
+write_thread: Thread | None = None
+_write_thread_lock = Lock()
+
+# The workers of the process pool put (job_id, started_at) on this queue when they start a job,
+# a thread in the main process records it in the registry, see _start_reader.
+_start_queue: multiprocessing.queues.Queue | None = None
+_start_thread: Thread | None = None
+_start_thread_lock = Lock()
+
+
+def _init_worker(log_level: int, start_queue: multiprocessing.queues.Queue):
+    """
+    Set up logging in a freshly spawned worker process, and keep the queue to report the start of jobs on.
+    """
+    global _start_queue
+
+    logging.basicConfig(level=log_level)
+    _start_queue = start_queue
+
+
+def create_process_pool(n_workers: int) -> ProcessPoolExecutor | None:
+    """
+    Create the process pool to run the computation jobs in.
+
+    :param n_workers: the number of worker processes. If 0, no pool is created and the jobs run in threads.
+    :return: the process pool, or None if n_workers is 0.
+    """
+    global _start_queue
+
+    if n_workers <= 0:
+        return None
+
+    # spawn instead of fork, forking a process with running Flask threads is unsafe
+    context = multiprocessing.get_context('spawn')
+    _start_queue = context.Queue()
+    return ProcessPoolExecutor(max_workers=n_workers,
+                               mp_context=context,
+                               initializer=_init_worker,
+                               initargs=(logging.getLogger().getEffectiveLevel(), _start_queue))
+
+
+def _reading_loop(queue: multiprocessing.queues.Queue, registry: JobRegistry):
+    """
+    Record the start of the jobs that the workers report on 'queue' in the registry.
     """
-    Main computation loop
+    while True:
+        job_id, started_at = queue.get()
+        try:
+            registry.start(job_id, started_at)
+        except Exception as e:
+            logging.getLogger().error(f"Could not record the start of job {job_id}! Exception: {e}")
+
+
+def _start_reader(registry: JobRegistry):
+    """
+    Start the thread that records the start of the jobs in the process pool, if it is not running yet.
+    """
+    global _start_thread
+
+    with _start_thread_lock:
+        if _start_queue is not None and (_start_thread is None or not _start_thread.is_alive()):
+            _start_thread = Thread(target=_reading_loop, args=(_start_queue, registry), daemon=True)
+            _start_thread.start()
+
+
+def writing_loop(queue: Queue, logger_name: str):
+    """
+    Write the results that are put on 'queue', until None is put on it.
+    The items on the queue are (result_directory, results, registry, job_id, duration), where results is a list of
+    (ids, result), see result_store.write_results. The job is recorded as done in the registry once it is written.
+
+    :param queue: the queue to take the results from.
+    :param logger_name: the name of the logger to use.
+    """
+    logger = logging.getLogger(logger_name)
+
+    stop = False
+    while not stop:
+        pending = [queue.get()]
+        n_results = 0
+        deadline = time.monotonic() + WRITE_DELAY
+
+        # collect what arrives shortly after, to write it together
+        while pending[-1] is not None and n_results + len(pending[-1][1]) < WRITE_BATCH_SIZE:
+            n_results += len(pending[-1][1])
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                pending.append(queue.get(timeout=remaining))
+            except Empty:
+                break
+
+        if pending[-1] is None:
+            stop = True
+            pending.pop()
+
+        _write_pending(pending, logger)
+
+
+def _write_pending(pending: list[tuple[Path, list, JobRegistry, int, float]], logger: logging.Logger):
+    """
+    Write the results of a number of jobs, grouped per assignment.
+    A response that is in more than one job gets the result of the last job.
+    """
+    per_assignment = defaultdict(dict)
+    jobs_per_assignment = defaultdict(list)
+    for result_directory, results, registry, job_id, duration in pending:
+        for ids, result in results:
+            per_assignment[(result_directory, ids[0])][ids[3]] = (ids, result)
+        jobs_per_assignment[(result_directory, results[0][0][0])].append((registry, job_id, duration))
+
+    for key, results in per_assignment.items():
+        try:
+            result_store.write_results(key[0], list(results.values()))
+        except Exception as e:
+            logger.error(f"Could not write {len(results)} results of assignment {key[1]}! Exception: {e}")
+            for registry, job_id, duration in jobs_per_assignment[key]:
+                registry.fail(job_id, f"writing the results failed: {e}", duration)
+        else:
+            for registry, job_id, duration in jobs_per_assignment[key]:
+                registry.finish(job_id, duration)
+
+    logger.debug(f"Wrote the results of {len(pending)} jobs.")
+
+
+def _start_writer(logger_name: str):
+    """
+    Start the writer thread, if it is not running yet.
+    """
+    global write_thread
+
+    with _write_thread_lock:
+        if write_thread is None or not write_thread.is_alive():
+            write_thread = Thread(target=writing_loop, args=(write_queue, logger_name), daemon=True)
+            write_thread.start()
+
+
+def stop_writer(timeout: float | None = None):
+    """
+    Let the writer thread write the results that are still on the queue, and stop it.
+
+    :param timeout: the maximum number of seconds to wait for the writer
+    """
+    with _write_thread_lock:
+        if write_thread is not None and write_thread.is_alive():
+            write_queue.put(None)
+            write_thread.join(timeout)
+
+
+def _queue_results(result_directory: Path, results: list, registry: JobRegistry, job_id: int, duration: float):
+    """
+    Queue the results of a job for the writer, or record the job as failed if it has no results.
+    """
+    if results:
+        write_queue.put((result_directory, results, registry, job_id, duration))
+    else:
+        registry.fail(job_id, "the computation failed, see the log", duration)
+
+
+def _compute_and_queue(registry: JobRegistry, job_id: int, function, *args, **kwargs):
+    """
+    Run a computation job in this process, and queue its results for the writer.
+    """
+    registry.start(job_id)
+    start = time.perf_counter()
+    try:
+        results = function(*args, write=False, **kwargs)
+    except Exception as e:
+        registry.fail(job_id, str(e), time.perf_counter() - start)
+        raise
+
+    _queue_results(args[3], results, registry, job_id, time.perf_counter() - start)
+
+
+def _run_in_worker(job_id: int, function, *args, **kwargs) -> tuple[list, dict, float, float]:
+    """
+    Run a computation job in a worker process, and report its start to the main process.
+
+    :param job_id: the id of the job in the registry
+    :return: Tuple (results, recorded, started_at, duration), where recorded are the metrics the job recorded in
+             the worker process, see metrics.take, started_at is the time.time() at which the job started in the
+             worker and duration is the number of seconds the job took.
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    if _start_queue is not None:
+        _start_queue.put((job_id, started_at))
+
+    try:
+        return function(*args, **kwargs), metrics.take(), started_at, time.perf_counter() - start
+    except BaseException:
+        metrics.take()
+        raise
+
+
+def _on_process_job_done(result_directory: Path, registry: JobRegistry, job_id: int, future: Future):
+    """
+    Keep the running jobs count of this process when a job in the process pool finishes,
+    and queue its results for the writer and keep the metrics it recorded.
+    Also called for the jobs that were cancelled before a worker started them.
+    """
+    logger = logging.getLogger()
+    add_to_running_jobs(-1)
+
+    if future.cancelled():
+        registry.fail(job_id, "cancelled")
+    elif future.exception() is not None:
+        logger.error(f"A computation job failed in its worker process! Exception: {future.exception()}")
+        registry.fail(job_id, str(future.exception()))
+    else:
+        results, recorded, started_at, duration = future.result()
+        metrics.merge(recorded)
+        # in case the start reported by the worker was not recorded yet
+        registry.start(job_id, started_at)
+        _queue_results(result_directory, results, registry, job_id, duration)
+
+    logger.info(f"Number of remaining jobs: {edit_distance.n_running_jobs}")
+
+
+def submit_job(executor: Executor, new_job: dict, result_directory: Path, registry: JobRegistry,
+               logger_name: str, process_pool: ProcessPoolExecutor | None = None, incremental: bool = False) -> int:
+    """
+    Record a computation job in the registry and run it.
+
+    :param executor: the executor to run the job in, if there is no process pool.
+    :param new_job: a batch job, a dict with the key 'response_paths' and optionally 'assignment_id', 'result_id'
+                    and 'on_written', a function that is called once the results are written,
+                    or a single response, a dict with the keys 'base_path' and 'rel_file_path'.
+    :param result_directory: where to write the results.
+    :param registry: the registry to record the job in.
+    :param logger_name: the name of the logger to use.
+    :param process_pool: if given, the job is run in this process pool instead of the executor.
+    :param incremental: whether to resume factorizations of responses that were computed before.
+    :return: the id of the job in the registry
+    """
+    logger = logging.getLogger(logger_name)
+
+    # the jobs hand their results to the writer thread
+    _start_writer(logger_name)
+
+    # Check if this is a batch job or single file job
+    if 'response_paths' in new_job:
+        # Batch job for (assignment_id, result_id)
+        logger.debug(f"Got batch job: assignment {new_job.get('assignment_id')}, result {new_job.get('result_id')}, {len(new_job['response_paths'])} responses")
+        response_paths = new_job['response_paths']
+        job = (compute_edit_distances_batch, DEFAULT_ALGORITHM, response_paths[0]['base_path'],
+               response_paths, result_directory)
+    else:
+        # Single file job
+        logger.debug(f"Got new job: {new_job['rel_file_path']}")
+        response_paths = [new_job]
+        job = (compute_edit_distances, DEFAULT_ALGORITHM, new_job['base_path'], new_job['rel_file_path'],
+               result_directory)
+
+    job_id = registry.add(response_paths, new_job.get('assignment_id'), new_job.get('result_id'),
+                          new_job.get('on_written'))
+
+    add_to_running_jobs(1)
+    if process_pool is None:
+        executor.submit(_compute_and_queue, registry, job_id, *job, incremental=incremental)
+    else:
+        # the job stays queued in the registry until a worker reports that it started it
+        _start_reader(registry)
+
+        # the results are sent back from the worker process, and queued for the writer in this process
+        future = process_pool.submit(_run_in_worker, job_id, *job, count_job=False, incremental=incremental,
+                                     write=False)
+        future.add_done_callback(partial(_on_process_job_done, result_directory, registry, job_id))
+
+    return job_id
+
+
+def start(executor: Executor, result_directory: Path, job_queue: Queue, logger_name: str, registry: JobRegistry,
+          process_pool: ProcessPoolExecutor | None = None, incremental: bool = False):
+    """
+    Main computation loop, runs the jobs that are put on 'job_queue' until None is put on it.
 
     :param executor: the executor to submit tasks to.
     :param result_directory: where to write the results.
-    :param stop_event: event when no new items will be written to the queue.
-    :param job_queue: queue to take items from.
+    :param job_queue: queue to take items from. None is put on it when no more jobs will be put on it.
     :param logger_name: the name of the logger to use.
+    :param registry: the registry to record the jobs in, see submit_job.
+    :param process_pool: if given, the jobs are run in this process pool instead of the executor.
+                         The workers only receive the file paths and send the results back.
+                         Either way, the results are written by the writer thread, see writing_loop.
+    :param incremental: whether to resume factorizations of responses that were computed before.
     :return:
     """
     if job_queue is None:
         raise ValueError("job_queue cannot be None")
 
     logger = logging.getLogger(logger_name)
-    # global _n_running_jobs
-
-    # Start the writing thread
-    # global write_thread
-    # if write_thread is None or not write_thread.is_alive():
-    #     write_thread = Thread(target=writing_loop, args=(result_directory, write_queue, logger_name), daemon=True)
-    #     write_thread.start()
 
     logger.info(f"Entering computation loop.")
 
-    # Loop as long as the stop_event has not been set
-    # or, if it has been set, finish all the remaining items in the queue
+    # wait for jobs without polling, until the retrieval puts None on the queue
     while True:
-        try:
-            new_job = job_queue.get(block=False)
-        except Empty:
-            if stop_event.is_set():
-                break
-
-            time.sleep(1)
-            continue
-
-        # Check if this is a batch job or single file job
-        if 'response_paths' in new_job:
-            # Batch job for (assignment_id, result_id)
-            logger.debug(f"Got batch job: assignment {new_job.get('assignment_id')}, result {new_job.get('result_id')}, {len(new_job['response_paths'])} responses")
-            add_to_running_jobs(1)
-            executor.submit(compute_edit_distances_batch, 'improved', new_job['response_paths'][0]['base_path'], 
-                          new_job['response_paths'], result_directory)
-        else:
-            # Single file job
-            logger.debug(f"Got new job: {new_job['rel_file_path']}")
-            add_to_running_jobs(1)
-            executor.submit(compute_edit_distances, 'improved', new_job['base_path'], new_job['rel_file_path'], result_directory)
-
+        new_job = job_queue.get()
+        if new_job is None:
+            break
 
+        submit_job(executor, new_job, result_directory, registry, logger_name, process_pool, incremental)
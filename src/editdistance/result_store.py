@@ -0,0 +1,369 @@
+import os
+import pickle
+import sqlite3
+import time
+from array import array
+from pathlib import Path
+
+from src import metrics
+from .signals import EMPTY_SIGNALS
+
+
+# Results are stored per assignment in 'result_directory/<assignment_id>/':
+#  - INDEX_NAME: an SQLite table with one row per response, holding the max edit distance, the number of versions,
+#                the paste signals and the offset and size of the packed factorization in the blob.
+#  - BLOB_NAME: the packed factorizations and edit distances of all responses, appended to on every write.
+#               Compacting the blob writes a new generation of it, see blob_name.
+INDEX_NAME = 'index.sqlite'
+BLOB_NAME = 'factorizations.bin'
+
+# The blob is compacted when it is this many times larger than the data that is still referenced.
+COMPACT_FACTOR = 2
+
+# The result of a response without any snapshots
+EMPTY_RESULT = {
+    'factorization': [],
+    'edit_distances': [0],
+    'max': 0
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    response_id INTEGER PRIMARY KEY,
+    exercise_id INTEGER NOT NULL,
+    question_id INTEGER NOT NULL,
+    max INTEGER NOT NULL,
+    n_versions INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    insertion_rate REAL NOT NULL DEFAULT 0,
+    max_novel INTEGER NOT NULL DEFAULT 0,
+    paste_bursts INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# The generation of the blob that the offsets in the index point into, see blob_name
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+)
+"""
+
+# The columns that were added after the first version of the index, with their declarations.
+_ADDED_COLUMNS = {
+    'insertion_rate': 'REAL NOT NULL DEFAULT 0',
+    'max_novel': 'INTEGER NOT NULL DEFAULT 0',
+    'paste_bursts': 'INTEGER NOT NULL DEFAULT 0'
+}
+
+SIGNAL_NAMES = tuple(EMPTY_SIGNALS)
+
+
+def ids_from_rel_path(rel_path: Path | str) -> list[int]:
+    """
+    Get the (assignment, exercise, question, response) ids from a path relative to the response or result root.
+
+    :param rel_path: a path like '<assignment>/<exercise>/<question>/<response>.pickle'
+    :return: the four ids
+    """
+    rel_path = Path(rel_path)
+    as_id, ex_id, q_id = rel_path.parts[-4:-1]
+    return [int(as_id), int(ex_id), int(q_id), int(rel_path.name.split('.')[0])]
+
+
+def _connect(assignment_dir: Path) -> sqlite3.Connection:
+    connection = sqlite3.connect(assignment_dir / INDEX_NAME, timeout=60, isolation_level=None)
+    connection.execute(_SCHEMA)
+    connection.execute(_META_SCHEMA)
+
+    # indices written by older versions get the columns that were added since
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(results)")}
+    for name, declaration in _ADDED_COLUMNS.items():
+        if name not in columns:
+            try:
+                connection.execute(f"ALTER TABLE results ADD COLUMN {name} {declaration}")
+            except sqlite3.OperationalError as e:
+                # another connection added it first
+                if 'duplicate column' not in str(e):
+                    raise
+
+    return connection
+
+
+def blob_name(generation: int) -> str:
+    """
+    The file name of a generation of the blob. Generation 0 is the blob as older versions wrote it.
+    """
+    if generation == 0:
+        return BLOB_NAME
+
+    return f"{Path(BLOB_NAME).stem}.{generation}{Path(BLOB_NAME).suffix}"
+
+
+def _blob_generation(connection: sqlite3.Connection) -> int:
+    """
+    The generation of the blob that the offsets in the index point into.
+    Read it in the same transaction as the offsets.
+    """
+    row = connection.execute("SELECT value FROM meta WHERE key = 'blob_generation'").fetchone()
+    return 0 if row is None else row[0]
+
+
+def pack(result: dict) -> bytes:
+    """
+    Pack the factorization and edit distances of a result as int32 values:
+    [n_edit_distances, *edit_distances, n_snapshots, *n_phrases per snapshot, *phrase lengths].
+    """
+    factorization = result['factorization']
+    edit_distances = result['edit_distances']
+
+    values = array('i', [len(edit_distances)])
+    values.extend(int(x) for x in edit_distances)
+    values.append(len(factorization))
+    values.extend(len(phrases) for phrases in factorization)
+    for phrases in factorization:
+        values.extend(phrases)
+
+    return values.tobytes()
+
+
+def unpack(data: bytes, max_ed: int) -> dict:
+    """
+    Unpack a result that was packed with pack.
+    """
+    values = array('i')
+    values.frombytes(data)
+
+    i = 0
+    n_eds = values[i]
+    edit_distances = values[i + 1: i + 1 + n_eds].tolist()
+    i += 1 + n_eds
+
+    n_snapshots = values[i]
+    counts = values[i + 1: i + 1 + n_snapshots]
+    i += 1 + n_snapshots
+
+    factorization = []
+    for count in counts:
+        factorization.append(values[i: i + count].tolist())
+        i += count
+
+    return {
+        'factorization': factorization,
+        'edit_distances': edit_distances,
+        'max': max_ed
+    }
+
+
+def write_results(result_directory: Path, entries: list[tuple[list[int], dict]]):
+    """
+    Write the results of a number of responses of the same assignment at once.
+    The index is updated in a single transaction, so readers see either all or none of the new results.
+
+    :param result_directory: the root directory of the results
+    :param entries: a list of (ids, result), where ids are the (assignment, exercise, question, response) ids
+                    and result is a dict with the keys 'factorization', 'edit_distances' and 'max',
+                    and optionally 'signals', see signals.compute_signals.
+    """
+    if not entries:
+        return
+
+    assignment_ids = {ids[0] for ids, _ in entries}
+    if len(assignment_ids) != 1:
+        raise ValueError(f"All results should be of the same assignment, got assignments {assignment_ids}.")
+
+    assignment_dir = result_directory / str(assignment_ids.pop())
+    os.makedirs(assignment_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    generation = compacted = None
+    connection = _connect(assignment_dir)
+    try:
+        # take the exclusive lock before touching the blob: concurrent writers append one after the other,
+        # and no reader is halfway reading the blob when it is compacted
+        connection.execute("BEGIN EXCLUSIVE")
+        generation = _blob_generation(connection)
+
+        rows = []
+        with open(assignment_dir / blob_name(generation), 'ab') as blob:
+            offset = blob.tell()
+            for ids, result in entries:
+                data = pack(result)
+                blob.write(data)
+                signals = result.get('signals', EMPTY_SIGNALS)
+                rows.append((ids[3], ids[1], ids[2], int(result['max']), len(result['edit_distances']),
+                             offset, len(data), *(signals[name] for name in SIGNAL_NAMES)))
+                offset += len(data)
+
+            blob.flush()
+            os.fsync(blob.fileno())
+
+        connection.executemany("INSERT OR REPLACE INTO results (response_id, exercise_id, question_id, max, "
+                               f"n_versions, offset, size, {', '.join(SIGNAL_NAMES)}) "
+                               f"VALUES (?, ?, ?, ?, ?, ?, ?{', ?' * len(SIGNAL_NAMES)})", rows)
+
+        compacted = _compact_if_required(connection, assignment_dir, generation, offset)
+
+        connection.execute("COMMIT")
+        metrics.count('results_written', len(entries))
+    except BaseException:
+        if connection.in_transaction:
+            # the index keeps pointing into the current generation, remove a next one while no other writer can
+            # start writing it
+            if generation is not None:
+                (assignment_dir / blob_name(generation + 1)).unlink(missing_ok=True)
+            connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+        metrics.observe('result_write', time.perf_counter() - start)
+
+    # the old generation is only removed once the index points into the new one
+    if compacted is not None:
+        (assignment_dir / blob_name(generation)).unlink(missing_ok=True)
+
+
+def _compact_if_required(connection: sqlite3.Connection, assignment_dir: Path, generation: int,
+                         blob_size: int) -> int | None:
+    """
+    Write the results that are still referenced to the next generation of the blob, if the overwritten results
+    take up too much space, and point the index into it.
+    Must be called inside a write transaction. The current generation is left in place, so the index is still
+    valid if the transaction rolls back. The caller removes it after the commit.
+
+    :return: the new generation, or None if the blob was not compacted
+    """
+    live_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    if blob_size <= COMPACT_FACTOR * live_size:
+        return None
+
+    rows = []
+    with open(assignment_dir / blob_name(generation), 'rb') as old, \
+            open(assignment_dir / blob_name(generation + 1), 'wb') as new:
+        for response_id, offset, size in connection.execute("SELECT response_id, offset, size FROM results ORDER BY offset"):
+            old.seek(offset)
+            rows.append((new.tell(), response_id))
+            new.write(old.read(size))
+
+        new.flush()
+        os.fsync(new.fileno())
+
+    connection.executemany("UPDATE results SET offset = ? WHERE response_id = ?", rows)
+    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('blob_generation', ?)", (generation + 1,))
+
+    return generation + 1
+
+
+def read_index(result_directory: Path, assignment_id: int) -> dict[int, tuple[int, int, int, int]]:
+    """
+    Read the index of an assignment in a single query.
+
+    :param result_directory: the root directory of the results
+    :param assignment_id: the assignment to read the index of
+    :return: a dict that maps each response id to (exercise_id, question_id, max, n_versions)
+    """
+    assignment_dir = result_directory / str(assignment_id)
+    if not (assignment_dir / INDEX_NAME).exists():
+        return {}
+
+    connection = _connect(assignment_dir)
+    try:
+        rows = connection.execute("SELECT response_id, exercise_id, question_id, max, n_versions FROM results").fetchall()
+    finally:
+        connection.close()
+
+    return {row[0]: row[1:] for row in rows}
+
+
+def read_signals(result_directory: Path, assignment_id: int) -> dict[int, dict]:
+    """
+    Read the paste signals of all responses of an assignment in a single query.
+
+    :param result_directory: the root directory of the results
+    :param assignment_id: the assignment to read the signals of
+    :return: a dict that maps each response id to its signals, see signals.compute_signals
+    """
+    assignment_dir = result_directory / str(assignment_id)
+    if not (assignment_dir / INDEX_NAME).exists():
+        return {}
+
+    connection = _connect(assignment_dir)
+    try:
+        rows = connection.execute(f"SELECT response_id, {', '.join(SIGNAL_NAMES)} FROM results").fetchall()
+    finally:
+        connection.close()
+
+    return {row[0]: dict(zip(SIGNAL_NAMES, row[1:])) for row in rows}
+
+
+def read_result(result_directory: Path, ids: list[int], default=None) -> dict | None:
+    """
+    Read the result of a single response.
+    Results that were written as a separate pickle file by older versions are still read.
+
+    :param result_directory: the root directory of the results
+    :param ids: the (assignment, exercise, question, response) ids
+    :param default: returned if there is no result
+    :return: a dict with the keys 'factorization', 'edit_distances' and 'max'
+    """
+    assignment_dir = result_directory / str(ids[0])
+
+    if (assignment_dir / INDEX_NAME).exists():
+        connection = _connect(assignment_dir)
+        try:
+            # the read transaction keeps writers from compacting the blob until it has been read
+            connection.execute("BEGIN")
+            row = connection.execute("SELECT max, offset, size FROM results WHERE response_id = ?", (ids[3],)).fetchone()
+
+            if row is not None:
+                max_ed, offset, size = row
+                with open(assignment_dir / blob_name(_blob_generation(connection)), 'rb') as blob:
+                    blob.seek(offset)
+                    return unpack(blob.read(size), max_ed)
+        finally:
+            if connection.in_transaction:
+                connection.execute("COMMIT")
+            connection.close()
+
+    return read_legacy_result(result_directory, ids, default)
+
+
+def read_legacy_result(result_directory: Path, ids: list[int], default=None) -> dict | None:
+    """
+    Read the result of a single response that was written as a separate pickle file by older versions.
+
+    :param result_directory: the root directory of the results
+    :param ids: the (assignment, exercise, question, response) ids
+    :param default: returned if there is no such file
+    """
+    legacy_path = (result_directory / str(ids[0]) / str(ids[1]) / str(ids[2]) / str(ids[3])).with_suffix('.pickle')
+    if legacy_path.exists():
+        with open(legacy_path, 'rb') as file:
+            return pickle.load(file)
+
+    return default
+
+
+def result_mtime(result_directory: Path, ids: list[int]) -> int:
+    """
+    A timestamp in nanoseconds that changes whenever the result of the response with the
+    (assignment, exercise, question, response) ids may have changed, 0 if it has no result.
+    The index is shared by the assignment, so writing any result of the assignment changes it.
+    """
+    mtime = 0
+    for path in (result_directory / str(ids[0]) / INDEX_NAME,
+                 (result_directory / str(ids[0]) / str(ids[1]) / str(ids[2]) / str(ids[3])).with_suffix('.pickle')):
+        try:
+            mtime = max(mtime, path.stat().st_mtime_ns)
+        except OSError:
+            pass
+
+    return mtime
+
+
+def has_result(result_directory: Path, ids: list[int]) -> bool:
+    """
+    Whether a result exists for the response with the (assignment, exercise, question, response) ids.
+    """
+    return read_result(result_directory, ids) is not None
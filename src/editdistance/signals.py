@@ -0,0 +1,83 @@
+from itertools import chain
+
+import numpy as np
+
+# Phrases shorter than this are counted as new text, longer phrases are copies of earlier text.
+NOVEL_PHRASE_LENGTH = 8
+
+# A snapshot that adds at least BURST_CHARS characters of new text within BURST_SECONDS of the previous
+# snapshot of the same response is a paste burst.
+BURST_CHARS = 40
+BURST_SECONDS = 5.0
+
+# Pauses between snapshots count for at most this many seconds towards the time spent writing.
+IDLE_SECONDS = 300.0
+
+# The signals of a response without any snapshots
+EMPTY_SIGNALS = {
+    'insertion_rate': 0.0,
+    'max_novel': 0,
+    'paste_bursts': 0
+}
+
+
+def compute_signals(factorization: list[list[int]], timestamps: list[int | None], artificial: list[bool],
+                    groups: list[int], n_groups: int) -> list[dict]:
+    """
+    Compute the paste signals of a number of responses whose snapshots were factorized together.
+    All snapshots are processed at once with NumPy.
+
+    :param factorization: the phrase lengths of every snapshot, in the order the snapshots were factorized
+    :param timestamps: the timestamp of every snapshot in microseconds since the epoch, None if unknown,
+                       see util.parse_timestamp_us
+    :param artificial: whether every snapshot was inserted artificially, those never add new text
+    :param groups: the index of the response every snapshot belongs to
+    :param n_groups: the number of responses
+    :return: for every response a dict with the keys
+             | *insertion_rate*: characters of new text per second spent writing.
+             | *max_novel*: the most characters of new text added by a single snapshot.
+             | *paste_bursts*: the number of snapshots that added a lot of new text within a few seconds.
+    """
+    n = len(factorization)
+    if n == 0:
+        return [dict(EMPTY_SIGNALS) for _ in range(n_groups)]
+
+    # the new text of a snapshot is the total length of its short phrases, an unmatched character has length 0
+    counts = np.fromiter((len(phrases) for phrases in factorization), dtype=np.int64, count=n)
+    lengths = np.fromiter(chain.from_iterable(factorization), dtype=np.int64, count=int(counts.sum()))
+    snapshot_of_phrase = np.repeat(np.arange(n), counts)
+    is_short = lengths < NOVEL_PHRASE_LENGTH
+    novel = np.bincount(snapshot_of_phrase[is_short], weights=np.maximum(lengths[is_short], 1), minlength=n)
+    novel[np.asarray(artificial, dtype=bool)] = 0
+
+    # order the snapshots by response, keeping their order within a response
+    groups = np.asarray(groups, dtype=np.int64)
+    order = np.lexsort((np.arange(n), groups))
+    groups = groups[order]
+    novel = novel[order]
+    seconds = np.fromiter((float('nan') if ts is None else ts / 1e6 for ts in timestamps),
+                          dtype=np.float64, count=n)[order]
+
+    # the time since the previous snapshot of the same response, unknown for the first snapshot
+    delta = np.full(n, np.inf)
+    same_group = groups[1:] == groups[:-1]
+    delta[1:][same_group] = seconds[1:][same_group] - seconds[:-1][same_group]
+    delta[np.isnan(delta)] = np.inf
+
+    is_burst = (novel >= BURST_CHARS) & (delta <= BURST_SECONDS)
+    active = np.where(np.isfinite(delta), np.clip(delta, 0, IDLE_SECONDS), 0)
+
+    total_novel = np.bincount(groups, weights=novel, minlength=n_groups)
+    total_active = np.bincount(groups, weights=active, minlength=n_groups)
+    n_bursts = np.bincount(groups, weights=is_burst, minlength=n_groups)
+    max_novel = np.zeros(n_groups)
+    np.maximum.at(max_novel, groups, novel)
+
+    return [
+        {
+            'insertion_rate': round(float(total_novel[g] / max(total_active[g], 1.0)), 3),
+            'max_novel': int(max_novel[g]),
+            'paste_bursts': int(n_bursts[g])
+        }
+        for g in range(n_groups)
+    ]
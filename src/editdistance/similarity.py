@@ -0,0 +1,112 @@
+import heapq
+import zlib
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from .algorithms import snapshot_text
+
+# The length of the character k-grams that are hashed. Shorter matches are not detected.
+K_GRAM = 8
+
+# The number of consecutive k-gram hashes of which the smallest is kept as fingerprint (winnowing).
+# Every match of at least K_GRAM + WINDOW - 1 characters shares a fingerprint.
+WINDOW = 4
+
+# Fingerprints that occur in more than this fraction of the responses to a question are ignored,
+# those come from the question itself or from a predefined answer.
+MAX_SHARED_FRACTION = 0.5
+
+# Fingerprints that occur in more than this many responses are ignored as well, whatever the size of the class.
+# Every fingerprint then adds at most MAX_DOCUMENT_FREQUENCY * (MAX_DOCUMENT_FREQUENCY - 1) / 2 pair counts,
+# so ranking the pairs grows linearly with the number of responses.
+MAX_DOCUMENT_FREQUENCY = 10
+
+
+def normalize(text: str) -> str:
+    """
+    Make 'text' insensitive to case and layout, so reformatting a copied answer does not hide it.
+    """
+    return ' '.join(text.lower().split())
+
+
+def fingerprints(text: str, k: int = K_GRAM, window: int = WINDOW) -> set[int]:
+    """
+    Compute the winnowing fingerprints of 'text'.
+
+    :param text: the text to fingerprint
+    :param k: the length of the hashed k-grams
+    :param window: the number of consecutive k-gram hashes of which the smallest is kept
+    :return: the set of fingerprints
+    """
+    text = normalize(text)
+    if len(text) == 0:
+        return set()
+
+    n_grams = len(text) - k + 1
+    if n_grams <= 0:
+        return {zlib.crc32(text.encode('utf-8'))}
+
+    hashes = np.fromiter((zlib.crc32(text[i:i + k].encode('utf-8')) for i in range(n_grams)),
+                         dtype=np.uint32, count=n_grams)
+
+    if n_grams <= window:
+        return {int(hashes.min())}
+
+    return set(np.lib.stride_tricks.sliding_window_view(hashes, window).min(axis=1).tolist())
+
+
+def final_text(pickle_path: Path) -> str:
+    """
+    The stripped text of the last version of the response at 'pickle_path' that has content.
+    """
+    _, texts = snapshot_text.load_history(pickle_path)
+    for text in reversed(texts):
+        if text is not None:
+            return text
+
+    return ''
+
+
+def rank_similar_pairs(response_fingerprints: dict[int, set[int]], k: int = 20,
+                       max_shared_fraction: float = MAX_SHARED_FRACTION,
+                       max_document_frequency: int = MAX_DOCUMENT_FREQUENCY) -> list[dict]:
+    """
+    Find the k pairs of responses with the most similar final answers.
+    Only pairs that share a fingerprint are scored, via an inverted index from fingerprint to responses,
+    so the work grows with the number of shared fingerprints instead of with the number of pairs.
+
+    :param response_fingerprints: the fingerprints of every response, see lsh_index.question_fingerprints
+    :param k: the number of pairs to return
+    :param max_shared_fraction: fingerprints in more than this fraction of the responses are ignored
+    :param max_document_frequency: fingerprints in more than this many responses are ignored
+    :return: list of dicts with keys 'responses', 'similarity' and 'shared', most similar first.
+             The similarity is the Jaccard similarity of the fingerprints of both responses.
+    """
+    postings = defaultdict(list)
+    for response_id, response_prints in response_fingerprints.items():
+        for fingerprint in response_prints:
+            postings[fingerprint].append(response_id)
+
+    limit = min(max_document_frequency, max(2, int(max_shared_fraction * len(response_fingerprints))))
+
+    shared = defaultdict(int)
+    for response_ids in postings.values():
+        if 2 <= len(response_ids) <= limit:
+            for i in range(len(response_ids)):
+                for j in range(i + 1, len(response_ids)):
+                    shared[(response_ids[i], response_ids[j])] += 1
+
+    def similarity(item):
+        (a, b), n_shared = item
+        return n_shared / (len(response_fingerprints[a]) + len(response_fingerprints[b]) - n_shared)
+
+    return [
+        {
+            'responses': [a, b],
+            'similarity': round(similarity(((a, b), n_shared)), 4),
+            'shared': n_shared
+        }
+        for (a, b), n_shared in heapq.nlargest(k, shared.items(), key=similarity)
+    ]
@@ -0,0 +1,177 @@
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable
+
+# All metrics are exported with this prefix
+NAMESPACE = 'fraud_detection'
+
+# The upper bounds in seconds of the buckets of the stage histograms, the last bucket (+Inf) is implicit
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# The stages that are timed, and what they measure
+STAGES = {
+    'http_request': "Sending an API request and receiving the response.",
+    'rate_limit_wait': "Waiting for the rate limiter before an API request.",
+    'pickle_load': "Reading and unpickling the history of a response.",
+    'strip_html': "Removing the html from all snapshots of a response.",
+    'suffix_array': "Computing a suffix array.",
+    'lcp': "Computing a longest common prefix array.",
+    'lpf': "Computing a longest previous factor array.",
+    'lz': "Computing a Lempel-Ziv factorization from the longest previous factors.",
+    'result_write': "Writing computed results to the result store.",
+    'construct_trees': "Building the response trees of the dataviewer.",
+    'get_history': "Rendering the history of a response in the dataviewer.",
+}
+
+# The events that are counted, and what they are
+EVENTS = {
+    'http_requests': "API requests that were sent.",
+    'http_rate_limited': "API requests that were answered with HTTP 429.",
+    'http_cache_hits': "API requests that were answered from the response cache.",
+    'text_cache_hits': "Responses whose stripped text was read from the text file.",
+    'snapshots_stripped': "Snapshots whose html was removed.",
+    'jobs_done': "Computation jobs that finished.",
+    'jobs_failed': "Computation jobs that failed.",
+    'results_written': "Results that were written to the result store.",
+}
+
+
+class Histogram:
+    """
+    Histogram of durations in seconds, with the buckets in BUCKETS.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+
+        self.total += seconds
+
+
+_histograms: dict[str, Histogram] = {stage: Histogram() for stage in STAGES}
+_counters: dict[str, float] = {event: 0 for event in EVENTS}
+_gauges: dict[str, tuple[str, Callable[[], float]]] = {}
+_lock = Lock()
+
+
+def observe(stage: str, seconds: float):
+    """
+    Record that 'stage' took 'seconds'.
+
+    :param stage: one of STAGES
+    :param seconds: the duration in seconds
+    """
+    with _lock:
+        _histograms[stage].observe(seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Context manager that records how long its body takes as a duration of 'stage', also if it raises.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def count(event: str, amount: float = 1):
+    """
+    Add 'amount' to the counter of 'event', one of EVENTS.
+    """
+    with _lock:
+        _counters[event] += amount
+
+
+def gauge(name: str, description: str, function: Callable[[], float]):
+    """
+    Export the current value of function() as the gauge 'name' whenever the metrics are rendered.
+    """
+    with _lock:
+        _gauges[name] = (description, function)
+
+
+def take() -> dict:
+    """
+    Take the metrics that were recorded since the last call, and reset them.
+    Used in worker processes, which send them to the main process to be merged there, see merge.
+
+    :return: dict with keys 'histograms' and 'counters'
+    """
+    with _lock:
+        taken = {
+            'histograms': {stage: (h.counts, h.total) for stage, h in _histograms.items() if any(h.counts)},
+            'counters': {event: value for event, value in _counters.items() if value}
+        }
+        for stage in taken['histograms']:
+            _histograms[stage] = Histogram()
+        for event in taken['counters']:
+            _counters[event] = 0
+
+    return taken
+
+
+def merge(taken: dict):
+    """
+    Add metrics that were taken in another process, see take.
+    """
+    with _lock:
+        for stage, (counts, total) in taken['histograms'].items():
+            histogram = _histograms[stage]
+            histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+            histogram.total += total
+        for event, value in taken['counters'].items():
+            _counters[event] += value
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+
+    with _lock:
+        name = f"{NAMESPACE}_stage_duration_seconds"
+        lines.append(f"# HELP {name} The time spent in each stage. "
+                     + ' '.join(f"{stage}: {description}" for stage, description in STAGES.items()))
+        lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in _histograms.items():
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float('inf'),), histogram.counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {_number(histogram.total)}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+
+        name = f"{NAMESPACE}_events_total"
+        lines.append(f"# HELP {name} The number of times each event happened. "
+                     + ' '.join(f"{event}: {description}" for event, description in EVENTS.items()))
+        lines.append(f"# TYPE {name} counter")
+        for event, value in _counters.items():
+            lines.append(f'{name}{{event="{event}"}} {_number(value)}')
+
+        gauges = list(_gauges.items())
+
+    for gauge_name, (description, function) in gauges:
+        name = f"{NAMESPACE}_{gauge_name}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_number(function())}")
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,64 @@
+import time
+from threading import Lock
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    Tokens are added at 'rate' per second up to 'capacity', and every request takes one token.
+    """
+
+    def __init__(self, delay: float, capacity: int = 1):
+        """
+        Constructor.
+        :param delay: the average delay in seconds between requests. If 0, requests are never delayed.
+        :param capacity: the maximum number of requests that may be sent in a burst
+        """
+        self.rate = 1 / delay if delay > 0 else None
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self) -> float:
+        """
+        Take a token, sleeping until one is available.
+
+        :return: the time in seconds that was spent waiting
+        """
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+
+                if now < self._paused_until:
+                    time_to_sleep = self._paused_until - now
+                elif self.rate is None:
+                    return waited
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+
+                    time_to_sleep = (1 - self._tokens) / self.rate
+
+            time.sleep(time_to_sleep)
+            waited += time_to_sleep
+
+    def pause(self, seconds: float):
+        """
+        Hold back all requests for 'seconds', for example after the server answered with HTTP 429.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            if self.rate is not None:
+                self._tokens = 0
+                self._last_refill = max(self._last_refill, self._paused_until)
@@ -0,0 +1,109 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+
+from requests.structures import CaseInsensitiveDict
+
+# A cached response: the json body and the response headers.
+CachedResponse = tuple[dict | list | None, CaseInsensitiveDict]
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache of responses that keeps at most 'max_entries' responses of at most 'max_bytes'
+    bytes together, the least recently used response is evicted first.
+    The size of a response is the length of its body, the logs of responses can be large.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 2 ** 20):
+        """
+        Constructor.
+        :param max_entries: the maximum number of responses that are kept. If 0, nothing is cached.
+        :param max_bytes: the maximum total size of the responses that are kept. If 0, nothing is cached.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._entries: OrderedDict[str, tuple[CachedResponse, int]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, url: str) -> CachedResponse | None:
+        with self._lock:
+            if url not in self._entries:
+                return None
+
+            self._entries.move_to_end(url)
+            return self._entries[url][0]
+
+    def put(self, url: str, response: CachedResponse, size: int | None = None):
+        """
+        Cache a response, responses larger than max_bytes are not cached.
+
+        :param size: the length of the body of the response. If None, the length of its json.
+        """
+        if size is None:
+            size = len(json.dumps(response[0]))
+
+        with self._lock:
+            if url in self._entries:
+                self.n_bytes -= self._entries.pop(url)[1]
+
+            if size > self.max_bytes:
+                return
+
+            self._entries[url] = (response, size)
+            self.n_bytes += size
+
+            while len(self._entries) > self.max_entries or self.n_bytes > self.max_bytes:
+                self.n_bytes -= self._entries.popitem(last=False)[1][1]
+
+
+class SqliteCache:
+    """
+    Thread-safe on-disk cache of responses in a SQLite database, keyed by url.
+    Responses older than 'ttl' seconds are treated as missing, so they are fetched again.
+    """
+
+    def __init__(self, path: Path, ttl: float):
+        """
+        Constructor, creates the database at 'path' if it does not exist.
+        :param path: the database file
+        :param ttl: the number of seconds a response stays valid
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                     "url TEXT PRIMARY KEY, "
+                                     "fetched_at REAL NOT NULL, "
+                                     "data TEXT NOT NULL, "
+                                     "headers TEXT NOT NULL)")
+            self._connection.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - ttl,))
+
+    def get(self, url: str) -> CachedResponse | None:
+        with self._lock:
+            row = self._connection.execute("SELECT fetched_at, data, headers FROM responses WHERE url = ?",
+                                           (url,)).fetchone()
+
+        if row is None or row[0] < time.time() - self.ttl:
+            return None
+
+        return json.loads(row[1]), CaseInsensitiveDict(json.loads(row[2]))
+
+    def put(self, url: str, response: CachedResponse):
+        data, headers = response
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO responses (url, fetched_at, data, headers) "
+                                     "VALUES (?, ?, ?, ?)",
+                                     (url, time.time(), json.dumps(data), json.dumps(dict(headers))))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
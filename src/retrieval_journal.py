@@ -0,0 +1,98 @@
+import json
+import os
+from pathlib import Path
+from threading import Lock
+
+
+class RetrievalJournal:
+    """
+    Append-only journal of the retrieval progress, kept as one JSON object per line.
+
+    It records when the retrieval of an assignment starts and finishes, which results were retrieved completely
+    and had their edit distances written, and the history count of every response that was written.
+    A run that was interrupted can then skip the results it already finished,
+    and a later run only needs to write the responses whose history grew.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Constructor, reads the existing journal at 'path' if there is one.
+        :param path: the journal file
+        """
+        self.path = path
+        self._lock = Lock()
+
+        # per assignment: whether its last run finished, and the results that were finished in that run
+        self._finished: dict[int, bool] = {}
+        self._done_results: dict[int, set[int]] = {}
+        self._history_counts: dict[int, int] = {}
+
+        if path.exists():
+            with open(path, 'rb+') as file:
+                content = file.read()
+
+                # drop a line that was cut off when the program exited, so new entries start on their own line
+                complete_length = content.rfind(b'\n') + 1
+                if complete_length < len(content):
+                    file.truncate(complete_length)
+
+            for line in content[:complete_length].splitlines():
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+
+    def _apply(self, entry: dict):
+        event = entry['event']
+
+        if event == 'start':
+            self._finished[entry['assignment']] = False
+            self._done_results[entry['assignment']] = set()
+        elif event == 'result':
+            self._done_results.setdefault(entry['assignment'], set()).add(entry['result'])
+        elif event == 'response':
+            self._history_counts[entry['response']] = entry['count']
+        elif event == 'finish':
+            self._finished[entry['assignment']] = True
+
+    def _append(self, entry: dict):
+        with self._lock:
+            self._apply(entry)
+
+            os.makedirs(self.path.parent, exist_ok=True)
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(entry) + '\n')
+
+    def start_assignment(self, assignment_id: int) -> bool:
+        """
+        Start the retrieval of an assignment.
+        If the previous run of this assignment was interrupted, that run is resumed instead.
+
+        :return: whether an interrupted run is resumed
+        """
+        if self._finished.get(assignment_id) is False:
+            return True
+
+        self._append({'event': 'start', 'assignment': assignment_id})
+        return False
+
+    def is_result_done(self, assignment_id: int, result_id: int) -> bool:
+        """
+        Whether the result was retrieved completely in the current run of its assignment.
+        """
+        return result_id in self._done_results.get(assignment_id, set())
+
+    def mark_result_done(self, assignment_id: int, result_id: int):
+        self._append({'event': 'result', 'assignment': assignment_id, 'result': result_id})
+
+    def finish_assignment(self, assignment_id: int):
+        self._append({'event': 'finish', 'assignment': assignment_id})
+
+    def history_count(self, response_id: int) -> int | None:
+        """
+        The history count of the response when it was last written, or None if it was never written.
+        """
+        return self._history_counts.get(response_id)
+
+    def mark_response(self, response_id: int, count: int):
+        self._append({'event': 'response', 'response': response_id, 'count': count})
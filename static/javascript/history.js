@@ -6,9 +6,19 @@ let timestamps;
 let historyFormat = "old"
 let result_id = undefined
 
+// The compact ("delta") format: the snapshots are fetched in chunks while they are shown
+let historyResponse;
+let chunkSize;
+let chunks = {};
+let firstIsArtificial = false;
+
 let goToSig = false;
 
 function hasArtificialInitialSnapshot() {
+    if (historyFormat === "delta") {
+        return firstIsArtificial;
+    }
+
     return Array.isArray(history)
         && history.length > 0
         && history[0] !== null
@@ -75,9 +85,12 @@ function fetchHistory() {
             }
         }
     ]
+    historyFormat = "old"
     setVersionNumber(1);
 
-    fetch("/api/history")
+    // the ids are in the url so the browser keeps the history of every response, and asks whether it changed
+    const query = Array.isArray(ids) && ids.length === 4 ? "response=" + ids.join("-") + "&" : ""
+    fetch("/api/history?" + query + "format=delta")
         .then(response => response.json())
         .then(data => processHistory(data))
         .catch(error => console.error('Error:', error));
@@ -86,12 +99,22 @@ function fetchHistory() {
 }
 
 function processHistory(data) {
-    history = data["history"];
+    historyFormat = data["format"]
     editDistances = data["edit_distances"];
     timestamps = data["timestamps"];
-    nVersions = history.length-1
-    historyFormat = data["format"]
     result_id = data["result_id"];
+
+    if (historyFormat === "delta") {
+        history = []
+        historyResponse = data["response"].join("-")
+        chunkSize = data["chunk_size"]
+        chunks = {}
+        firstIsArtificial = data["first_is_artificial"]
+        nVersions = data["n_snapshots"] - 1
+    } else {
+        history = data["history"];
+        nVersions = history.length-1
+    }
     setPredefinedAnswerIndicator();
 
     if (result_id === undefined || result_id === null) {
@@ -110,6 +133,7 @@ function processHistory(data) {
 function resetHistory() {
     currentVersion = -1;
     history = [];
+    chunks = {};
     editDistances = [];
     nVersions = -1;
     timestamps = []
@@ -194,7 +218,9 @@ function setText() {
         return;
     }
 
-    if (historyFormat === "old") {
+    if (historyFormat === "delta") {
+        setTextFromChunks(currentVersion);
+    } else if (historyFormat === "old") {
         if (history[currentVersion] === undefined) {
             document.getElementById("left_version_div").innerHTML = "<i>*No previous version exists*</i>";
             document.getElementById("right_version_div").innerHTML = processContent(history[currentVersion-1]["changes"]["content"])
@@ -212,6 +238,113 @@ function setText() {
 
 }
 
+function setTextFromChunks(version) {
+    const response = historyResponse;
+    const hasPrevious = version <= nVersions;
+
+    Promise.all([getSnapshot(version - 1), hasPrevious ? getSnapshot(version) : undefined])
+        .then(([left, right]) => {
+            // the viewer moved on while the chunks were fetched
+            if (response !== historyResponse || version !== currentVersion || historyFormat !== "delta") {
+                return;
+            }
+
+            if (!hasPrevious) {
+                document.getElementById("left_version_div").innerHTML = "<i>*No previous version exists*</i>";
+                document.getElementById("right_version_div").innerHTML = processContent(left)
+            } else {
+                document.getElementById("left_version_div").innerHTML = processContent(left)
+                document.getElementById("right_version_div").innerHTML = processContent(right)
+            }
+        })
+        .catch(error => console.error('Error:', error));
+
+    // fetch the neighbouring chunks in the background, so scrubbing does not wait for them
+    const start = version - version % chunkSize;
+    for (const neighbour of [start - chunkSize, start + chunkSize]) {
+        if (0 <= neighbour && neighbour <= nVersions) {
+            loadChunk(neighbour).catch(() => {});
+        }
+    }
+}
+
+function getSnapshot(i) {
+    return loadChunk(i - i % chunkSize).then(chunk => chunk[i % chunkSize]);
+}
+
+function loadChunk(start) {
+    if (!(start in chunks)) {
+        chunks[start] = fetch(`/api/history/chunk?response=${historyResponse}&start=${start}`)
+            .then(response => response.json())
+            .then(data => decodeChunk(data))
+            .catch(error => {
+                delete chunks[start];
+                throw error;
+            });
+    }
+
+    return chunks[start];
+}
+
+/**
+ * Apply the deltas of a chunk to its base, and colour the phrases of every snapshot
+ * @param data the chunk
+ * @returns {*[]} the content of every snapshot in the chunk, null for snapshots without content
+ */
+function decodeChunk(data) {
+    const out = [];
+    let previous = data["base"];
+
+    for (let i = 0; i < data["deltas"].length; i++) {
+        const delta = data["deltas"][i];
+        if (delta === null) {
+            out.push(null);
+            continue;
+        }
+
+        previous = previous.slice(0, delta[0]) + delta[2] + previous.slice(previous.length - delta[1]);
+
+        const factorization = data["factorizations"] === null ? null : data["factorizations"][i];
+        out.push(factorization && factorization.length > 0 ? colorPhrases(previous, factorization) : previous);
+    }
+
+    return out;
+}
+
+/**
+ * Colour the phrases of a snapshot, every phrase gets the next colour and characters without a match are red
+ * @param text the text of the snapshot
+ * @param factorization the length of every phrase, in characters
+ * @returns {string} the text as html
+ */
+function colorPhrases(text, factorization) {
+    const matchColor = [' #85c1e9', ' #f9e79f', ' #abebc6'];
+    const characters = Array.from(text);
+    let i = 0;
+    let c = 0;
+    let out = "<p>";
+
+    for (const length of factorization) {
+        const j = Math.max(length, 1);
+        let color;
+        if (length === 0) {
+            color = ' #f1948a';
+        } else {
+            color = matchColor[c];
+            c = (c + 1) % matchColor.length;
+        }
+
+        out += `<span style='background-color:${color}'>${characters.slice(i, i + j).join("")}</span>`;
+        i += j;
+    }
+
+    if (i < characters.length) {
+        out += `<span style='background-color:#f1948a'>${characters.slice(i).join("")}</span>`;
+    }
+
+    return out + "</p>";
+}
+
 /**
  * Make null values explicit
  * @param content the content
@@ -31,18 +31,19 @@ function processInfo(data) {
 
     fetchHistory()
 
+	// The histograms are only sent when the active set changed, otherwise the plots are kept
 	// Plot of the number of versions
-    if (data['num_versions'] === undefined || data['num_versions'] === "unavailable") {
+    if (data['num_versions'] === "unavailable") {
         document.getElementById("box_plot_div").innerHTML = "Histogram of number of submitted versions unavailable"
-	} else {
+	} else if (data['num_versions'] !== undefined) {
 		document.getElementById("box_plot_div").innerHTML = ""
 		renderHistogram(data['num_versions'], "box_plot_div", "#versions for " + document.getElementById("eidSelect").value + " #" + document.getElementById("qidSelect").selectedIndex)
 	}
 
-	// Plot of the number of versions
-    if (data['all_max_edit_distances'] === undefined || data['all_max_edit_distances'] === "unavailable") {
+	// Plot of the maximum edit distances
+    if (data['all_max_edit_distances'] === "unavailable") {
         document.getElementById("ed_histogram_div").innerHTML = "Histogram of maximum edit distances unavailable"
-	} else {
+	} else if (data['all_max_edit_distances'] !== undefined) {
 		document.getElementById("ed_histogram_div").innerHTML = ""
 		renderHistogram(data['all_max_edit_distances'], "ed_histogram_div", "max. edit distances for " + document.getElementById("eidSelect").value + " #" + document.getElementById("qidSelect").selectedIndex)
 	}
@@ -140,6 +141,12 @@ function stripHTML(select) {
     })
 }
 
+function sortResponses(select) {
+    simplePost("/api/sort", processSpecificResponse, {
+        "value": select.value
+    })
+}
+
 function simplePost(endpoint, processFunc, dict) {
     fetch(endpoint,
     {
@@ -179,8 +179,9 @@ function recheck() {
 }
 
 function processRecheck(data) {
-    document.getElementById("recheck_div").innerHTML = data.status ? "All responses have been processed" : "Some responses have not been processed. They are being computed now!";
-    if (data.status) {
+    const active = data.jobs.queued + data.jobs.running;
+    document.getElementById("recheck_div").innerHTML = data.status ? "All responses have been processed" : `Some responses have not been processed. They are being computed now! (${active} jobs queued or running)`;
+    if (data.status || active === 0) {
         document.getElementById("recheckBtn").disabled = false;
     }
 }